@@ -0,0 +1,56 @@
+"""Compare `/artworks` throughput with and without the shared Postgres connection pool.
+
+Needs the usual backend environment and a reachable Postgres. Run from `packages/backend`:
+
+    uv run python -m benchmarks.artworks_pool --requests 2000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+
+import httpx
+import server
+from server import migrations, pg
+
+from .utils import run_load
+
+
+async def bench(requests: int, concurrency: int) -> None:
+    await migrations.run()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def request() -> None:
+            r = await client.get("/artworks")
+            r.raise_for_status()
+
+        # Warm up imports, the pool and Postgres' caches before measuring
+        await run_load("warmup", request, requests=concurrency, concurrency=concurrency)
+        unpooled = await run_load("/artworks (connection per request)", request, requests, concurrency)
+
+        await pg.open_pool()
+        try:
+            await run_load("warmup", request, requests=concurrency, concurrency=concurrency)
+            pooled = await run_load("/artworks (pooled)", request, requests, concurrency)
+            stats = pg.get_pool_stats()
+        finally:
+            await pg.close_pool()
+
+    print(unpooled.summary())
+    print(pooled.summary())
+    print(f"speedup: {pooled.rps / unpooled.rps:.2f}x")
+    print(f"pool stats: {stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
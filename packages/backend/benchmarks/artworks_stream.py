@@ -0,0 +1,113 @@
+"""Hold thousands of idle `/artworks/stream` subscribers on a single uvicorn worker and measure its memory.
+
+Starts the backend in a subprocess, so it needs the usual backend environment and a reachable Postgres. Inserts (and
+afterwards deletes) one `github_files` row to time the fan-out. Run from `packages/backend`:
+
+    uv run python -m benchmarks.artworks_stream --subscribers 10000
+"""
+
+import argparse
+import asyncio
+import resource
+import sys
+import time
+
+import httpx
+from server import pg
+
+from .utils import get_rss, wait_until_healthy
+
+BENCH_USERNAME = "hhh-benchmark"
+
+
+def raise_open_files_limit() -> None:
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Subscriber:
+    def __init__(self) -> None:
+        self.received = asyncio.Event()
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def connect(self, port: int) -> None:
+        reader, self._writer = await asyncio.open_connection("127.0.0.1", port)
+        self._writer.write(b"GET /artworks/stream HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+        await self._writer.drain()
+        # Wait until the `retry:` preamble arrives, the subscription is registered before that is sent
+        buffer = b""
+        while b"retry:" not in buffer:
+            buffer += await reader.read(4096)
+        asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        while chunk := await reader.read(4096):
+            if b"event: artworks" in chunk:
+                self.received.set()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+async def bench(n_subscribers: int, port: int, hold: float) -> None:
+    raise_open_files_limit()
+    server_process = await asyncio.create_subprocess_exec(
+        *(sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--backlog", "4096"),
+        *("--log-level", "warning", "--timeout-graceful-shutdown", "5"),
+    )
+    subscribers = [Subscriber() for _ in range(n_subscribers)]
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            await wait_until_healthy(client)
+            baseline_rss = get_rss(server_process.pid)
+
+            start = time.perf_counter()
+            semaphore = asyncio.Semaphore(500)
+
+            async def connect(subscriber: Subscriber) -> None:
+                async with semaphore:
+                    await subscriber.connect(port)
+
+            await asyncio.gather(*(connect(subscriber) for subscriber in subscribers))
+            print(f"connected {n_subscribers} subscribers in {time.perf_counter() - start:.2f} s")
+
+            r = await client.get("/health")
+            print(f"subscribers registered by the backend: {r.json()['stream_subscribers']}")
+
+            connected_rss = get_rss(server_process.pid)
+            print(f"backend RSS idle:      {baseline_rss / 2**20:8.1f} MiB")
+            print(f"backend RSS connected: {connected_rss / 2**20:8.1f} MiB")
+            print(f"per subscriber:        {(connected_rss - baseline_rss) / n_subscribers / 1024:8.1f} KiB")
+
+            await asyncio.sleep(hold)
+            print(f"backend RSS after {hold:.0f} s idle: {get_rss(server_process.pid) / 2**20:8.1f} MiB")
+
+            start = time.perf_counter()
+            await pg.github_files_insert_row(BENCH_USERNAME, "hhh-benchmark.webp", "0" * 40)
+            await asyncio.gather(*(subscriber.received.wait() for subscriber in subscribers))
+            print(f"fan-out of one artwork to all subscribers: {(time.perf_counter() - start) * 1000:.1f} ms")
+            print(f"backend RSS after fan-out: {get_rss(server_process.pid) / 2**20:8.1f} MiB")
+    finally:
+        for subscriber in subscribers:
+            subscriber.close()
+        server_process.terminate()
+        await server_process.wait()
+
+        async with pg.connection() as conn:
+            await conn.execute("DELETE FROM github_files WHERE github_username = %s", (BENCH_USERNAME,))
+            await conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--hold", type=float, default=20, help="seconds to keep subscribers idle before publishing")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.subscribers, args.port, args.hold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare the wall time and peak memory of committing large images through the Contents and the Git Data API.
+
+Runs the fake GitHub from `fake_github` in a process of its own and each commit API in a fresh process, so the peak
+resident set size only covers the client side of the uploads. Needs the usual backend environment. Linux only. Run
+from `packages/backend`:
+
+    uv run python -m benchmarks.commit_engines --size-mib 5 --commits 10 --rtt 0.03
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from server import env, gh
+
+from .fake_github import FAKE_FORK, FAKE_USER
+from .utils import get_rss, reset_peak_rss, run_load
+
+COMMIT_APIS = ["contents", "git-data"]
+
+
+async def commit(file_content: bytes) -> None:
+    await gh.commit_and_create_pull_request(
+        root_app_installation_token="ghs_benchmark",
+        app_installation_token="ghs_benchmark",
+        fork_owner=FAKE_USER,
+        fork_name=FAKE_FORK,
+        new_branch="benchmark",
+        files={"benchmark.webp": file_content},
+        pr_title="Publish benchmark.webp",
+    )
+
+
+async def bench_commit_api(size: int, commits: int, concurrency: int) -> None:
+    """Measure the commit API this process is configured with."""
+    file_content = os.urandom(size)
+
+    # Connect, and fill the caches of both the client and the interpreter, before measuring
+    await commit(b"warm up")
+    reset_peak_rss()
+    baseline_rss = get_rss()
+
+    result = await run_load(env.GITHUB_COMMIT_API, lambda: commit(file_content), commits, concurrency)
+    peak_rss = get_rss(field="VmHWM") - baseline_rss
+    await gh.close_client()
+
+    print(f"{result.summary()}  peak RSS growth {peak_rss / 2**20:6.1f} MiB", flush=True)
+
+
+async def bench(size: int, commits: int, concurrency: int, rtt: float) -> None:
+    fake_process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "benchmarks.fake_github",
+        "--upstream-owner",
+        env.GIT_UPSTREAM_OWNER,
+        "--upstream-repo",
+        env.GIT_UPSTREAM_REPO,
+        "--rtt",
+        str(rtt),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        assert fake_process.stdout is not None  # noqa: S101
+        fake = json.loads(await fake_process.stdout.readline())
+
+        print(f"{size / 2**20:.1f} MiB images, {commits} commits, concurrency {concurrency}, RTT {rtt * 1000:.0f} ms")
+        for commit_api in COMMIT_APIS:
+            bench_process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "benchmarks.commit_engines",
+                "--size-mib",
+                str(size / 2**20),
+                "--commits",
+                str(commits),
+                "--concurrency",
+                str(concurrency),
+                "--measure-this-process",
+                env={
+                    **os.environ,
+                    "GITHUB_API_URL": fake["base_url"],
+                    "SSL_CERT_FILE": fake["cert_file"],
+                    "GITHUB_COMMIT_API": commit_api,
+                },
+            )
+            await bench_process.wait()
+    finally:
+        fake_process.terminate()
+        await fake_process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mib", type=float, default=5)
+    parser.add_argument("--commits", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--rtt", type=float, default=0.03, help="simulated round-trip time in seconds")
+    parser.add_argument("--measure-this-process", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    size = int(args.size_mib * 2**20)
+    if args.measure_this_process:
+        asyncio.run(bench_commit_api(size, args.commits, args.concurrency))
+    else:
+        asyncio.run(bench(size, args.commits, args.concurrency, args.rtt))
+
+
+if __name__ == "__main__":
+    main()
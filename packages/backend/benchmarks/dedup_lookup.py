@@ -0,0 +1,84 @@
+"""Measure near-duplicate lookups in `server.dedup.HashIndex` with a million stored perceptual hashes.
+
+Uniformly random hashes are the best case for multi-index hashing. Real artworks cluster, many canvases are mostly
+blank, so the index is also filled with hashes a few bits away from a small set of common ones. Run from
+`packages/backend`:
+
+    uv run python -m benchmarks.dedup_lookup --hashes 1000000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections.abc import Callable
+
+from server.dedup import HASH_BITS, HashIndex
+
+
+def flip_bits(rng: random.Random, value: int, n_bits: int) -> int:
+    for bit in rng.sample(range(HASH_BITS), n_bits):
+        value ^= 1 << bit
+    return value
+
+
+def random_hashes(rng: random.Random, n: int) -> list[int]:
+    return [rng.getrandbits(HASH_BITS) for _ in range(n)]
+
+
+def clustered_hashes(rng: random.Random, n: int) -> list[int]:
+    """Half of the hashes near one of 1000 common ones, the other half random."""
+    common = random_hashes(rng, 1000)
+    hashes = [flip_bits(rng, rng.choice(common), rng.randrange(6, 16)) for _ in range(n // 2)]
+    return hashes + random_hashes(rng, n - len(hashes))
+
+
+def time_lookups(index: HashIndex, queries: list[int]) -> list[float]:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        index.find(query)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hashes", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--distances", type=int, nargs="+", default=[0, 4, 8])
+    parser.add_argument("--seed", type=int, default=16)
+    args = parser.parse_args()
+
+    distributions: dict[str, Callable[[random.Random, int], list[int]]] = {
+        "random": random_hashes,
+        "clustered": clustered_hashes,
+    }
+    for name, generate in distributions.items():
+        rng = random.Random(args.seed)
+        hashes = generate(rng, args.hashes)
+
+        for distance in args.distances:
+            index = HashIndex(distance)
+            start = time.perf_counter()
+            for row_id, value in enumerate(hashes):
+                index.add(value, row_id)
+            build_time = time.perf_counter() - start
+
+            # Half are near a stored hash and should be found, the other half are new artworks
+            near = [flip_bits(rng, rng.choice(hashes), rng.randint(0, distance)) for _ in range(args.queries // 2)]
+            new = random_hashes(rng, args.queries - len(near))
+            found = sum(index.find(query) is not None for query in near)
+
+            times = sorted(time_lookups(index, near + new))
+            p50 = statistics.median(times)
+            p99 = times[int(len(times) * 0.99)]
+            print(
+                f"{name:<9} {len(index)} hashes, distance {distance}:  built in {build_time:5.1f} s  "
+                f"lookup p50 {p50 * 1e6:7.1f} us  p99 {p99 * 1e6:7.1f} us  max {times[-1] * 1e6:7.1f} us  "
+                f"found {found}/{len(near)} near copies"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Load-test the backend end to end, with `fake_github` and `fake_gotrue` standing in for GitHub and Supabase Auth.
+
+The backend runs as a uvicorn worker of its own and the fakes each in a process of their own too, all on this machine.
+Both fakes add the same simulated round-trip time and can fail a share of their requests with 502s. Every scenario is
+driven at the same concurrency:
+
+- `publish`: `/publish` of a new random image each time, until its job is done. The latency of the upload alone is
+  reported as `publish (enqueue)`.
+- `status`: `/status` with the fake user's session cookies
+- `artworks`: `/artworks`, the first page of the gallery
+- `verify_pr`: `/verify_pr` for artworks published during the run and made-up ones
+
+Results go to stdout, and with `--output` are appended as JSON lines labelled with the current commit, so runs at
+different commits can be compared. Random images and queries are seeded. Needs the usual backend environment and a
+scratch Postgres: the installation sync replaces `github_installations` with the fake's. Run from `packages/backend`:
+
+    uv run python -m benchmarks.end_to_end --requests 1000 --publishes 100 --concurrency 20 --rtt 0.03
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+import httpx
+from PIL import Image
+from server import env, migrations, pg, sb
+
+from .fake_github import FAKE_USER
+from .utils import LoadResult, run_load, wait_until_healthy
+
+SCENARIOS = ("publish", "status", "artworks", "verify_pr")
+JOB_POLL_INTERVAL = 0.05
+JOB_TIMEOUT = 120.0
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],  # noqa: S607
+            capture_output=True,
+            check=True,
+            cwd=Path(__file__).parent,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def random_png(rng: random.Random, size: int = 64) -> bytes:
+    image = Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def start_fake(module: str, *args: str) -> tuple[asyncio.subprocess.Process, dict[str, Any]]:
+    process = await asyncio.create_subprocess_exec(
+        *(sys.executable, "-m", module, *args),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    assert process.stdout is not None  # noqa: S101
+    return process, json.loads(await process.stdout.readline())
+
+
+class Scenarios:
+    def __init__(self, client: httpx.AsyncClient, session: dict[str, Any], seed: int, image_size: int) -> None:
+        self.client = client
+        self.image_size = image_size
+        self.cookies = {
+            sb.ACCESS_TOKEN_COOKIE_KEY: session["access_token"],
+            sb.REFRESH_TOKEN_COOKIE_KEY: session["refresh_token"],
+        }
+        self.rng = random.Random(seed)
+        # File names and commit hashes published by the `publish` scenario, `verify_pr` asks for these half the time
+        self.published: list[tuple[str, str]] = []
+        self.enqueue_latencies: list[float] = []
+        self.enqueue_errors = 0
+
+    async def load_published(self) -> None:
+        async with pg.connection() as conn:
+            cur = await conn.execute(
+                "SELECT filename, commit_hash FROM github_files WHERE github_username = %s", (FAKE_USER,)
+            )
+            self.published = [(filename.rstrip(), commit_hash) for filename, commit_hash in await cur.fetchall()]
+
+    async def status(self) -> None:
+        r = await self.client.get("/status", cookies=self.cookies)
+        r.raise_for_status()
+        if not r.json()["logged_in"]:
+            raise RuntimeError("Not logged in")
+
+    async def artworks(self) -> None:
+        r = await self.client.get("/artworks")
+        r.raise_for_status()
+
+    async def verify_pr(self) -> None:
+        if self.published and self.rng.random() < 0.5:
+            filename, commit_hash = self.rng.choice(self.published)
+        else:
+            filename, commit_hash = f"{self.rng.randbytes(8).hex()}.webp", self.rng.randbytes(20).hex()
+
+        r = await self.client.get("/verify_pr", params={"filename": filename, "commit_hash": commit_hash})
+        r.raise_for_status()
+
+    async def publish(self) -> None:
+        start = time.perf_counter()
+        try:
+            r = await self.client.post(
+                "/publish",
+                cookies=self.cookies,
+                files={"image": ("artwork.png", random_png(self.rng, self.image_size), "image/png")},
+            )
+            r.raise_for_status()
+        except httpx.HTTPError:
+            self.enqueue_errors += 1
+            raise
+        self.enqueue_latencies.append(time.perf_counter() - start)
+
+        job_id = r.json()["job_id"]
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            r = await self.client.get(f"/publish/{job_id}")
+            r.raise_for_status()
+            job = r.json()
+            if job["status"] == "succeeded":
+                return
+            if job["status"] == "failed":
+                raise RuntimeError(f"Publish failed: {job['error']}")
+
+        raise TimeoutError("Publish job did not finish")
+
+
+async def cleanup() -> None:
+    async with pg.connection() as conn:
+        for table in ("github_files", "publish_jobs", "publish_rate_limits"):
+            await conn.execute(f"DELETE FROM {table} WHERE github_username = %s", (FAKE_USER,))  # noqa: S608
+        await conn.commit()
+
+
+def report(result: LoadResult, output: Path | None, parameters: dict[str, Any]) -> None:
+    print(result.summary(), flush=True)
+    if output is None:
+        return
+
+    record = {
+        **parameters,
+        "scenario": result.label,
+        "requests": result.requests,
+        "errors": result.errors,
+        "rps": round(result.rps, 1),
+        "p50_ms": round(result.percentile(50), 2),
+        "p95_ms": round(result.percentile(95), 2),
+        "p99_ms": round(result.percentile(99), 2),
+    }
+    with output.open("a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+async def bench(args: argparse.Namespace) -> None:
+    fake_args = ("--rtt", str(args.rtt), "--error-rate", str(args.error_rate))
+    github_process, github = await start_fake(
+        "benchmarks.fake_github",
+        *("--upstream-owner", env.GIT_UPSTREAM_OWNER, "--upstream-repo", env.GIT_UPSTREAM_REPO),
+        *("--token-lifetime", "60" if args.cold_tokens else "3600"),
+        *fake_args,
+    )
+    gotrue_process, gotrue = await start_fake("benchmarks.fake_gotrue", "--user", FAKE_USER, *fake_args)
+    processes = [github_process, gotrue_process]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Both fakes have a certificate of their own, httpx only reads one file
+        cert_bundle = Path(directory) / "certificates.pem"
+        cert_bundle.write_text(Path(github["cert_file"]).read_text() + Path(gotrue["cert_file"]).read_text())
+
+        backend_process = await asyncio.create_subprocess_exec(
+            *(sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--log-level", "warning"),
+            env={
+                **os.environ,
+                "GITHUB_API_URL": github["base_url"],
+                "SUPABASE_INTERNAL_URL": gotrue["base_url"],
+                "SUPABASE_PUBLIC_URL": gotrue["base_url"],
+                "SSL_CERT_FILE": str(cert_bundle),
+                # Every publish is by the same user, and a new random image
+                "PUBLISH_RATE_LIMIT": str(10**9),
+                "ARTWORK_NEAR_DUPLICATE_DISTANCE": "-1",
+            },
+        )
+        processes.append(backend_process)
+
+        try:
+            # The backend migrates too, but it may not have yet, and a fresh database has no tables to clean up
+            await migrations.run()
+            await pg.open_pool()
+            await cleanup()
+            limits = httpx.Limits(max_connections=args.concurrency * 2)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits) as client:
+                await wait_until_healthy(client)
+                # The installation sync starts with the backend, publishes fail with a 404 until it has run once
+                for _ in range(100):
+                    if await pg.github_installations_get(FAKE_USER) is not None:
+                        break
+                    await asyncio.sleep(0.1)
+
+                scenarios = Scenarios(client, gotrue["session"], args.seed, args.image_size)
+                parameters = {
+                    "commit": get_commit(),
+                    "concurrency": args.concurrency,
+                    "rtt": args.rtt,
+                    "error_rate": args.error_rate,
+                    "cold_tokens": args.cold_tokens,
+                }
+                print(
+                    f"{parameters['commit']}: concurrency {args.concurrency}, RTT {args.rtt * 1000:.0f} ms, "
+                    f"{args.error_rate:.0%} upstream errors"
+                )
+
+                for name in sorted(args.scenarios, key=SCENARIOS.index):
+                    if name == "verify_pr":
+                        await scenarios.load_published()
+                    request: Callable[[], Awaitable[None]] = getattr(scenarios, name)
+                    requests = args.publishes if name == "publish" else args.requests
+                    # Warm up connections and caches, like in a server that has been running for a while
+                    await run_load(name, request, min(requests, args.concurrency), args.concurrency)
+                    scenarios.enqueue_latencies.clear()
+                    scenarios.enqueue_errors = 0
+
+                    result = await run_load(name, request, requests, args.concurrency)
+                    report(result, args.output, parameters)
+                    if name == "publish":
+                        enqueue = LoadResult(
+                            label="publish (enqueue)",
+                            requests=requests,
+                            errors=scenarios.enqueue_errors,
+                            elapsed=result.elapsed,
+                            latencies=scenarios.enqueue_latencies,
+                        )
+                        report(enqueue, args.output, parameters)
+        finally:
+            for process in processes:
+                process.terminate()
+                await process.wait()
+            try:
+                await cleanup()
+            finally:
+                await pg.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario, except publish")
+    parser.add_argument("--publishes", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=64, help="width and height of published images")
+    parser.add_argument("--rtt", type=float, default=0.03, help="simulated round-trip time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream requests failing with 502")
+    parser.add_argument("--cold-tokens", action="store_true", help="mint GitHub installation tokens for every publish")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=9110)
+    parser.add_argument("--output", type=Path, help="append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""An in-process stand-in for the parts of the GitHub REST API used by `server.gh`.
+
+It is served over TLS with a throwaway self-signed certificate behind a TCP proxy that delays traffic by a configurable
+round-trip time, so connection setup costs roughly what it would against api.github.com.
+
+To keep its memory out of a measurement, run it in a process of its own. It prints its base URL and certificate:
+
+    uv run python -m benchmarks.fake_github --rtt 0.03
+"""
+
+import argparse
+import asyncio
+import base64
+import datetime
+import hashlib
+import ipaddress
+import itertools
+import json
+import math
+import os
+import random
+import secrets
+import tempfile
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any
+
+import uvicorn
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+FAKE_USER = "hhh-benchmark-user"
+FAKE_FORK = "HHH"
+FAKE_INSTALLATION_ID = 1000
+
+
+def create_app(upstream_owner: str, upstream_repo: str, error_rate: float = 0.0) -> FastAPI:  # noqa: C901
+    """Create the fake API, answering a random `error_rate` share of requests with a 502 instead.
+
+    With `app.state.rate_limit` set, responses carry GitHub's `X-RateLimit-*` headers and requests over the limit get
+    the 403 GitHub answers with.
+    """
+    app = FastAPI()
+    app.state.requests = 0
+    app.state.error_rate = error_rate
+    # Below `server.gh.TOKEN_EXPIRY_MARGIN`, installation tokens are never reused, as if every publish was a first
+    app.state.token_lifetime = 3600
+    app.state.errors = 0
+    # Requests allowed per `Authorization` header and window, like GitHub's primary rate limit, `None` for no limit
+    app.state.rate_limit = None
+    app.state.rate_limit_window = 60.0
+    app.state.rate_limited = 0
+    # Per `Authorization` header, when the current window resets and the requests made in it
+    rate_limit_windows: dict[str, tuple[float, int]] = {}
+    rng = random.Random(0)
+    # Tests may append more, e.g. to page through many forks
+    app.state.forks = [{"name": FAKE_FORK, "full_name": f"{FAKE_USER}/{FAKE_FORK}", "fork": True}]
+    commit_counter = itertools.count()
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next: Any) -> Any:
+        app.state.requests += 1
+        if app.state.error_rate and rng.random() < app.state.error_rate:
+            app.state.errors += 1
+            return JSONResponse({"message": "Server Error"}, status_code=502)
+        if app.state.rate_limit is None:
+            return await call_next(request)
+
+        now = time.time()
+        authorization = request.headers.get("Authorization", "")
+        reset_at, used = rate_limit_windows.get(authorization, (0.0, 0))
+        if reset_at <= now:
+            reset_at, used = float(math.ceil(now + app.state.rate_limit_window)), 0
+        remaining = app.state.rate_limit - used
+        headers = {
+            "X-RateLimit-Limit": str(app.state.rate_limit),
+            "X-RateLimit-Remaining": str(max(remaining - 1, 0)),
+            "X-RateLimit-Reset": str(int(reset_at)),
+        }
+        if remaining <= 0:
+            app.state.rate_limited += 1
+            return JSONResponse({"message": "API rate limit exceeded"}, status_code=403, headers=headers)
+
+        rate_limit_windows[authorization] = (reset_at, used + 1)
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
+
+    @app.get("/app/installations")
+    async def installations() -> list[dict[str, Any]]:
+        return [{"id": FAKE_INSTALLATION_ID, "account": {"login": FAKE_USER}}]
+
+    @app.post("/app/installations/{installation_id}/access_tokens", status_code=201)
+    async def access_token(installation_id: int) -> dict[str, Any]:
+        expires_at = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=app.state.token_lifetime)
+        return {"token": f"ghs_{secrets.token_hex(18)}", "expires_at": expires_at.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+    @app.get("/installation/repositories")
+    async def installation_repositories() -> dict[str, Any]:
+        repository = {"name": FAKE_FORK, "full_name": f"{FAKE_USER}/{FAKE_FORK}", "fork": True}
+        return {"total_count": 1, "repositories": [repository]}
+
+    @app.get(f"/repos/{upstream_owner}/{upstream_repo}/forks")
+    async def forks(request: Request, page: int = 1, per_page: int = 30) -> Response:
+        start = (page - 1) * per_page
+        body = json.dumps(app.state.forks[start : start + per_page]).encode()
+        headers = {"ETag": f'"{hashlib.sha256(body).hexdigest()}"'}
+        if start + per_page < len(app.state.forks):
+            next_url = request.url.include_query_params(page=page + 1)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+
+        if request.headers.get("If-None-Match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+
+        return Response(body, media_type="application/json", headers=headers)
+
+    @app.post("/repos/{owner}/{repo}/git/blobs", status_code=201)
+    async def create_blob(owner: str, repo: str, request: Request) -> dict[str, Any]:
+        body = await request.json()
+        content = base64.b64decode(body["content"])
+        return {"sha": hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()}
+
+    @app.get("/repos/{owner}/{repo}/git/commits/{sha}")
+    async def get_commit(owner: str, repo: str, sha: str) -> dict[str, Any]:
+        return {"sha": sha, "tree": {"sha": hashlib.sha1(sha.encode()).hexdigest()}}
+
+    @app.post("/repos/{owner}/{repo}/git/trees", status_code=201)
+    async def create_tree(owner: str, repo: str, request: Request) -> dict[str, Any]:
+        body = await request.json()
+        return {"sha": hashlib.sha1(json.dumps(body).encode()).hexdigest()}
+
+    @app.post("/repos/{owner}/{repo}/git/commits", status_code=201)
+    async def create_commit(owner: str, repo: str) -> dict[str, Any]:
+        return {"sha": f"{next(commit_counter):040x}"}
+
+    @app.post("/repos/{owner}/{repo}/git/refs", status_code=201)
+    async def create_ref(owner: str, repo: str, request: Request) -> dict[str, Any]:
+        body = await request.json()
+        return {"ref": body["ref"], "object": {"sha": body["sha"], "type": "commit"}}
+
+    @app.put("/repos/{owner}/{repo}/contents/{path:path}", status_code=201)
+    async def put_contents(owner: str, repo: str, path: str, request: Request) -> dict[str, Any]:
+        body = await request.json()
+        content = base64.b64decode(body["content"])
+        hashlib.sha1(b"blob %d\0" % len(content) + content)
+        return {"content": {"path": path}, "commit": {"sha": f"{next(commit_counter):040x}"}}
+
+    @app.post(f"/repos/{upstream_owner}/{upstream_repo}/pulls", status_code=201)
+    async def create_pull(request: Request) -> JSONResponse:
+        body = await request.json()
+        return JSONResponse({"number": 1, "title": body["title"]}, status_code=201)
+
+    return app
+
+
+def write_self_signed_certificate(directory: Path) -> tuple[Path, Path]:
+    """Write a certificate and key valid for 127.0.0.1 and localhost, returning their paths."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    # A unique subject, OpenSSL would only try the first of several certificates with the same one in a bundle
+    name = x509.Name(
+        [
+            x509.NameAttribute(NameOID.COMMON_NAME, "localhost"),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, f"hhh-benchmark-{secrets.token_hex(4)}"),
+        ]
+    )
+    alternative_names = [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+    now = datetime.datetime.now(datetime.UTC)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName(alternative_names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = directory / "cert.pem"
+    key_path = directory / "key.pem"
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return cert_path, key_path
+
+
+async def _pipe_with_delay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float) -> None:
+    """Forward bytes one way, each chunk arriving `delay` seconds after it was sent, like over a slow link."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[tuple[float, bytes]] = asyncio.Queue()
+
+    async def deliver() -> None:
+        while True:
+            deadline, data = await queue.get()
+            if (remaining := deadline - loop.time()) > 0:
+                await asyncio.sleep(remaining)
+            if not data:
+                writer.close()
+                return
+            writer.write(data)
+            await writer.drain()
+
+    delivery = asyncio.create_task(deliver())
+    try:
+        while True:
+            data = await reader.read(65536)
+            queue.put_nowait((loop.time() + delay, data))
+            if not data:
+                break
+        await delivery
+    except ConnectionError:
+        delivery.cancel()
+        writer.close()
+
+
+async def start_latency_proxy(target_port: int, rtt: float) -> asyncio.Server:
+    async def handle(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", target_port)
+        await asyncio.gather(
+            _pipe_with_delay(client_reader, upstream_writer, rtt / 2),
+            _pipe_with_delay(upstream_reader, client_writer, rtt / 2),
+            return_exceptions=True,
+        )
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+@asynccontextmanager
+async def run_fake_github(
+    upstream_owner: str, upstream_repo: str, rtt: float = 0.0, error_rate: float = 0.0
+) -> AsyncIterator[FastAPI]:
+    """Serve the fake GitHub API in the background, and point HTTPS clients created inside this block at it.
+
+    The base URL is available as `app.state.base_url` and the number of requests served as `app.state.requests`.
+    """
+    app = create_app(upstream_owner, upstream_repo, error_rate)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = write_self_signed_certificate(Path(directory))
+        config = uvicorn.Config(
+            app,
+            host="127.0.0.1",
+            port=0,
+            ssl_certfile=cert_path,
+            ssl_keyfile=key_path,
+            log_level="warning",
+            lifespan="off",
+        )
+        server = uvicorn.Server(config)
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        port = server.servers[0].sockets[0].getsockname()[1]
+        proxy = await start_latency_proxy(port, rtt)
+        proxy_port = proxy.sockets[0].getsockname()[1]
+        app.state.base_url = f"https://127.0.0.1:{proxy_port}"
+
+        # httpx reads this when a client is created, so our certificate is trusted by `server.gh`
+        previous_cert_file = os.environ.get("SSL_CERT_FILE")
+        os.environ["SSL_CERT_FILE"] = str(cert_path)
+        try:
+            yield app
+        finally:
+            if previous_cert_file is None:
+                del os.environ["SSL_CERT_FILE"]
+            else:
+                os.environ["SSL_CERT_FILE"] = previous_cert_file
+
+            proxy.close()
+            server.should_exit = True
+            await serve_task
+
+
+async def serve_forever(
+    upstream_owner: str, upstream_repo: str, rtt: float, error_rate: float, token_lifetime: int, rate_limit: int | None
+) -> None:
+    async with run_fake_github(upstream_owner, upstream_repo, rtt=rtt, error_rate=error_rate) as app:
+        app.state.token_lifetime = token_lifetime
+        app.state.rate_limit = rate_limit
+        print(json.dumps({"base_url": app.state.base_url, "cert_file": os.environ["SSL_CERT_FILE"]}), flush=True)
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--upstream-owner", default="heavenly-hostas-hosting")
+    parser.add_argument("--upstream-repo", default="HHH")
+    parser.add_argument("--rtt", type=float, default=0.0, help="simulated round-trip time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 502")
+    parser.add_argument("--token-lifetime", type=int, default=3600, help="seconds installation tokens are valid")
+    parser.add_argument("--rate-limit", type=int, help="requests allowed per token and minute, unlimited by default")
+    args = parser.parse_args()
+
+    asyncio.run(
+        serve_forever(
+            args.upstream_owner, args.upstream_repo, args.rtt, args.error_rate, args.token_lifetime, args.rate_limit
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""An in-process stand-in for the parts of Supabase Auth (GoTrue) used by `server.sb`.
+
+Users are made up on the fly: `issue_session` signs an access token for any GitHub username with the backend's
+`JWT_SECRET`, and every endpoint accepts the tokens it issued. Like `fake_github`, it is served over TLS behind a proxy
+adding a configurable round-trip time.
+
+To keep it out of a measurement, run it in a process of its own. It prints its base URL, certificate and a session:
+
+    uv run python -m benchmarks.fake_gotrue --rtt 0.02 --user hhh-benchmark-user
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import secrets
+import tempfile
+import time
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Annotated, Any
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from server import env
+
+from .fake_github import start_latency_proxy, write_self_signed_certificate
+
+ACCESS_TOKEN_LIFETIME = 3600
+
+
+def _user_id(user_name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"https://github.com/{user_name}"))
+
+
+def _user(user_name: str) -> dict[str, Any]:
+    user_id = _user_id(user_name)
+    created_at = datetime.datetime(2025, 7, 1, tzinfo=datetime.UTC).isoformat()
+    return {
+        "id": user_id,
+        "aud": "authenticated",
+        "role": "authenticated",
+        "app_metadata": {"provider": "github", "providers": ["github"]},
+        "user_metadata": {"user_name": user_name},
+        "created_at": created_at,
+        "identities": [
+            {
+                "id": user_id,
+                "identity_id": user_id,
+                "user_id": user_id,
+                "identity_data": {"user_name": user_name},
+                "provider": "github",
+                "created_at": created_at,
+            }
+        ],
+    }
+
+
+def issue_session(app: FastAPI, user_name: str, lifetime: int = ACCESS_TOKEN_LIFETIME) -> dict[str, Any]:
+    """Sign in `user_name`, returning a session like GoTrue's token endpoint does."""
+    expires_at = int(time.time()) + lifetime
+    claims = {
+        "sub": _user_id(user_name),
+        "aud": "authenticated",
+        "role": "authenticated",
+        "iat": expires_at - lifetime,
+        "exp": expires_at,
+        "app_metadata": {"provider": "github", "providers": ["github"]},
+        "user_metadata": {"user_name": user_name},
+    }
+    refresh_token = secrets.token_urlsafe(16)
+    app.state.refresh_tokens[refresh_token] = user_name
+    return {
+        "access_token": jwt.encode(claims, app.state.jwt_secret, algorithm="HS256"),
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": lifetime,
+        "expires_at": expires_at,
+        "user": _user(user_name),
+    }
+
+
+def create_app(jwt_secret: str, error_rate: float = 0.0) -> FastAPI:  # noqa: C901
+    """Create the fake API, answering a random `error_rate` share of requests with a 502 instead."""
+    app = FastAPI()
+    app.state.jwt_secret = jwt_secret
+    app.state.requests = 0
+    app.state.error_rate = error_rate
+    app.state.errors = 0
+    rng = random.Random(0)
+    app.state.refresh_tokens = {}
+    # Codes handed out by the fake OAuth flow, exchanged for a session of the user they were issued to
+    app.state.auth_codes = {}
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next: Any) -> Any:
+        app.state.requests += 1
+        if app.state.error_rate and rng.random() < app.state.error_rate:
+            app.state.errors += 1
+            return JSONResponse({"message": "Server Error"}, status_code=502)
+        return await call_next(request)
+
+    def authenticate(authorization: str | None) -> str:
+        try:
+            claims = jwt.decode(
+                (authorization or "").removeprefix("Bearer "),
+                app.state.jwt_secret,
+                algorithms=["HS256"],
+                audience="authenticated",
+            )
+        except jwt.InvalidTokenError as e:
+            raise HTTPException(status_code=401, detail="invalid JWT") from e
+        return claims["user_metadata"]["user_name"]
+
+    @app.get("/auth/v1/user")
+    async def user(authorization: Annotated[str | None, Header()] = None) -> dict[str, Any]:
+        return _user(authenticate(authorization))
+
+    @app.post("/auth/v1/token")
+    async def token(request: Request, grant_type: str) -> dict[str, Any]:
+        body = await request.json()
+        if grant_type == "refresh_token":
+            user_name = app.state.refresh_tokens.pop(body.get("refresh_token"), None)
+        elif grant_type == "pkce":
+            user_name = app.state.auth_codes.pop(body.get("auth_code"), None)
+        else:
+            user_name = None
+
+        if user_name is None:
+            raise HTTPException(status_code=400, detail="invalid grant")
+        return issue_session(app, user_name)
+
+    @app.post("/auth/v1/logout", status_code=204)
+    async def logout(authorization: Annotated[str | None, Header()] = None) -> Response:
+        authenticate(authorization)
+        return Response(status_code=204)
+
+    return app
+
+
+@asynccontextmanager
+async def run_fake_gotrue(jwt_secret: str, rtt: float = 0.0, error_rate: float = 0.0) -> AsyncIterator[FastAPI]:
+    """Serve the fake GoTrue in the background, and point HTTPS clients created inside this block at it.
+
+    Supabase clients take `app.state.base_url` as their Supabase URL, the API itself is under `/auth/v1`.
+    """
+    app = create_app(jwt_secret, error_rate)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = write_self_signed_certificate(Path(directory))
+        config = uvicorn.Config(
+            app,
+            host="127.0.0.1",
+            port=0,
+            ssl_certfile=cert_path,
+            ssl_keyfile=key_path,
+            log_level="warning",
+            lifespan="off",
+        )
+        server = uvicorn.Server(config)
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        port = server.servers[0].sockets[0].getsockname()[1]
+        proxy = await start_latency_proxy(port, rtt)
+        proxy_port = proxy.sockets[0].getsockname()[1]
+        app.state.base_url = f"https://127.0.0.1:{proxy_port}"
+
+        previous_cert_file = os.environ.get("SSL_CERT_FILE")
+        os.environ["SSL_CERT_FILE"] = str(cert_path)
+        try:
+            yield app
+        finally:
+            if previous_cert_file is None:
+                del os.environ["SSL_CERT_FILE"]
+            else:
+                os.environ["SSL_CERT_FILE"] = previous_cert_file
+
+            proxy.close()
+            server.should_exit = True
+            await serve_task
+
+
+async def serve_forever(rtt: float, error_rate: float, user_name: str) -> None:
+    async with run_fake_gotrue(env.JWT_SECRET, rtt=rtt, error_rate=error_rate) as app:
+        info = {
+            "base_url": app.state.base_url,
+            "cert_file": os.environ["SSL_CERT_FILE"],
+            "session": issue_session(app, user_name),
+        }
+        print(json.dumps(info), flush=True)
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, default=0.0, help="simulated round-trip time in seconds")
+    parser.add_argument("--user", default="hhh-benchmark-user", help="GitHub username to print a session for")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 502")
+    args = parser.parse_args()
+
+    asyncio.run(serve_forever(args.rtt, args.error_rate, args.user))
+
+
+if __name__ == "__main__":
+    main()
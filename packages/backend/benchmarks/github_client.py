@@ -0,0 +1,89 @@
+"""Measure the GitHub API time of one publish with and without the shared client and the GitHub data caches.
+
+Runs the same sequence of `server.gh` calls as `/publish` against the local fake GitHub from `fake_github`, with a
+simulated network round-trip time. Needs the usual backend environment. Run from `packages/backend`:
+
+    uv run python -m benchmarks.github_client --publishes 50 --rtt 0.03
+"""
+
+import argparse
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from server import env, forks, gh
+
+from .fake_github import FAKE_FORK, FAKE_INSTALLATION_ID, FAKE_USER, run_fake_github
+from .utils import run_load
+
+
+async def publish_github_calls(after_each_call: Callable[[], Awaitable[Any]]) -> None:
+    """Make the GitHub calls of a single publish, calling `after_each_call` after each `gh` function."""
+    app_token = await gh.get_app_token()
+    app_installation_token = await gh.get_app_installation_token(FAKE_INSTALLATION_ID, app_token)
+    await after_each_call()
+    await gh.get_app_installation_repositories(app_installation_token)
+    await after_each_call()
+    root_app_installation_token = await gh.get_app_installation_token(env.GIT_UPSTREAM_APP_INSTALLATION_ID, app_token)
+    await after_each_call()
+    await forks.is_fork(f"{FAKE_USER}/{FAKE_FORK}")
+    await after_each_call()
+    await gh.commit_and_create_pull_request(
+        root_app_installation_token=root_app_installation_token,
+        app_installation_token=app_installation_token,
+        fork_owner=FAKE_USER,
+        fork_name=FAKE_FORK,
+        new_branch="benchmark",
+        files={"benchmark.webp": b"\0" * 200_000},
+        pr_title="Publish benchmark.webp",
+    )
+    await after_each_call()
+
+
+async def nothing() -> None:
+    pass
+
+
+async def cold_publish_github_calls(after_each_call: Callable[[], Awaitable[Any]]) -> None:
+    """Like `publish_github_calls`, but without any of the GitHub data cached between publishes."""
+    gh.clear_token_caches()
+    forks.clear()
+    await publish_github_calls(after_each_call)
+
+
+async def bench(publishes: int, concurrency: int, rtt: float) -> None:
+    async with run_fake_github(env.GIT_UPSTREAM_OWNER, env.GIT_UPSTREAM_REPO, rtt=rtt) as fake:
+        env.GITHUB_API_URL = fake.state.base_url
+        await gh.close_client()
+
+        results = []
+        # Closing the shared client after every call reproduces the old `async with httpx.AsyncClient()` per function
+        for label, publish, after_each_call in [
+            ("client per call, no caches", cold_publish_github_calls, gh.close_client),
+            ("shared client, no caches", cold_publish_github_calls, nothing),
+            ("shared client, caches", publish_github_calls, nothing),
+        ]:
+            fake.state.requests = 0
+            result = await run_load(label, lambda: publish(after_each_call), publishes, concurrency)
+            results.append((result, fake.state.requests / publishes))
+
+        await gh.close_client()
+
+    print(f"simulated RTT {rtt * 1000:.0f} ms")
+    for result, requests_per_publish in results:
+        print(f"{result.summary()}  GitHub requests per publish {requests_per_publish:.1f}")
+    print(f"token cache stats: {gh.get_token_cache_stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--publishes", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--rtt", type=float, default=0.03, help="simulated round-trip time in seconds")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.publishes, args.concurrency, args.rtt))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Exercise the retries, circuit breaker and rate-limit throttling of `server.gh` against a misbehaving fake GitHub.
+
+Three scenarios against the local fake from `fake_github`, with a simulated network round-trip time:
+
+- flaky: the GitHub calls of a publish while a share of requests fail with 502s, with and without retries
+- outage: GitHub calls while every request fails, with the circuit breaker and with it never opening
+- rate limit: concurrent GitHub calls with a small rate limit, counting the 403s the fake had to answer with
+
+Needs the usual backend environment. Run from `packages/backend`:
+
+    uv run python -m benchmarks.github_resilience --publishes 200 --rtt 0.02
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from server import env, forks, gh, resilience
+
+from .fake_github import FAKE_INSTALLATION_ID, run_fake_github
+from .github_client import publish_github_calls
+from .utils import run_load
+
+
+async def nothing() -> None:
+    pass
+
+
+def close_circuit() -> None:
+    """Start the next scenario as if GitHub had been fine all along."""
+    gh._circuit_breaker.record_success()  # noqa: SLF001
+
+
+async def flaky(fake: FastAPI, publishes: int, concurrency: int, error_rate: float) -> None:
+    fake.state.error_rate = error_rate
+    for max_attempts in (1, resilience.MAX_ATTEMPTS):
+        resilience.MAX_ATTEMPTS = max_attempts
+        close_circuit()
+        retried = resilience.get_retry_stats()["retried"]
+
+        async def publish() -> None:
+            gh.clear_token_caches()
+            forks.clear()
+            await publish_github_calls(nothing)
+
+        label = f"publish, {error_rate:.0%} errors, {max_attempts} attempts"
+        result = await run_load(label, publish, publishes, concurrency)
+        print(f"{result.summary()}  {resilience.get_retry_stats()['retried'] - retried} retries")
+
+    fake.state.error_rate = 0.0
+
+
+async def outage(fake: FastAPI, calls: int) -> None:
+    fake.state.error_rate = 1.0
+    app_token = await gh.get_app_token()
+    breaker = gh._circuit_breaker  # noqa: SLF001
+    threshold = breaker.failure_threshold
+    for label, failure_threshold in (("never opening", 10**9), ("circuit breaker", threshold)):
+        breaker.failure_threshold = failure_threshold
+        close_circuit()
+        requests = fake.state.requests
+        start = time.perf_counter()
+        for _ in range(calls):
+            try:
+                await gh.get_app_installations(app_token)
+            except httpx.HTTPError:
+                pass
+        elapsed = time.perf_counter() - start
+        print(
+            f"{'outage, ' + label:<36} {elapsed / calls * 1000:>8.1f} ms per failed call  "
+            f"{fake.state.requests - requests} requests to GitHub"
+        )
+
+    breaker.failure_threshold = threshold
+    fake.state.error_rate = 0.0
+    close_circuit()
+
+
+async def rate_limited(fake: FastAPI, calls: int, concurrency: int, rate_limit: int, window: float) -> None:
+    fake.state.rate_limit = rate_limit
+    fake.state.rate_limit_window = window
+    app_token = await gh.get_app_token()
+    token = await gh.get_app_installation_token(FAKE_INSTALLATION_ID, app_token)
+
+    async def call() -> None:
+        await gh.get_app_installation_repositories(token)
+
+    for reserve in (0, rate_limit // 5):
+        gh._rate_limits.reserve = reserve  # noqa: SLF001
+        # A fresh window for each run, and nothing known about it yet
+        await asyncio.sleep(window)
+        gh.clear_token_caches()
+        token = await gh.get_app_installation_token(FAKE_INSTALLATION_ID, app_token)
+        rejected = fake.state.rate_limited
+        result = await run_load(f"{rate_limit}/{window:.0f} s limit, reserve {reserve}", call, calls, concurrency)
+        print(f"{result.summary()}  {fake.state.rate_limited - rejected} rejected with 403")
+
+    fake.state.rate_limit = None
+
+
+async def bench(args: argparse.Namespace) -> None:
+    async with run_fake_github(env.GIT_UPSTREAM_OWNER, env.GIT_UPSTREAM_REPO, rtt=args.rtt) as fake:
+        env.GITHUB_API_URL = fake.state.base_url
+        await gh.close_client()
+
+        await flaky(fake, args.publishes, args.concurrency, args.error_rate)
+        await outage(fake, args.calls)
+        await rate_limited(fake, args.rate_limit * 3, args.concurrency, args.rate_limit, args.window)
+        print(gh.get_resilience_stats())
+
+        await gh.close_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--publishes", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=50, help="calls during the outage")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rtt", type=float, default=0.02, help="simulated round-trip time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="share of requests failing while flaky")
+    parser.add_argument("--rate-limit", type=int, default=100, help="requests per token and window")
+    parser.add_argument("--window", type=float, default=5.0, help="rate limit window in seconds")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Measure how many bytes `server.images` saves on canvas-sized artworks, and the CPU time it takes per image.
+
+The CPU time includes encoding the mip levels, whose sizes are reported separately.
+
+The inputs are synthetic drawings at the size the editor's canvas has on common screens (95% of the window height,
+A4 ratio, at twice the resolution), encoded like the browser does with `canvas.toBlob("image/webp", 0.7)`. Needs the
+usual backend environment. Run from `packages/backend`:
+
+    uv run python -m benchmarks.image_pipeline --images 5
+"""
+
+import argparse
+import asyncio
+import io
+import random
+import statistics
+import time
+
+from PIL import Image, ImageDraw
+from server import images
+
+SCREEN_HEIGHTS = [1080, 1440, 2160]
+
+
+def draw_artwork(rng: random.Random, screen_height: int) -> bytes:
+    """Draw something like an editor canvas: strokes and shapes in a few colors, partly erased to transparency."""
+    height = int(screen_height * 0.95 * 2)
+    width = int(height * 2**0.5)
+    image = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+
+    palette = [tuple(rng.randrange(256) for _ in range(3)) + (255,) for _ in range(8)]
+    for _ in range(60):
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randrange(2, 12))]
+        draw.line(points, fill=rng.choice(palette), width=rng.randrange(5, 60), joint="curve")
+    for _ in range(15):
+        x, y = rng.randrange(width), rng.randrange(height)
+        size = rng.randrange(50, height // 3)
+        draw.ellipse((x, y, x + size, y + size), fill=rng.choice(palette))
+    for _ in range(5):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.rectangle((x, y, x + rng.randrange(100, 600), y + rng.randrange(100, 600)), fill=(0, 0, 0, 0))
+
+    output = io.BytesIO()
+    image.save(output, format="webp", quality=70)
+    return output.getvalue()
+
+
+async def pool_wall_time(uploads: list[bytes]) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(images.normalize(upload) for upload in uploads))
+    elapsed = time.perf_counter() - start
+    images.shutdown_executor()
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=5, help="images per screen height")
+    parser.add_argument("--seed", type=int, default=12)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"max dimension {images.MAX_DIMENSION}, {args.images} images per screen height")
+    for screen_height in SCREEN_HEIGHTS:
+        uploads = [draw_artwork(rng, screen_height) for _ in range(args.images)]
+        uploaded = statistics.mean(len(upload) for upload in uploads)
+
+        for image_format in images.ENCODER_OPTIONS:
+            sizes = []
+            level_sizes: dict[int, list[int]] = {size: [] for size in images.MIP_LEVELS}
+            cpu_times = []
+            for upload in uploads:
+                start = time.process_time()
+                artwork = images.normalize_sync(upload, image_format=image_format)
+                cpu_times.append(time.process_time() - start)
+
+                sizes.append(len(artwork.image))
+                for size, level in artwork.levels.items():
+                    level_sizes[size].append(len(level))
+
+            published = statistics.mean(sizes)
+            print(
+                f"{screen_height}p canvas -> {image_format:<4}  "
+                f"{uploaded / 1024:7.1f} KiB -> {published / 1024:7.1f} KiB ({1 - published / uploaded:6.1%} saved)  "
+                f"CPU p50 {statistics.median(cpu_times) * 1000:7.1f} ms  max {max(cpu_times) * 1000:7.1f} ms"
+            )
+            levels = [f"{size}: {statistics.mean(n) / 1024:6.1f} KiB" for size, n in level_sizes.items() if n]
+            print(f"    mip levels  {'  '.join(levels)}")
+
+        elapsed = asyncio.run(pool_wall_time(uploads))
+        print(f"{screen_height}p canvas, {len(uploads)} at once in {images.WORKERS} pool workers: {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Measure what `server.metrics` costs: per observation, per timed call, per request and per scrape.
+
+The timed call and the request are compared with the same work uninstrumented. A request goes through a minimal
+FastAPI app over an in-process ASGI transport, so the middleware's share isn't hidden behind network time. The scrape
+renders histograms filled with about as many label combinations as the backend produces. Run from
+`packages/backend`:
+
+    uv run python -m benchmarks.metrics_overhead --calls 200000 --requests 5000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import timeit
+from collections.abc import Awaitable, Callable
+
+import httpx
+from fastapi import FastAPI
+from server import metrics
+
+from .utils import run_load
+
+
+async def noop() -> None:
+    pass
+
+
+async def time_awaits(function: Callable[[], Awaitable[None]], calls: int) -> float:
+    """Await `function` `calls` times, returning the mean time per call in nanoseconds."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        await function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def create_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(metrics.RequestMetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int) -> dict[str, int]:
+        return {"item_id": item_id}
+
+    return app
+
+
+def fill_histograms(rng: random.Random) -> int:
+    """Observe into as many label combinations as a busy backend would have, returning their number."""
+    histogram = metrics.Histogram("benchmark_seconds", "Benchmark", ("route", "status", "outcome"))
+    for route in range(30):
+        for status in ("200", "401", "404", "409", "500"):
+            for outcome in ("ok", "error"):
+                for _ in range(10):
+                    histogram.observe((f"/route/{route}", status, outcome), rng.expovariate(20))
+    for _ in range(100):
+        for call in range(35):
+            metrics.upstream_calls.observe(("github", f"call_{call}", "ok"), rng.expovariate(10))
+        for query in range(25):
+            metrics.db_queries.observe((f"query_{query}", "ok"), rng.expovariate(500))
+
+    metrics.HISTOGRAMS = (*metrics.HISTOGRAMS, histogram)
+    return sum(len(histogram) for histogram in metrics.HISTOGRAMS)
+
+
+async def bench(calls: int, requests: int, concurrency: int) -> None:
+    histogram = metrics.Histogram("observe_seconds", "Benchmark", ("call", "outcome"))
+    histogram.observe(("noop", "ok"), 0.01)
+    observe_ns = min(timeit.repeat(lambda: histogram.observe(("noop", "ok"), 0.01), number=calls, repeat=5))
+    print(f"{'observe':<36} {observe_ns / calls * 1e9:>8.0f} ns")
+
+    timed_noop = metrics.timed(histogram)(noop)
+    bare = min([await time_awaits(noop, calls) for _ in range(5)])
+    timed = min([await time_awaits(timed_noop, calls) for _ in range(5)])
+    print(f"{'await a no-op coroutine':<36} {bare:>8.0f} ns")
+    print(f"{'await it timed':<36} {timed:>8.0f} ns  (+{timed - bare:.0f} ns)")
+
+    for instrumented in (False, True):
+        transport = httpx.ASGITransport(app=create_app(instrumented))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def request(client: httpx.AsyncClient = client) -> None:
+                r = await client.get(f"/items/{random.randrange(1000)}")
+                r.raise_for_status()
+
+            label = "request with middleware" if instrumented else "request without middleware"
+            # Warm up
+            await run_load(label, request, concurrency, concurrency)
+            print((await run_load(label, request, requests, concurrency)).summary())
+
+    series = fill_histograms(random.Random(0))
+    scrape = min(timeit.repeat(lambda: metrics.render({"db_pool": {"pool_size": 10}}), number=20, repeat=5)) / 20
+    size = len(metrics.render({}))
+    print(f"{'scrape':<36} {scrape * 1000:>8.2f} ms  {series} series, {size / 1024:.0f} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.calls, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
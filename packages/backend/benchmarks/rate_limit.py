@@ -0,0 +1,97 @@
+"""Measure what `server.ratelimit` adds to each `/publish` request, and check that the limit holds under concurrency.
+
+Three paths are timed: a publish that is allowed, which queues a job with a tiny image in the same transaction, one
+refused from the worker's own memory, the usual case for a client hammering the endpoint, and one refused by Postgres,
+when another worker took the last publish. Then many publishes for the same user are raced against each other, as if
+sent to different workers, and no more than the limit may get through. Needs the usual backend environment and a
+reachable Postgres, the benchmark users' jobs and rows are deleted afterwards. Run from `packages/backend`:
+
+    uv run python -m benchmarks.rate_limit --requests 2000 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import itertools
+
+from fastapi import HTTPException
+from server import jobs, migrations, pg, ratelimit, uploads
+
+from .utils import run_load
+
+BENCH_USERNAME = "hhh-benchmark-limit"
+
+_counter = itertools.count()
+
+
+async def check(user_name: str, forget: bool = False) -> bool:
+    if forget:
+        # As if the user's earlier publishes went through other workers
+        ratelimit._arrival_times.pop(user_name, None)
+
+    # A different image every time, so none is answered with an already queued job
+    content = str(next(_counter)).encode()
+    image = uploads.Upload(io.BytesIO(content), len(content), hashlib.sha256(content).hexdigest())
+    try:
+        ratelimit.check_publish(user_name)
+        await jobs.enqueue(user_name, image)
+    except HTTPException as e:
+        if e.status_code != 429:
+            raise
+        return False
+    return True
+
+
+async def bench(requests: int, concurrency: int) -> None:
+    await pg.open_pool()
+    try:
+        await migrations.run()
+        print(f"limit {ratelimit.PUBLISH_LIMIT} per {ratelimit.PUBLISH_WINDOW:.0f} s, {concurrency} concurrent")
+
+        # A fresh user per request, so every one of them is allowed
+        result = await run_load(
+            "allowed (Postgres)",
+            lambda: check(f"{BENCH_USERNAME}-{next(_counter)}"),
+            requests,
+            concurrency,
+        )
+        print(result.summary())
+
+        for _ in range(ratelimit.PUBLISH_LIMIT):
+            await check(BENCH_USERNAME)
+        result = await run_load("refused (in process)", lambda: check(BENCH_USERNAME), requests, concurrency)
+        print(result.summary())
+        result = await run_load(
+            "refused (Postgres)",
+            lambda: check(BENCH_USERNAME, forget=True),
+            requests,
+            concurrency,
+        )
+        print(result.summary())
+
+        raced_user = f"{BENCH_USERNAME}-raced"
+        allowed = await asyncio.gather(*(check(raced_user, forget=True) for _ in range(100)))
+        print(f"100 racing publishes for one user, {sum(allowed)} allowed")
+    finally:
+        async with pg.connection() as conn:
+            for table in ("publish_jobs", "publish_rate_limits"):
+                await conn.execute(
+                    f"DELETE FROM {table} WHERE github_username LIKE %s",  # noqa: S608
+                    (f"{BENCH_USERNAME}%",),
+                )
+            await conn.commit()
+        await pg.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Compare a Supabase client per request, as `server.sb` used to create them, with its shared-transport auth clients.
+
+Each simulated request does what `/status` and `/publish` do with GoTrue: restore the session from the cookies,
+read it back and list the user's identities. Against `fake_gotrue`, running in a process of its own with a simulated
+round-trip time, it reports latency under concurrency, memory allocated and still held after the requests, and the
+asyncio tasks left behind. Needs the usual backend environment. Run from `packages/backend`:
+
+    uv run python -m benchmarks.supabase_clients --requests 500 --concurrency 10 --rtt 0.02
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from server import env, sb
+from supabase import AsyncClientOptions, create_async_client
+
+from .utils import run_load
+
+BENCH_USERNAME = "hhh-benchmark-user"
+
+
+async def per_request_client(supabase_url: str, session: dict[str, Any]) -> None:
+    client = await create_async_client(
+        supabase_url=supabase_url,
+        supabase_key=env.SUPABASE_KEY,
+        options=AsyncClientOptions(flow_type="pkce"),
+    )
+    await client.auth.set_session(access_token=session["access_token"], refresh_token=session["refresh_token"])
+    await client.auth.get_session()
+    await client.auth.get_user_identities()
+
+
+async def shared_transport_client(supabase_url: str, session: dict[str, Any]) -> None:
+    client = sb._create_auth_client(supabase_url)  # noqa: SLF001
+    await client.set_session(access_token=session["access_token"], refresh_token=session["refresh_token"])
+    await client.get_session()
+    await client.get_user_identities()
+
+
+async def measure_memory(request: Callable[[], Awaitable[None]], requests: int) -> tuple[float, float, int]:
+    """Run requests one after the other, returning the peak and retained memory per request and leftover tasks."""
+    tasks_before = len(asyncio.all_tasks())
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(requests):
+            await request()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (peak - baseline) / requests, (retained - baseline) / requests, len(asyncio.all_tasks()) - tasks_before
+
+
+async def bench(requests: int, concurrency: int, rtt: float) -> None:
+    fake_process = await asyncio.create_subprocess_exec(
+        *(sys.executable, "-m", "benchmarks.fake_gotrue", "--rtt", str(rtt), "--user", BENCH_USERNAME),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        assert fake_process.stdout is not None  # noqa: S101
+        fake = json.loads(await fake_process.stdout.readline())
+        # httpx reads this when a client is created
+        os.environ["SSL_CERT_FILE"] = fake["cert_file"]
+
+        session = fake["session"]
+        variants: dict[str, Callable[[], Awaitable[None]]] = {
+            "client per request": lambda: per_request_client(fake["base_url"], session),
+            "shared transport": lambda: shared_transport_client(fake["base_url"], session),
+        }
+        print(f"{requests} requests, {concurrency} concurrent, {rtt * 1000:.0f} ms RTT to GoTrue")
+
+        for label, request in variants.items():
+            # Warm up, so the shared transport has its connections open like in a running server
+            await run_load(label, request, concurrency, concurrency)
+
+            result = await run_load(label, request, requests, concurrency)
+            print(result.summary())
+
+            peak, retained, leftover_tasks = await measure_memory(request, min(requests, 200))
+            print(
+                f"{'':<36} peak {peak / 1024:8.1f} KiB/request  retained {retained / 1024:8.1f} KiB/request  "
+                f"{leftover_tasks} tasks left behind"
+            )
+
+        await sb.close_http_clients()
+        # The per-request clients' refresh timers would otherwise keep running until the tokens expire
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+    finally:
+        fake_process.terminate()
+        await fake_process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rtt", type=float, default=0.02, help="simulated round-trip time in seconds")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.requests, args.concurrency, args.rtt))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Send many large uploads at once to a uvicorn worker and measure how much its memory grows.
+
+`/publish` needs a Supabase session, so the worker runs a small app with the rest of its ingestion path: streaming the
+upload through `server.uploads` and queueing it with `server.jobs.enqueue`. For comparison it also has the old path,
+which read the whole `UploadFile` and inserted it as one parameter. Needs the usual backend environment and a reachable
+Postgres, the queued jobs are deleted afterwards. Linux only. Run from `packages/backend`:
+
+    uv run python -m benchmarks.upload_memory --uploads 32 --size-mib 20
+"""
+
+import argparse
+import asyncio
+import os
+import secrets
+import sys
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import FastAPI, Request, UploadFile
+from server import jobs, migrations, pg, uploads
+
+from .utils import get_rss, reset_peak_rss, wait_until_healthy
+
+BENCH_USERNAME = "hhh-benchmark"
+BOUNDARY = "hhh-benchmark-boundary"
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    await pg.open_pool()
+    try:
+        await migrations.run()
+        yield
+    finally:
+        await pg.close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/health")
+async def health() -> dict[str, int]:
+    return pg.get_pool_stats()
+
+
+@app.post("/streamed")
+async def streamed(request: Request) -> str:
+    async with uploads.receive_file(request, "image") as image:
+        return str(await jobs.enqueue(BENCH_USERNAME, image))
+
+
+@app.post("/buffered")
+async def buffered(image: UploadFile) -> str:
+    async with pg.connection() as conn:
+        cur = await conn.execute(
+            "INSERT INTO publish_jobs (github_username, image) VALUES (%s, %s) RETURNING id",
+            (BENCH_USERNAME, await image.read()),
+        )
+        row = await cur.fetchone()
+        await conn.commit()
+
+    assert row is not None  # noqa: S101
+    return str(row[0])
+
+
+async def iter_multipart_body(content: bytes) -> AsyncIterator[bytes]:
+    """Yield a form with `content` as its image, made unique so uploads aren't recognized as the same image."""
+    yield (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="image"; filename="canvas.webp"\r\n'
+        "Content-Type: image/webp\r\n\r\n"
+    ).encode()
+    yield secrets.token_bytes(16)
+    for start in range(0, len(content), 1024 * 1024):
+        yield content[start : start + 1024 * 1024]
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def upload(client: httpx.AsyncClient, path: str, content: bytes) -> int:
+    r = await client.post(
+        path,
+        content=iter_multipart_body(content),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+    )
+    return r.status_code
+
+
+async def bench(n_uploads: int, size: int, port: int) -> None:
+    content = os.urandom(size)
+    server_process = await asyncio.create_subprocess_exec(
+        *(sys.executable, "-m", "uvicorn", "benchmarks.upload_memory:app", "--port", str(port)),
+        *("--log-level", "warning"),
+        env={
+            **os.environ,
+            # Large enough for the test uploads, the concurrent COPYs wait for a pooled connection in turn
+            "PUBLISH_MAX_UPLOAD_BYTES": str(size + 1024),
+            "POSTGRES_POOL_TIMEOUT": "120",
+            # Every streamed upload queues a job, which takes a publish from the rate limit
+            "PUBLISH_RATE_LIMIT": str(10**9),
+        },
+    )
+    try:
+        timeout = httpx.Timeout(300.0)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            await wait_until_healthy(client)
+            print(f"{n_uploads} concurrent uploads of {size / 2**20:.0f} MiB")
+
+            for path in ["/streamed", "/buffered"]:
+                reset_peak_rss(server_process.pid)
+                baseline_rss = get_rss(server_process.pid)
+                start = time.perf_counter()
+                statuses = await asyncio.gather(*(upload(client, path, content) for _ in range(n_uploads)))
+                elapsed = time.perf_counter() - start
+                peak_rss = get_rss(server_process.pid, field="VmHWM") - baseline_rss
+                print(
+                    f"{path:<10} {elapsed:6.2f} s  peak RSS growth {peak_rss / 2**20:8.1f} MiB  "
+                    f"statuses {sorted(set(statuses))}"
+                )
+
+            oversized = await upload(client, "/streamed", content + b"\0" * 2048)
+            print(f"upload over the limit answered with {oversized}")
+    finally:
+        server_process.terminate()
+        await server_process.wait()
+
+        async with pg.connection() as conn:
+            for table in ("publish_jobs", "publish_rate_limits"):
+                await conn.execute(f"DELETE FROM {table} WHERE github_username = %s", (BENCH_USERNAME,))  # noqa: S608
+            await conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=32)
+    parser.add_argument("--size-mib", type=float, default=20)
+    parser.add_argument("--port", type=int, default=9101)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.uploads, int(args.size_mib * 2**20), args.port))
+
+
+if __name__ == "__main__":
+    main()
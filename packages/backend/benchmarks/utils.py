@@ -0,0 +1,91 @@
+import asyncio
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+
+
+@dataclass
+class LoadResult:
+    label: str
+    requests: int
+    errors: int
+    elapsed: float
+    latencies: list[float]
+
+    @property
+    def rps(self) -> float:
+        return self.requests / self.elapsed
+
+    def percentile(self, p: float) -> float:
+        """Get the `p`-th latency percentile in milliseconds."""
+        if not self.latencies:
+            return float("nan")
+        if len(self.latencies) == 1:
+            return self.latencies[0] * 1000
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[int(p) - 1] * 1000
+
+    def summary(self) -> str:
+        return (
+            f"{self.label:<36} {self.rps:>10.1f} req/s  "
+            f"p50 {self.percentile(50):>8.2f} ms  p95 {self.percentile(95):>8.2f} ms  "
+            f"p99 {self.percentile(99):>8.2f} ms  errors {self.errors}"
+        )
+
+
+async def run_load(
+    label: str,
+    request: Callable[[], Awaitable[object]],
+    requests: int,
+    concurrency: int,
+) -> LoadResult:
+    """Call `request` `requests` times from `concurrency` concurrent workers and collect latencies."""
+    latencies: list[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await request()
+            except Exception:  # noqa: BLE001
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return LoadResult(label=label, requests=requests, errors=errors, elapsed=elapsed, latencies=latencies)
+
+
+def get_rss(pid: int | str = "self", field: str = "VmRSS") -> int:
+    """Get the resident set size of a process in bytes, or its peak with `field="VmHWM"`, Linux only."""
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith(f"{field}:"):
+            return int(line.split()[1]) * 1024
+    raise RuntimeError(f"{field} not found")
+
+
+def reset_peak_rss(pid: int | str = "self") -> None:
+    """Start tracking the peak resident set size of a process afresh, Linux only."""
+    Path(f"/proc/{pid}/clear_refs").write_text("5")
+
+
+async def wait_until_healthy(client: httpx.AsyncClient) -> None:
+    for _ in range(100):
+        try:
+            r = await client.get("/health")
+            if r.is_success:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Backend did not start")
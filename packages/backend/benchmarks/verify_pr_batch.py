@@ -0,0 +1,98 @@
+"""Compare validating 10k pull requests one `/verify_pr` call at a time with a single `/verify_pr/batch` call.
+
+Requests go to the app in process, over an ASGI transport, so the numbers are the backend's own cost without network
+round trips, which would only widen the gap. Half of the pairs exist. Seeds rows like `verify_pr_lookup` does and
+deletes them afterwards, so point it at a scratch database. Run from `packages/backend`:
+
+    uv run python -m benchmarks.verify_pr_batch --rows 100000 --pairs 10000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from server import app, migrations, pg
+
+from .utils import run_load
+from .verify_pr_lookup import cleanup, seed, seeded_commit_hash, seeded_filename
+
+
+async def explain(pairs: list[tuple[str, str]]) -> str:
+    async with pg.connection() as conn:
+        cur = await conn.execute(
+            """
+            EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF)
+            SELECT EXISTS (SELECT 1 FROM github_files WHERE filename=p.filename AND commit_hash=p.commit_hash)
+            FROM unnest(%s::bpchar[], %s::bpchar[]) WITH ORDINALITY AS p(filename, commit_hash, position)
+            ORDER BY p.position
+            """,
+            ([filename for filename, _ in pairs], [commit_hash for _, commit_hash in pairs]),
+        )
+        return "\n".join(row[0] for row in await cur.fetchall())
+
+
+async def bench(rows: int, n_pairs: int, concurrency: int) -> None:
+    await migrations.run()
+    await pg.open_pool()
+    try:
+        await cleanup()
+        await seed(0, rows)
+
+        rng = random.Random(0)
+        indices = [rng.randrange(2 * rows) for _ in range(n_pairs)]
+        pairs = [(seeded_filename(i), seeded_commit_hash(i)) for i in indices]
+        expected = [i < rows for i in indices]
+        print(f"{n_pairs:,} pairs against {rows:,} rows")
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            remaining = iter(pairs)
+
+            async def verify_one() -> None:
+                filename, commit_hash = next(remaining)
+                r = await client.get("/verify_pr", params={"filename": filename, "commit_hash": commit_hash})
+                r.raise_for_status()
+
+            for label, workers in (("one at a time", 1), (f"{concurrency} concurrent", concurrency)):
+                remaining = iter(pairs)
+                result = await run_load(f"/verify_pr, {label}", verify_one, n_pairs, workers)
+                print(f"{result.label:<36} {result.elapsed * 1000:>10.1f} ms total  {result.rps:>10.1f} pairs/s")
+
+            for _ in range(3):
+                start = time.perf_counter()
+                r = await client.post(
+                    "/verify_pr/batch",
+                    json={"items": [{"filename": f, "commit_hash": c} for f, c in pairs]},
+                )
+                r.raise_for_status()
+                elapsed = time.perf_counter() - start
+            assert [result["is_valid"] for result in r.json()["results"]] == expected  # noqa: S101
+            label = "/verify_pr/batch"
+            print(f"{label:<36} {elapsed * 1000:>10.1f} ms total  {n_pairs / elapsed:>10.1f} pairs/s")
+
+        start = time.perf_counter()
+        assert await pg.github_files_check_exist_many(pairs) == expected  # noqa: S101
+        elapsed = time.perf_counter() - start
+        label = "of which the query"
+        print(f"{label:<36} {elapsed * 1000:>10.1f} ms total  {n_pairs / elapsed:>10.1f} pairs/s")
+
+        print(await explain(pairs))
+    finally:
+        await cleanup()
+        await pg.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--pairs", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.rows, args.pairs, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
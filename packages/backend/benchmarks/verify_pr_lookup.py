@@ -0,0 +1,105 @@
+"""Show that `pg.github_files_check_exists` latency stays flat as `github_files` grows to 1M rows.
+
+Seeds rows owned by a dedicated benchmark user into `github_files` and deletes them afterwards, so point it at a
+scratch database. Run from `packages/backend`:
+
+    uv run python -m benchmarks.verify_pr_lookup --sizes 1000 10000 100000 1000000
+"""
+
+import argparse
+import asyncio
+import random
+
+from server import migrations, pg
+
+from .utils import run_load
+
+BENCH_USERNAME = "hhh-benchmark"
+
+
+def seeded_filename(i: int) -> str:
+    return f"{i:037d}.webp"
+
+
+def seeded_commit_hash(i: int) -> str:
+    return f"{i:040x}"
+
+
+async def seed(start: int, stop: int) -> None:
+    async with pg.connection() as conn:
+        await conn.execute(
+            """
+            INSERT INTO github_files (github_username, filename, commit_hash)
+            SELECT
+                %s,
+                lpad(i::text, 37, '0') || '.webp',
+                lpad(to_hex(i), 40, '0')
+            FROM
+                generate_series(%s, %s - 1) AS i
+            """,
+            (BENCH_USERNAME, start, stop),
+        )
+        await conn.commit()
+
+    # Refresh statistics and the visibility map so the planner can pick an index-only scan
+    conn = await pg.get_connection()
+    async with conn:
+        await conn.set_autocommit(True)
+        await conn.execute("VACUUM ANALYZE github_files")
+
+
+async def cleanup() -> None:
+    async with pg.connection() as conn:
+        await conn.execute("DELETE FROM github_files WHERE github_username = %s", (BENCH_USERNAME,))
+        await conn.commit()
+
+
+async def explain(filename: str, commit_hash: str) -> str:
+    async with pg.connection() as conn:
+        cur = await conn.execute(
+            """
+            EXPLAIN (ANALYZE, COSTS OFF)
+            SELECT EXISTS (SELECT 1 FROM github_files WHERE filename=%s AND commit_hash=%s)
+            """,
+            (filename, commit_hash),
+        )
+        return "\n".join(row[0] for row in await cur.fetchall())
+
+
+async def bench(sizes: list[int], lookups: int, concurrency: int) -> None:
+    await migrations.run()
+    await pg.open_pool()
+    try:
+        await cleanup()
+        seeded = 0
+        for size in sorted(sizes):
+            await seed(seeded, size)
+            seeded = size
+
+            async def lookup() -> None:
+                i = random.randrange(2 * seeded)  # noqa: S311
+                # Half of the probes miss, mirroring PRs that didn't come from the backend
+                exists = await pg.github_files_check_exists(seeded_filename(i), seeded_commit_hash(i))
+                assert exists == (i < seeded)  # noqa: S101
+
+            result = await run_load(f"{seeded:>9,} rows", lookup, lookups, concurrency)
+            print(result.summary())
+
+        print(await explain(seeded_filename(0), seeded_commit_hash(0)))
+    finally:
+        await cleanup()
+        await pg.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.sizes, args.lookups, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
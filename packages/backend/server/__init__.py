@@ -1,16 +1,68 @@
-import secrets
-from datetime import datetime
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from typing import Annotated
 
-from fastapi import FastAPI, HTTPException, Query, Request, Response, UploadFile
+import psycopg
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from gotrue import CodeExchangeParams, SignInWithOAuthCredentials, SignInWithOAuthCredentialsOptions
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from . import (
+    dedup,
+    env,
+    feed,
+    forks,
+    gh,
+    images,
+    installations,
+    jobs,
+    listing,
+    metrics,
+    migrations,
+    pg,
+    ratelimit,
+    sb,
+    sessions,
+    uploads,
+)
 
-from . import env, gh, pg, sb
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    await pg.open_pool()
+    try:
+        await migrations.run()
+        background_tasks = [
+            asyncio.create_task(feed.listen()),
+            asyncio.create_task(sessions.listen()),
+            asyncio.create_task(installations.sync_forever()),
+            asyncio.create_task(forks.refresh_forever()),
+            asyncio.create_task(dedup.warm_up()),
+            *jobs.start_workers(),
+        ]
+        try:
+            yield
+        finally:
+            feed.broadcaster.close()
+            sessions.close()
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+    finally:
+        images.shutdown_executor()
+        await gh.close_client()
+        await sb.close_http_clients()
+        await pg.close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://heavenly-hostas-hosting.github.io"],
@@ -22,9 +74,9 @@ app.add_middleware(
 
 @app.get("/login")
 async def login() -> Response:
-    sb_client = await sb.create_public_client()
+    sb_client = sb.create_public_client()
 
-    gh_response = await sb_client.auth.sign_in_with_oauth(
+    gh_response = await sb_client.sign_in_with_oauth(
         SignInWithOAuthCredentials(
             provider="github",
             options=SignInWithOAuthCredentialsOptions(redirect_to=env.GITHUB_CALLBACK_REDIRECT_URI),
@@ -46,7 +98,17 @@ async def login() -> Response:
 @app.get("/logout")
 async def logout(request: Request) -> Response:
     sb_client = await sb.get_session(request)
-    await sb_client.auth.sign_out()
+    await sb_client.sign_out()
+
+    # Signing out revokes every session of the user, make all workers stop trusting their access tokens too. The name
+    # comes from the token itself, looking it up in GoTrue would hold up logging out or fail it.
+    access_token = request.cookies[sb.ACCESS_TOKEN_COOKIE_KEY]
+    if (user_name := sb.get_access_token_user_name(access_token)) is not None:
+        try:
+            await pg.sessions_notify_logout(user_name, time.time())
+        except psycopg.Error:
+            # The tokens run out within the hour anyway, the cookies should still go
+            pass
 
     response = RedirectResponse(env.POST_AUTH_REDIRECT_URI)
     response.delete_cookie(
@@ -70,12 +132,12 @@ async def auth(
     code: Annotated[str, Query()],
     request: Request,
 ) -> RedirectResponse:
-    client = await sb.create_internal_client()
+    client = sb.create_internal_client()
     code_verifier = request.cookies.get(sb.CODE_VERIFIER_COOKIE_KEY)
     if code_verifier is None:
         raise HTTPException(status_code=401, detail="Code verifier not found in cookies")
 
-    gh_response = await client.auth.exchange_code_for_session(
+    gh_response = await client.exchange_code_for_session(
         CodeExchangeParams(
             code_verifier=code_verifier,
             auth_code=code,
@@ -102,74 +164,61 @@ async def auth(
     return response
 
 
-@app.post("/publish")
-async def publish(  # noqa: C901
-    image: UploadFile,
-    http_request: Request,
-) -> Response:
+class PublishJobResponse(BaseModel):
+    job_id: uuid.UUID
+    status: str
+    stage: str | None = None
+    attempts: int = 0
+    error: str | None = None
+    error_status_code: int | None = None
+    filename: str | None = None
+
+
+# The upload is parsed by hand to stream it, so the OpenAPI schema FastAPI would generate for it is given here
+PUBLISH_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["image"],
+                "properties": {"image": {"type": "string", "format": "binary"}},
+            },
+        },
+    },
+}
+
+
+@app.post(
+    "/publish",
+    status_code=202,
+    response_model=PublishJobResponse,
+    openapi_extra={"requestBody": PUBLISH_REQUEST_BODY},
+)
+async def publish(http_request: Request) -> Response:
+    """Queue the image uploaded as the `image` form field for publishing, `/publish/{job_id}` reports its progress."""
     client = await sb.get_session(http_request)
 
-    client_session = await client.auth.get_session()
+    client_session = await client.get_session()
     if client_session is None:
         raise HTTPException(status_code=401, detail="User not authenticated")
 
     gh_identity = await sb.get_github_identity(client)
     user_name = gh_identity.identity_data["user_name"]
-    app_token = gh.get_app_token()
 
-    installation_id: int | None = None
-    for installation in await gh.get_app_installations(app_token):
-        if installation["account"]["login"] == user_name:
-            if installation_id is not None:
-                raise HTTPException(status_code=400, detail="Multiple GitHub App installations found for user")
-
-            installation_id = installation["id"]
-
-    if installation_id is None:
+    # Before reading the upload, so clients known to be over the limit or without the app don't get to send it. Only
+    # queueing the job takes a publish from the limit, refused uploads and double submits don't.
+    ratelimit.check_publish(user_name)
+    if await installations.get_installation_id(user_name) is None:
         raise HTTPException(status_code=404, detail="No GitHub App installation found")
 
-    app_installation_token = await gh.get_app_installation_token(installation_id, app_token)
-    installation_repositories = await gh.get_app_installation_repositories(app_installation_token)
+    async with uploads.receive_file(http_request, "image") as image:
+        job_id = await jobs.enqueue(user_name, image)
 
-    total_repo_count = installation_repositories["total_count"]
-    if total_repo_count == 0:
-        raise HTTPException(status_code=409, detail="GitHub App not installed on any repository")
-    elif total_repo_count > 1:
-        raise HTTPException(status_code=409, detail="GitHub App must be installed on a single repository")
-
-    root_app_installation_token = await gh.get_app_installation_token(env.GIT_UPSTREAM_APP_INSTALLATION_ID, app_token)
-    all_fork_full_names = set(
-        repo["full_name"] for repo in await gh.get_app_installation_repository_forks(root_app_installation_token)
-    )
-    repository = installation_repositories["repositories"][0]
-
-    if not repository["fork"] or repository["full_name"] not in all_fork_full_names:
-        raise HTTPException(
-            status_code=409, detail="The installation repository must be a fork of the main repository"
-        )
-
-    now = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
-    random_sequence = secrets.token_hex(8)
-    file_stem = f"{now}_{random_sequence}"
-    file_name = f"{file_stem}.webp"
-
-    commit_hash = await gh.commit_and_create_pull_request(
-        root_app_installation_token=root_app_installation_token,
-        app_installation_token=app_installation_token,
-        fork_owner=user_name,
-        fork_name=repository["name"],
-        new_branch=file_stem,
-        file_path=file_name,
-        file_content=await image.read(),
-        pr_title=f"Publish {file_name}",
-    )
-    await pg.github_files_insert_row(
-        username=user_name,
-        filename=file_name,
-        commit_hash=commit_hash,
+    response = JSONResponse(
+        content=PublishJobResponse(job_id=job_id, status="queued").model_dump(mode="json"),
+        status_code=202,
     )
-
-    response = Response(content="Publish endpoint hit", status_code=200)
     sb.set_response_token_cookies_(
         response,
         access_token=client_session.access_token,
@@ -179,6 +228,41 @@ async def publish(  # noqa: C901
     return response
 
 
+@app.get("/publish/{job_id}")
+async def publish_status(job_id: uuid.UUID) -> PublishJobResponse:
+    job = await pg.publish_jobs_get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Publish job not found")
+
+    status, stage, attempts, error, error_status_code, filename = job
+    return PublishJobResponse(
+        job_id=job_id,
+        status=status,
+        stage=stage,
+        attempts=attempts,
+        error=error,
+        error_status_code=error_status_code,
+        filename=filename,
+    )
+
+
+@app.post("/installations/refresh", status_code=204)
+async def refresh_installations(
+    request: Request,
+    x_hub_signature_256: Annotated[str | None, Header()] = None,
+    x_github_event: Annotated[str | None, Header()] = None,
+) -> Response:
+    """Receive the GitHub App's webhook deliveries to keep the installation index up to date."""
+    body = await request.body()
+    if not installations.verify_webhook_signature(body, x_hub_signature_256):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    if x_github_event == "installation":
+        await installations.apply_installation_event(json.loads(body))
+
+    return Response(status_code=204)
+
+
 class LoginStatusResponse(BaseModel):
     username: str | None
     logged_in: bool
@@ -186,36 +270,38 @@ class LoginStatusResponse(BaseModel):
 
 @app.get("/status", response_model=LoginStatusResponse)
 async def status(http_request: Request) -> JSONResponse:
-    try:
-        client = await sb.get_session(http_request)
-        client_session = await client.auth.get_session()
-        if client_session is None:
-            raise HTTPException(status_code=401, detail="User not authenticated")
-
-        gh_identity = await sb.get_github_identity(client)
-    except HTTPException as e:
-        if e.status_code != 401:
-            raise
-
-        return JSONResponse(
-            content=LoginStatusResponse(
-                username=None,
-                logged_in=False,
-            ).model_dump()
-        )
-
-    user_name = gh_identity.identity_data["user_name"]
+    state = await sessions.resolve(http_request)
     response = JSONResponse(
         content=LoginStatusResponse(
-            username=user_name,
-            logged_in=True,
+            username=state.user_name,
+            logged_in=state.user_name is not None,
         ).model_dump()
     )
-    sb.set_response_token_cookies_(
-        response,
-        access_token=client_session.access_token,
-        refresh_token=client_session.refresh_token,
+    if state.access_token is not None and state.refresh_token is not None:
+        sb.set_response_token_cookies_(
+            response,
+            access_token=state.access_token,
+            refresh_token=state.refresh_token,
+        )
+
+    return response
+
+
+@app.get("/session/stream")
+async def session_stream(http_request: Request) -> StreamingResponse:
+    """Stream the login state, sent on connecting and whenever it changes, instead of having `/status` polled."""
+    state = await sessions.resolve(http_request)
+    response = StreamingResponse(
+        sessions.stream(state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+    if state.access_token is not None and state.refresh_token is not None:
+        sb.set_response_token_cookies_(
+            response,
+            access_token=state.access_token,
+            refresh_token=state.refresh_token,
+        )
 
     return response
 
@@ -237,15 +323,117 @@ async def verify_pr(
     return VerifyPRResponse(is_valid=is_valid)
 
 
-class ArtworksResponse(BaseModel):
-    artworks: list[tuple[str, str]]
+# Enough to audit the whole data branch in a few requests, each item is about 100 bytes of JSON
+VERIFY_PR_BATCH_LIMIT = 10_000
+
+
+class VerifyPRItem(BaseModel):
+    filename: str
+    commit_hash: str
+
+
+class VerifyPRBatchRequest(BaseModel):
+    items: list[VerifyPRItem] = Field(max_length=VERIFY_PR_BATCH_LIMIT)
+
 
+class VerifyPRBatchResult(VerifyPRItem):
+    is_valid: bool
+
+
+class VerifyPRBatchResponse(BaseModel):
+    results: list[VerifyPRBatchResult]
+
+
+@app.post("/verify_pr/batch")
+async def verify_pr_batch(request: VerifyPRBatchRequest) -> VerifyPRBatchResponse:
+    """Like `/verify_pr` for many pull requests at once, with the results in the order of `items`."""
+    exist = await pg.github_files_check_exist_many([(item.filename, item.commit_hash) for item in request.items])
+
+    return VerifyPRBatchResponse(
+        results=[
+            VerifyPRBatchResult(filename=item.filename, commit_hash=item.commit_hash, is_valid=is_valid)
+            for item, is_valid in zip(request.items, exist, strict=True)
+        ]
+    )
+
+
+@app.get("/artworks", response_model=listing.ArtworksResponse)
+async def artworks(
+    after_id: Annotated[int | None, Query(ge=0)] = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
+    snapshot = await listing.get_snapshot()
+    # The listing at any given URL only changes with the table version, so it doubles as the ETag for deltas too.
+    # `no-cache` makes browsers revalidate every poll, which is answered with a body-less 304 while nothing changed.
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+
+    if listing.etag_matches(if_none_match, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+
+    if after_id is None:
+        return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+    if after_id >= snapshot.version:
+        # Caught up, no need to ask Postgres
+        delta = listing.to_response([], after_id=after_id, has_more=False)
+    else:
+        # Fetch one extra row to know whether the client has to come back for more
+        rows = await pg.github_files_get_after(after_id, limit + 1)
+        delta = listing.to_response(rows[:limit], after_id=after_id, has_more=len(rows) > limit)
+
+    return Response(content=delta.model_dump_json(), media_type="application/json", headers=headers)
+
+
+@app.get("/artworks/stream")
+async def artworks_stream(
+    after_id: Annotated[int | None, Query(ge=0)] = None,
+    last_event_id: Annotated[int | None, Header()] = None,
+) -> StreamingResponse:
+    # Browsers send `Last-Event-ID` on their own when reconnecting, it is newer than the `after_id` in the URL
+    cursor = last_event_id if last_event_id is not None else after_id
+
+    return StreamingResponse(
+        feed.stream(cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class HealthResponse(BaseModel):
+    db_pool: dict[str, int]
+    stream_subscribers: int
+    github_token_caches: dict[str, dict[str, int]]
+    github_resilience: dict[str, dict[str, int]]
+    installation_cache: dict[str, int]
+    verified_access_tokens: dict[str, int]
+    session_streams: dict[str, int]
+    upstream_forks: dict[str, int]
+    duplicate_index: dict[str, int]
+    publish_rate_limits: dict[str, int]
+
+
+@app.get("/health")
+async def health() -> HealthResponse:
+    return HealthResponse(
+        db_pool=pg.get_pool_stats(),
+        stream_subscribers=len(feed.broadcaster),
+        github_token_caches=gh.get_token_cache_stats(),
+        github_resilience=gh.get_resilience_stats(),
+        installation_cache=installations.get_cache_stats(),
+        verified_access_tokens=sb.get_verified_token_stats(),
+        session_streams=sessions.get_stats(),
+        upstream_forks=forks.get_stats(),
+        duplicate_index=dedup.get_stats(),
+        publish_rate_limits=ratelimit.get_stats(),
+    )
 
-@app.get("/artworks")
-async def artworks() -> ArtworksResponse:
-    works = await pg.github_files_get_all()
 
-    return ArtworksResponse(artworks=works)
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """Expose latency histograms, and the numbers `/health` shows, for Prometheus to scrape."""
+    stats = await health()
+    return Response(metrics.render(stats.model_dump()), media_type=metrics.CONTENT_TYPE)
 
 
 if __name__ == "__main__":
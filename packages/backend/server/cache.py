@@ -0,0 +1,86 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class ExpiringCache(Generic[K, V]):
+    """Cache values until `margin` seconds before they expire, fetching a missing key once however many callers ask.
+
+    `fetch` returns the value together with its expiry as a UNIX timestamp. With `max_size` set, the least recently
+    used entries are evicted first.
+    """
+
+    def __init__(self, margin: float = 0.0, max_size: int | None = None) -> None:
+        self.margin = margin
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Misses that joined a fetch already in flight instead of starting their own
+        self.coalesced = 0
+        self._entries: OrderedDict[K, tuple[V, float]] = OrderedDict()
+        self._inflight: dict[K, asyncio.Task[tuple[V, float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_cached(self, key: K) -> V | None:
+        """Get a value without fetching, `None` if it is missing or (about to be) expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at - self.margin <= time.time():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def get(self, key: K, fetch: Callable[[], Awaitable[tuple[V, float]]]) -> V:
+        value = self.get_cached(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._store(key, done))
+
+        # Shielded so a caller giving up doesn't cancel the fetch others are waiting on
+        value, _ = await asyncio.shield(task)
+        return value
+
+    def set(self, key: K, value: V, expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        if self.max_size is not None and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get_stats(self) -> dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+    def _store(self, key: K, task: asyncio.Task[tuple[V, float]]) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        self.set(key, *task.result())
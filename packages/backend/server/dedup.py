@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import os
+from array import array
+
+from . import pg
+
+# Artworks whose perceptual hashes differ in at most this many of their 64 bits are refused as near-duplicates of
+# each other. Unset by default, canvases with little drawn on them hash alike even when they aren't copies.
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("ARTWORK_NEAR_DUPLICATE_DISTANCE", "-1"))
+SYNC_BATCH_SIZE = 10_000
+
+HASH_BITS = 64
+# About 21 bits each, so that with a million hashes stored most chunk values are shared by no more than one of them
+N_CHUNKS = 3
+
+
+class HashIndex:
+    """Find 64-bit hashes within a Hamming distance of a query, by multi-index hashing.
+
+    The hashes are split into `N_CHUNKS` chunks, and any two within `max_distance` of each other have a chunk that
+    differs in at most `max_distance // N_CHUNKS` bits. Only the hashes with such a chunk are compared in full, found
+    by looking up every variant of the query's chunks with that many bits flipped. The number of variants grows
+    steeply with the distance, with a million hashes lookups take well under a millisecond up to a distance of 8.
+    """
+
+    def __init__(self, max_distance: int) -> None:
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"Distance must be between 0 and {HASH_BITS - 1}")
+
+        self.max_distance = max_distance
+        chunk_distance = max_distance // N_CHUNKS
+        bounds = [HASH_BITS * i // N_CHUNKS for i in range(N_CHUNKS + 1)]
+        # Bit offset, mask and the bits to flip when probing, of each chunk
+        self._chunks = [
+            (
+                start,
+                (1 << (end - start)) - 1,
+                [
+                    sum(1 << bit for bit in bits)
+                    for n_bits in range(chunk_distance + 1)
+                    for bits in itertools.combinations(range(end - start), n_bits)
+                ],
+            )
+            for start, end in itertools.pairwise(bounds)
+        ]
+        # Positions in `_hashes` by the value of each chunk
+        self._tables: list[dict[int, array[int]]] = [{} for _ in self._chunks]
+        self._hashes: array[int] = array("Q")
+        self._ids: array[int] = array("q")
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, value: int, row_id: int) -> None:
+        position = len(self._hashes)
+        self._hashes.append(value)
+        self._ids.append(row_id)
+
+        for table, (shift, mask, _) in zip(self._tables, self._chunks, strict=True):
+            key = value >> shift & mask
+            if (bucket := table.get(key)) is None:
+                bucket = table[key] = array("I")
+            bucket.append(position)
+
+    def find(self, value: int) -> int | None:
+        """Get the id of the closest stored hash within the distance, if there is one."""
+        best_id = None
+        best_distance = self.max_distance + 1
+        for table, (shift, mask, flips) in zip(self._tables, self._chunks, strict=True):
+            key = value >> shift & mask
+            for flip in flips:
+                for position in table.get(key ^ flip, ()):
+                    distance = (self._hashes[position] ^ value).bit_count()
+                    if distance < best_distance:
+                        best_id = self._ids[position]
+                        best_distance = distance
+                        if distance == 0:
+                            return best_id
+
+        return best_id
+
+
+_index: HashIndex | None = None
+_indexed_id = 0
+_lock = asyncio.Lock()
+
+
+def get_stats() -> dict[str, int]:
+    return {"hashes": len(_index) if _index is not None else 0, "indexed_id": _indexed_id}
+
+
+async def sync() -> HashIndex:
+    """Add the hashes of artworks published since the last sync, by any worker, to the index."""
+    global _index, _indexed_id
+
+    async with _lock:
+        if _index is None:
+            _index = HashIndex(NEAR_DUPLICATE_DISTANCE)
+
+        while rows := await pg.github_files_get_phashes_after(_indexed_id, SYNC_BATCH_SIZE):
+            for row_id, phash in rows:
+                if phash is not None:
+                    _index.add(phash, row_id)
+            _indexed_id = rows[-1][0]
+
+        return _index
+
+
+async def warm_up() -> None:
+    """Load the index ahead of the first publish, which would otherwise wait for all hashes to be read."""
+    if NEAR_DUPLICATE_DISTANCE >= 0:
+        await sync()
+
+
+async def find_near_duplicate(phash: int) -> int | None:
+    """Get the id of a published artwork that looks like `phash`, `None` if there is none or the check is off."""
+    if NEAR_DUPLICATE_DISTANCE < 0:
+        return None
+
+    index = await sync()
+    return index.find(phash)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from . import utils
@@ -15,6 +16,12 @@ POST_AUTH_REDIRECT_URI = utils.assure_get_env("POST_AUTH_REDIRECT_URI")
 
 JWT_SECRET = utils.assure_get_env("JWT_SECRET")
 
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+# Secret of the GitHub App's webhook, installation events are rejected without it
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+# "git-data" commits through the blob/tree/commit/ref endpoints, "contents" through the older Contents API
+GITHUB_COMMIT_API = os.getenv("GITHUB_COMMIT_API", "git-data")
+
 GIT_UPSTREAM_OWNER = utils.assure_get_env("GIT_UPSTREAM_OWNER")
 GIT_UPSTREAM_REPO = utils.assure_get_env("GIT_UPSTREAM_REPO")
 GIT_UPSTREAM_DATA_BRANCH = utils.assure_get_env("GIT_UPSTREAM_DATA_BRANCH")
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+from collections.abc import AsyncIterator
+
+import psycopg
+from psycopg import sql
+
+from . import listing, pg
+
+# Filled by the trigger created in migration 4
+CHANNEL = "github_files_inserted"
+
+HEARTBEAT_INTERVAL = float(os.getenv("ARTWORKS_STREAM_HEARTBEAT_SECONDS", "15"))
+RECONNECT_DELAY = 5.0
+# A subscriber this far behind is disconnected, it catches up through `Last-Event-ID` when the browser reconnects
+MAX_QUEUED_EVENTS = 32
+
+Event = tuple[int, bytes]
+
+
+class Broadcaster:
+    """Fan out pre-encoded events to every subscriber without ever blocking the publisher."""
+
+    def __init__(self, max_queued: int) -> None:
+        self._max_queued = max_queued
+        self._subscribers: set[asyncio.Queue[Event | None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue[Event | None]:
+        queue: asyncio.Queue[Event | None] = asyncio.Queue(self._max_queued)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue[Event | None]) -> None:
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Event) -> None:
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def close(self) -> None:
+        """Ask every subscriber to finish, e.g. so open streams don't hold up a graceful shutdown."""
+        for queue in list(self._subscribers):
+            self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue[Event | None]) -> None:
+        self.unsubscribe(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+
+logger = logging.getLogger(__name__)
+
+broadcaster = Broadcaster(MAX_QUEUED_EVENTS)
+_last_broadcast_id = 0
+
+
+def encode_event(rows: list[pg.ArtworkRow], after_id: int) -> Event:
+    """Encode rows as a server-sent event carrying the same payload as an `/artworks` delta."""
+    response = listing.to_response(rows, after_id=after_id, has_more=False)
+    data = response.model_dump_json()
+    return response.cursor, f"id: {response.cursor}\nevent: artworks\ndata: {data}\n\n".encode()
+
+
+def _broadcast(rows: list[pg.ArtworkRow]) -> None:
+    global _last_broadcast_id
+
+    # Ids become visible in order, `pg.github_files_insert_row` serializes inserts, so a lower one can't come later
+    rows = [row for row in rows if row[0] > _last_broadcast_id]
+    if not rows:
+        return
+
+    # Make sure anyone (re)connecting from now on sees these rows in their catch-up
+    listing.invalidate()
+    broadcaster.publish(encode_event(rows, after_id=_last_broadcast_id))
+    _last_broadcast_id = rows[-1][0]
+
+
+async def listen() -> None:
+    """Relay `github_files` inserts from Postgres to this worker's subscribers until cancelled."""
+    global _last_broadcast_id
+
+    # Only rows inserted from now on are news
+    started = False
+    while True:
+        try:
+            if not started:
+                _last_broadcast_id = await pg.github_files_get_latest_id()
+                started = True
+
+            conn = await psycopg.AsyncConnection.connect(pg.get_conninfo(), autocommit=True)
+            async with conn:
+                await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(CHANNEL)))
+                # Anything inserted while we weren't listening, e.g. during a database restart
+                _broadcast(await pg.github_files_get_after(_last_broadcast_id))
+
+                async for notify in conn.notifies():
+                    row = json.loads(notify.payload)
+                    # Rows from before migration 11 and notifications sent by older workers have no mip levels
+                    _broadcast([(row["id"], row["github_username"], row["filename"], row.get("mip_levels", []))])
+        except psycopg.OperationalError:
+            await asyncio.sleep(RECONNECT_DELAY)
+        except Exception:
+            # E.g. a malformed notification, anything missed meanwhile is caught up on after reconnecting
+            logger.exception("Relaying new artworks failed, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def stream(cursor: int | None) -> AsyncIterator[bytes]:
+    """Stream new artworks as server-sent events, starting with everything after `cursor` if given."""
+    # Subscribe before catching up so nothing published in between is lost, duplicates are skipped by id below
+    queue = broadcaster.subscribe()
+    try:
+        yield b"retry: 5000\n\n"
+
+        if cursor is not None:
+            snapshot = await listing.get_snapshot()
+            while cursor < snapshot.version:
+                rows = await pg.github_files_get_after(cursor, 500)
+                if not rows:
+                    break
+
+                event_id, data = encode_event(rows, after_id=cursor)
+                yield data
+                cursor = event_id
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+            except TimeoutError:
+                # Keeps proxies from timing out idle connections and lets us notice dead ones
+                yield b": heartbeat\n\n"
+                continue
+
+            if event is None:
+                return
+
+            event_id, data = event
+            if cursor is not None and event_id <= cursor:
+                continue
+
+            yield data
+            cursor = event_id
+    finally:
+        broadcaster.unsubscribe(queue)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import httpx
+
+from . import env, gh
+
+REFRESH_INTERVAL = float(os.getenv("GITHUB_FORKS_REFRESH_SECONDS", "300"))
+# Repositories not known as forks trigger a refresh at most this often, so they can't hammer GitHub
+MIN_REFRESH_INTERVAL = 30.0
+
+
+@dataclass(frozen=True)
+class _Page:
+    etag: str | None
+    full_names: list[str]
+    has_next: bool
+
+
+logger = logging.getLogger(__name__)
+
+_pages: list[_Page] = []
+_fork_full_names: frozenset[str] = frozenset()
+_refresh_lock = asyncio.Lock()
+_refreshed_at = float("-inf")
+
+
+def get_stats() -> dict[str, int]:
+    return {"forks": len(_fork_full_names), "pages": len(_pages)}
+
+
+def clear() -> None:
+    global _pages, _fork_full_names, _refreshed_at
+
+    _pages = []
+    _fork_full_names = frozenset()
+    _refreshed_at = float("-inf")
+
+
+async def refresh() -> None:
+    """Page through all forks of the upstream repository, re-downloading only the pages that changed."""
+    global _pages, _fork_full_names, _refreshed_at
+
+    app_token = await gh.get_app_token()
+    token = await gh.get_app_installation_token(env.GIT_UPSTREAM_APP_INSTALLATION_ID, app_token)
+
+    pages: list[_Page] = []
+    has_next = True
+    while has_next:
+        previous = _pages[len(pages)] if len(pages) < len(_pages) else None
+        response = await gh.get_app_installation_repository_forks(
+            token,
+            page=len(pages) + 1,
+            etag=previous.etag if previous is not None else None,
+        )
+
+        if response.forks is None and previous is not None:
+            # Whether more pages follow isn't part of the unchanged body, and a full page may have gained a next one
+            # even if the 304 didn't say so
+            page = _Page(
+                etag=previous.etag,
+                full_names=previous.full_names,
+                has_next=response.has_next or len(previous.full_names) >= gh.FORKS_PER_PAGE,
+            )
+        else:
+            page = _Page(
+                etag=response.etag,
+                full_names=[repo["full_name"] for repo in response.forks or []],
+                has_next=response.has_next,
+            )
+
+        pages.append(page)
+        has_next = page.has_next
+
+    _pages = pages
+    _fork_full_names = frozenset(name for page in pages for name in page.full_names)
+    _refreshed_at = time.monotonic()
+
+
+async def refresh_forever() -> None:
+    while True:
+        try:
+            async with _refresh_lock:
+                await refresh()
+        except httpx.HTTPError:
+            # Keep answering from the forks we know, the next round may well succeed
+            pass
+        except Exception:
+            logger.exception("Refreshing upstream forks failed")
+
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+
+async def is_fork(full_name: str) -> bool:
+    """Check whether a repository is a fork of the upstream repository, usually without asking GitHub."""
+    if full_name in _fork_full_names:
+        return True
+
+    # Possibly forked since the last refresh
+    async with _refresh_lock:
+        if time.monotonic() - _refreshed_at >= MIN_REFRESH_INTERVAL:
+            await refresh()
+
+    return full_name in _fork_full_names
@@ -1,140 +1,387 @@
-import base64  # noqa: F401
+import base64
 import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from datetime import datetime
 from typing import Any
 
 import httpx
 import jwt
 
-from . import env
+from . import cache, env, metrics, resilience, utils
 
+# GitHub rejects app JWTs that are valid for more than 10 minutes
+APP_TOKEN_LIFETIME = 10 * 60
+# Cached tokens are replaced this long before they expire, so they can't run out in the middle of a publish
+TOKEN_EXPIRY_MARGIN = 2 * 60
+# Bytes of the image base64-encoded at a time while uploading a blob, a multiple of 3 so the pieces need no padding
+BLOB_CHUNK_SIZE = 3 * 64 * 1024
+# The most GitHub lists at once
+FORKS_PER_PAGE = 100
 
-def get_app_token() -> str:
-    """Generate a JWT token for the GitHub App."""
-    now = int(time.time())
-    payload = {
-        "iat": now,
-        "exp": now + (3 * 60),  # JWT valid for 3 minutes
-        "iss": env.CLIENT_ID,  # GitHub App ID
+_client: httpx.AsyncClient | None = None
+_app_tokens: cache.ExpiringCache[str, str] = cache.ExpiringCache(margin=TOKEN_EXPIRY_MARGIN)
+_installation_tokens: cache.ExpiringCache[int, str] = cache.ExpiringCache(margin=TOKEN_EXPIRY_MARGIN)
+# Commits never change, so the trees they point at can be cached forever
+_commit_tree_shas: dict[str, str] = {}
+_circuit_breaker = resilience.CircuitBreaker(resilience.CIRCUIT_FAILURE_THRESHOLD, resilience.CIRCUIT_RESET_TIMEOUT)
+_rate_limits = resilience.RateLimits(resilience.RATE_LIMIT_RESERVE, resilience.MAX_THROTTLE)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared GitHub API client, so requests reuse kept-alive HTTP/2 connections instead of new handshakes."""
+    global _client
+
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=env.GITHUB_API_URL,
+            headers={"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"},
+            transport=resilience.GuardedTransport(
+                httpx.AsyncHTTPTransport(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120),
+                ),
+                _circuit_breaker,
+                _rate_limits,
+            ),
+            # Generous read and write timeouts, uploads carry the whole image in one request body
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        )
+
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+
+    if _client is None:
+        return
+
+    client, _client = _client, None
+    await client.aclose()
+
+
+def get_token_cache_stats() -> dict[str, dict[str, int]]:
+    return {
+        "app_token": _app_tokens.get_stats(),
+        "installation_tokens": _installation_tokens.get_stats(),
+    }
+
+
+def get_resilience_stats() -> dict[str, dict[str, int]]:
+    return {
+        "circuit": _circuit_breaker.get_stats(),
+        "rate_limits": _rate_limits.get_stats(),
+        "calls": resilience.get_retry_stats(),
     }
 
-    return jwt.encode(payload, env.PRIVATE_KEY, algorithm="RS256")
 
+def clear_token_caches() -> None:
+    _app_tokens.clear()
+    _installation_tokens.clear()
+
+
+async def get_app_token() -> str:
+    """Get a JWT token for the GitHub App, signing a new one only when the cached one is about to expire.
+
+    Not timed as an upstream call, signing happens locally.
+    """
+
+    async def sign() -> tuple[str, float]:
+        now = int(time.time())
+        issued_at = now - 60  # Backdated to allow for clock drift, as recommended by GitHub
+        expires_at = issued_at + APP_TOKEN_LIFETIME
+        payload = {
+            "iat": issued_at,
+            "exp": expires_at,
+            "iss": env.CLIENT_ID,  # GitHub App ID
+        }
+
+        return jwt.encode(payload, env.PRIVATE_KEY, algorithm="RS256"), expires_at
+
+    return await _app_tokens.get(env.CLIENT_ID, sign)
 
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
 async def get_app_installations(app_token: str) -> list[dict[str, Any]]:
-    """Get all installations of the GitHub App."""
-    headers = {
-        "Authorization": f"Bearer {app_token}",
-        "Accept": "application/vnd.github+json",
-    }
-    async with httpx.AsyncClient() as client:
-        r = await client.get("https://api.github.com/app/installations", headers=headers)
+    """Get all installations of the GitHub App, following pagination."""
+    headers = {"Authorization": f"Bearer {app_token}"}
+    installations: list[dict[str, Any]] = []
+
+    url: str | None = "/app/installations?per_page=100"
+    while url is not None:
+        r = await get_client().get(url, headers=headers)
         r.raise_for_status()
-        return r.json()
+        installations.extend(r.json())
+        url = r.links.get("next", {}).get("url")
 
+    return installations
 
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
 async def get_app_installation_repositories(app_installation_token: str) -> dict[str, Any]:
     """Get all repositories a GitHub App installation has access to."""
-    headers = {
-        "Authorization": f"Bearer {app_installation_token}",
-        "Accept": "application/vnd.github+json",
-    }
-    async with httpx.AsyncClient() as client:
-        r = await client.get("https://api.github.com/installation/repositories", headers=headers)
-        r.raise_for_status()
-        return r.json()
+    headers = {"Authorization": f"Bearer {app_installation_token}"}
+    r = await get_client().get("/installation/repositories", headers=headers)
+    r.raise_for_status()
+    return r.json()
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
+async def mint_app_installation_token(installation_id: int, app_token: str) -> tuple[str, float]:
+    """Get a new installation token from GitHub, with when it expires as a Unix timestamp.
+
+    A retried mint is at worst a token that is never used.
+    """
+    headers = {"Authorization": f"Bearer {app_token}"}
+    r = await get_client().post(f"/app/installations/{installation_id}/access_tokens", headers=headers)
+    r.raise_for_status()
+    data = r.json()
+    return data["token"], datetime.fromisoformat(data["expires_at"]).timestamp()
 
 
 async def get_app_installation_token(installation_id: int, app_token: str) -> str:
     """Get an installation token for the GitHub App.
 
-    This token is used to perform actions on behalf of the installation.
+    This token is used to perform actions on behalf of the installation. Tokens are valid for an hour and cached per
+    installation, `app_token` is only used when a new one has to be minted. Only minting is timed as an upstream call.
     """
-    headers = {
-        "Authorization": f"Bearer {app_token}",
-        "Accept": "application/vnd.github+json",
-    }
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f"https://api.github.com/app/installations/{installation_id}/access_tokens",
-            headers=headers,
-        )
-        r.raise_for_status()
-        return r.json()["token"]
+    return await _installation_tokens.get(
+        installation_id, lambda: mint_app_installation_token(installation_id, app_token)
+    )
 
 
-async def get_app_installation_repository_forks(app_installation_token: str) -> list[dict[str, Any]]:
-    headers = {
-        "Authorization": f"Bearer {app_installation_token}",
-        "Accept": "application/vnd.github+json",
-    }
-    async with httpx.AsyncClient() as client:
-        r = await client.get(
-            f"https://api.github.com/repos/{env.GIT_UPSTREAM_OWNER}/{env.GIT_UPSTREAM_REPO}/forks",
-            headers=headers,
-        )
+@dataclass(frozen=True)
+class ForksPage:
+    forks: list[dict[str, Any]] | None  # `None` when the page didn't change since `etag` was sent
+    etag: str | None
+    has_next: bool
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
+async def get_app_installation_repository_forks(
+    app_installation_token: str,
+    page: int = 1,
+    etag: str | None = None,
+) -> ForksPage:
+    """Get a page of forks of the upstream repository, oldest first so earlier pages rarely change.
+
+    With the `etag` of a previous response, GitHub answers with a 304 (which doesn't count against the rate limit) if
+    the page is unchanged.
+    """
+    headers = {"Authorization": f"Bearer {app_installation_token}"}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+
+    r = await get_client().get(
+        f"/repos/{env.GIT_UPSTREAM_OWNER}/{env.GIT_UPSTREAM_REPO}/forks",
+        params={"sort": "oldest", "per_page": FORKS_PER_PAGE, "page": page},
+        headers=headers,
+    )
+    if r.status_code == 304:
+        # The ETag only covers the page's body, a full last page stays unchanged when a fork is added after it
+        return ForksPage(forks=None, etag=etag, has_next="next" in r.links)
+
+    r.raise_for_status()
+    return ForksPage(forks=r.json(), etag=r.headers.get("ETag"), has_next="next" in r.links)
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+async def create_branch(headers: dict[str, str], owner: str, repo: str, branch: str, sha: str) -> None:
+    r = await get_client().post(
+        f"/repos/{owner}/{repo}/git/refs",
+        headers=headers,
+        json={"ref": f"refs/heads/{branch}", "sha": sha},
+    )
+    r.raise_for_status()
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+async def put_file_contents(
+    headers: dict[str, str], owner: str, repo: str, branch: str, file_path: str, content: bytes
+) -> str:
+    """Commit a file to a branch through the Contents API, returning the commit hash."""
+    r = await get_client().put(
+        f"/repos/{owner}/{repo}/contents/{file_path}",
+        headers=headers,
+        json={
+            "message": f"Add {file_path}",
+            "content": base64.b64encode(content).decode("utf-8"),
+            "branch": branch,
+        },
+    )
+    r.raise_for_status()
+    commit_hash: str = r.json()["commit"]["sha"]
+
+    return commit_hash
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+async def create_pull_request(
+    root_headers: dict[str, str], fork_owner: str, fork_name: str, branch: str, title: str
+) -> None:
+    """Open a pull request from the fork's branch against the upstream data branch."""
+    r = await get_client().post(
+        f"/repos/{env.GIT_UPSTREAM_OWNER}/{env.GIT_UPSTREAM_REPO}/pulls",
+        headers=root_headers,
+        json={
+            "title": title,
+            "head": f"{fork_owner}:{branch}",
+            "head_repo": fork_name,
+            "base": env.GIT_UPSTREAM_DATA_BRANCH,
+            "maintainer_can_modify": False,
+        },
+    )
+    r.raise_for_status()
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+async def _commit_with_contents_api(
+    headers: dict[str, str],
+    fork_owner: str,
+    fork_name: str,
+    new_branch: str,
+    files: dict[str, bytes],
+) -> str:
+    if len(files) != 1:
+        raise ValueError("The Contents API commits a single file at a time")
+
+    [(file_path, file_content)] = files.items()
+
+    # Get SHA of the data branch to create a new branch off of in the fork
+    # r = await client.get(
+    #     f"/repos/{env.GIT_UPSTREAM_OWNER}/{env.GIT_UPSTREAM_REPO}/git/refs/heads/{env.GIT_UPSTREAM_DATA_BRANCH}",
+    #     headers=headers,
+    # )
+    # r.raise_for_status()
+    # base_sha = r.json()["object"]["sha"]
+
+    await create_branch(headers, fork_owner, fork_name, new_branch, env.GIT_UPSTREAM_DATA_BRANCH_FIRST_COMMIT_HASH)
+    return await put_file_contents(headers, fork_owner, fork_name, new_branch, file_path, file_content)
+
+
+async def _iter_blob_body(content: bytes) -> AsyncIterator[bytes]:
+    """Yield the JSON body of a blob upload piece by piece, instead of building the whole base64 string at once."""
+    yield b'{"encoding":"base64","content":"'
+    view = memoryview(content)
+    for start in range(0, len(view), BLOB_CHUNK_SIZE):
+        yield base64.b64encode(view[start : start + BLOB_CHUNK_SIZE])
+    yield b'"}'
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
+async def create_blob(headers: dict[str, str], owner: str, repo: str, content: bytes) -> str:
+    body_length = len('{"encoding":"base64","content":""}') + (len(content) + 2) // 3 * 4
+    r = await get_client().post(
+        f"/repos/{owner}/{repo}/git/blobs",
+        headers={**headers, "Content-Type": "application/json", "Content-Length": str(body_length)},
+        content=_iter_blob_body(content),
+    )
+    r.raise_for_status()
+    blob_sha: str = r.json()["sha"]
+
+    return blob_sha
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
+async def get_commit_tree_sha(headers: dict[str, str], owner: str, repo: str, commit_sha: str) -> str:
+    tree_sha = _commit_tree_shas.get(commit_sha)
+    if tree_sha is None:
+        r = await get_client().get(f"/repos/{owner}/{repo}/git/commits/{commit_sha}", headers=headers)
         r.raise_for_status()
-        return r.json()
+        tree_sha = _commit_tree_shas[commit_sha] = r.json()["tree"]["sha"]
+
+    return tree_sha
+
+
+@metrics.timed(metrics.upstream_calls, "github")
+@resilience.retry
+async def create_tree(
+    headers: dict[str, str], owner: str, repo: str, base_tree_sha: str, blobs: dict[str, str]
+) -> str:
+    """Create a tree of `base_tree_sha` with the blobs added, by path."""
+    r = await get_client().post(
+        f"/repos/{owner}/{repo}/git/trees",
+        headers=headers,
+        json={
+            "base_tree": base_tree_sha,
+            "tree": [
+                {"path": file_path, "mode": "100644", "type": "blob", "sha": blob_sha}
+                for file_path, blob_sha in blobs.items()
+            ],
+        },
+    )
+    r.raise_for_status()
+    tree_sha: str = r.json()["sha"]
 
+    return tree_sha
 
+
+@metrics.timed(metrics.upstream_calls, "github")
+async def _commit_with_git_data_api(
+    headers: dict[str, str],
+    fork_owner: str,
+    fork_name: str,
+    new_branch: str,
+    files: dict[str, bytes],
+) -> str:
+    client = get_client()
+    base_sha = env.GIT_UPSTREAM_DATA_BRANCH_FIRST_COMMIT_HASH
+
+    # A failed upload cancels the others, instead of leaving them to finish for nothing
+    base_tree_sha, *blob_shas = await utils.gather_or_cancel(
+        get_commit_tree_sha(headers, fork_owner, fork_name, base_sha),
+        *(create_blob(headers, fork_owner, fork_name, file_content) for file_content in files.values()),
+    )
+
+    blobs = dict(zip(files, blob_shas, strict=True))
+    tree_sha = await create_tree(headers, fork_owner, fork_name, base_tree_sha, blobs)
+
+    r = await client.post(
+        f"/repos/{fork_owner}/{fork_name}/git/commits",
+        headers=headers,
+        json={"message": f"Add {next(iter(files))}", "tree": tree_sha, "parents": [base_sha]},
+    )
+    r.raise_for_status()
+    commit_hash: str = r.json()["sha"]
+
+    # Creating the branch last points it straight at the commit, no separate update needed
+    await create_branch(headers, fork_owner, fork_name, new_branch, commit_hash)
+
+    return commit_hash
+
+
+@metrics.timed(metrics.upstream_calls, "github")
 async def commit_and_create_pull_request(
     root_app_installation_token: str,
     app_installation_token: str,
     fork_owner: str,
     fork_name: str,
     new_branch: str,
-    file_path: str,
-    file_content: bytes,
+    files: dict[str, bytes],
     pr_title: str,
 ) -> str:
-    root_auth_headers = {"Authorization": f"token {root_app_installation_token}"}
-    auth_headers = {"Authorization": f"token {app_installation_token}"}
-    meta_headers = {"Accept": "application/vnd.github+json"}
-
-    root_headers = root_auth_headers | meta_headers
-    headers = auth_headers | meta_headers
-
-    async with httpx.AsyncClient() as client:
-        # Get SHA of the data branch to create a new branch off of in the fork
-        # r = await client.get(
-        #     f"https://api.github.com/repos/{env.GIT_UPSTREAM_OWNER}/{env.GIT_UPSTREAM_REPO}/git/refs/heads/{env.GIT_UPSTREAM_DATA_BRANCH}",
-        #     headers=headers,
-        # )
-        # r.raise_for_status()
-        # base_sha = r.json()["object"]["sha"]
-
-        # Create a new branch in the fork
-        r = await client.post(
-            f"https://api.github.com/repos/{fork_owner}/{fork_name}/git/refs",
-            headers=headers,
-            json={"ref": f"refs/heads/{new_branch}", "sha": env.GIT_UPSTREAM_DATA_BRANCH_FIRST_COMMIT_HASH},
-        )
-        r.raise_for_status()
+    """Commit `files`, by path, to a new branch of the fork in a single commit and open a pull request for it.
 
-        # Commit file contents to the new branch
-        r = await client.put(
-            f"https://api.github.com/repos/{fork_owner}/{fork_name}/contents/{file_path}",
-            headers=headers,
-            json={
-                "message": f"Add {file_path}",
-                "content": base64.b64encode(file_content).decode("utf-8"),
-                "branch": new_branch,
-            },
-        )
-        r.raise_for_status()
-        commit_hash: str = r.json()["commit"]["sha"]
-
-        # Open PR against upstream
-        r = await client.post(
-            f"https://api.github.com/repos/{env.GIT_UPSTREAM_OWNER}/{env.GIT_UPSTREAM_REPO}/pulls",
-            headers=root_headers,
-            json={
-                "title": pr_title,
-                "head": f"{fork_owner}:{new_branch}",
-                "head_repo": fork_name,
-                "base": env.GIT_UPSTREAM_DATA_BRANCH,
-                "maintainer_can_modify": False,
-            },
-        )
-        r.raise_for_status()
+    The commit message names the first file.
+    """
+    root_headers = {"Authorization": f"token {root_app_installation_token}"}
+    headers = {"Authorization": f"token {app_installation_token}"}
+
+    commit = _commit_with_contents_api if env.GITHUB_COMMIT_API == "contents" else _commit_with_git_data_api
+    commit_hash = await commit(headers, fork_owner, fork_name, new_branch, files)
+
+    await create_pull_request(root_headers, fork_owner, fork_name, new_branch, pr_title)
 
     return commit_hash
+
+
+def can_commit_multiple_files() -> bool:
+    """Whether `commit_and_create_pull_request` can put more than one file in its commit."""
+    return env.GITHUB_COMMIT_API != "contents"
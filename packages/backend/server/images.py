@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any
+
+from fastapi import HTTPException
+from PIL import Image, features
+
+# Longest side of published artworks, the gallery never shows them much larger than this
+MAX_DIMENSION = int(os.getenv("ARTWORK_MAX_DIMENSION", "2048"))
+# "webp" or "avif", also the extension of published files
+FORMAT = os.getenv("ARTWORK_FORMAT", "webp")
+WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Longest sides of the smaller copies published next to each artwork, so the gallery can load distant ones cheaply
+MIP_LEVELS = [128, 512, 1024]
+# Uploads are refused before decoding above this, the editor's canvas is about 24 megapixels even on a 4K screen
+MAX_PIXELS = 40_000_000
+
+# Slower settings than these cost several times the CPU time for a few percent smaller files
+ENCODER_OPTIONS: dict[str, dict[str, Any]] = {
+    "webp": {"quality": 80, "method": 4},
+    "avif": {"quality": 60, "speed": 8},
+}
+
+if FORMAT not in ENCODER_OPTIONS or not features.check(FORMAT):
+    raise RuntimeError(f"Unsupported ARTWORK_FORMAT {FORMAT!r}")
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=WORKERS)
+
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+
+    if _executor is None:
+        return
+
+    executor, _executor = _executor, None
+    executor.shutdown(cancel_futures=True)
+
+
+@dataclass
+class NormalizedImage:
+    image: bytes
+    # Encoded smaller copies by the length of their longest side, only those smaller than the image itself
+    levels: dict[int, bytes]
+    # Of the decoded pixels, so the same artwork hashes the same however it was encoded
+    content_sha256: str
+    # 64-bit difference hash, close in Hamming distance for images that look alike
+    phash: int
+
+
+def level_filename(filename: str, size: int) -> str:
+    """Name the copy of an artwork at a mip level, e.g. `artwork.512.webp` for `artwork.webp`."""
+    stem, extension = filename.rsplit(".", 1)
+    return f"{stem}.{size}.{extension}"
+
+
+def _encode(image: Image.Image, image_format: str) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=image_format, **ENCODER_OPTIONS[image_format])
+    return output.getvalue()
+
+
+def content_hash(image: Image.Image) -> str:
+    sha256 = hashlib.sha256(f"{image.mode} {image.width}x{image.height}\n".encode())
+    sha256.update(image.tobytes())
+    return sha256.hexdigest()
+
+
+def difference_hash(image: Image.Image) -> int:
+    """Hash whether each pixel of a 9x8 grayscale thumbnail is brighter than its right neighbour."""
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.BOX).getdata())
+    bits = 0
+    for y in range(8):
+        for x in range(8):
+            bits = bits << 1 | (pixels[y * 9 + x] > pixels[y * 9 + x + 1])
+    return bits
+
+
+def normalize_sync(
+    data: bytes,
+    max_dimension: int = MAX_DIMENSION,
+    image_format: str = FORMAT,
+    mip_levels: list[int] = MIP_LEVELS,
+) -> NormalizedImage:
+    """Decode an image, shrink it to fit in `max_dimension` and re-encode it and its mip levels without metadata.
+
+    Also hashes the shrunk image, exactly and perceptually, to recognize artworks that were already published.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise ValueError(f"Image of {image.width}x{image.height} pixels is too large")
+
+        # Decodes only the first frame of animations
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        normalized = image.convert("RGBA" if has_alpha else "RGB")
+
+    levels = {}
+    # Largest first, each level is shrunk from the previous one instead of from the full image
+    level = normalized
+    for size in sorted(mip_levels, reverse=True):
+        if size >= max(level.size):
+            continue
+
+        level = level.copy()
+        level.thumbnail((size, size), Image.Resampling.LANCZOS)
+        levels[size] = _encode(level, image_format)
+
+    return NormalizedImage(
+        image=_encode(normalized, image_format),
+        levels=dict(sorted(levels.items())),
+        content_sha256=content_hash(normalized),
+        phash=difference_hash(normalized),
+    )
+
+
+async def normalize(data: bytes) -> NormalizedImage:
+    """Normalize an uploaded image in the process pool, so it neither blocks the event loop nor holds the GIL."""
+    global _executor
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), normalize_sync, data)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=422, detail="Upload is not a supported image") from e
+    except BrokenProcessPool:
+        # A worker died, e.g. killed for running out of memory, start over with a fresh pool next time
+        _executor = None
+        raise
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Any
+
+import httpx
+import psycopg
+
+from . import cache, env, gh, pg
+
+SYNC_INTERVAL = float(os.getenv("GITHUB_INSTALLATION_SYNC_SECONDS", "600"))
+# Lookups for users without an installation trigger a sync at most this often, so they can't hammer GitHub
+MIN_SYNC_INTERVAL = 30.0
+# Entries only go stale through uninstalls, this bounds how long workers that didn't get the webhook keep using them
+CACHE_TTL = 300.0
+
+logger = logging.getLogger(__name__)
+
+_cache: cache.ExpiringCache[str, int] = cache.ExpiringCache(max_size=10_000)
+_sync_lock = asyncio.Lock()
+_last_sync = float("-inf")
+
+
+def get_cache_stats() -> dict[str, int]:
+    return _cache.get_stats()
+
+
+async def sync() -> int:
+    """Replace the installation index with every installation of the GitHub App, returning how many there are."""
+    global _last_sync
+
+    app_token = await gh.get_app_token()
+    installations = [
+        (installation["account"]["login"], installation["id"])
+        for installation in await gh.get_app_installations(app_token)
+    ]
+    await pg.github_installations_replace_all(installations)
+    _cache.clear()
+    _last_sync = time.monotonic()
+
+    return len(installations)
+
+
+async def sync_forever() -> None:
+    while True:
+        try:
+            async with _sync_lock:
+                await sync()
+        except (httpx.HTTPError, psycopg.Error):
+            # Keep serving from the existing index, the next round may well succeed
+            pass
+        except Exception:
+            logger.exception("Syncing GitHub App installations failed")
+
+        await asyncio.sleep(SYNC_INTERVAL)
+
+
+async def _sync_if_stale() -> None:
+    async with _sync_lock:
+        if time.monotonic() - _last_sync >= MIN_SYNC_INTERVAL:
+            await sync()
+
+
+async def get_installation_id(account_login: str) -> int | None:
+    """Get the id of the GitHub App installation on an account, `None` if the app isn't installed there."""
+
+    async def fetch() -> tuple[int, float]:
+        installation_id = await pg.github_installations_get(account_login)
+        if installation_id is None:
+            # Possibly installed since the last sync and we didn't get (or aren't set up for) the webhook
+            await _sync_if_stale()
+            installation_id = await pg.github_installations_get(account_login)
+
+        if installation_id is None:
+            raise LookupError(account_login)
+
+        return installation_id, time.time() + CACHE_TTL
+
+    try:
+        return await _cache.get(account_login, fetch)
+    except LookupError:
+        return None
+
+
+def verify_webhook_signature(body: bytes, signature: str | None) -> bool:
+    """Check the `X-Hub-Signature-256` header GitHub signs webhook deliveries with."""
+    if env.GITHUB_WEBHOOK_SECRET is None or signature is None:
+        return False
+
+    expected = "sha256=" + hmac.new(env.GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+async def apply_installation_event(payload: dict[str, Any]) -> None:
+    """Update the index from an `installation` webhook event."""
+    installation = payload["installation"]
+    account_login = installation["account"]["login"]
+
+    if payload["action"] in ("created", "unsuspend", "new_permissions_accepted"):
+        await pg.github_installations_upsert(account_login, installation["id"])
+    elif payload["action"] in ("deleted", "suspend"):
+        await pg.github_installations_delete(installation["id"])
+
+    _cache.invalidate(account_login)
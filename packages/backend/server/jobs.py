@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime
+from typing import Any
+
+import httpx
+import psycopg
+from fastapi import HTTPException
+
+from . import dedup, env, forks, gh, images, installations, listing, metrics, pg, ratelimit, resilience, uploads, utils
+
+WORKERS = int(os.getenv("PUBLISH_WORKERS", "4"))
+# Jobs enqueued by this process wake its workers right away, this is how long the others may take to notice them
+POLL_INTERVAL = float(os.getenv("PUBLISH_POLL_SECONDS", "1"))
+MAX_ATTEMPTS = 5
+# Doubled after every failed attempt
+RETRY_DELAY = 5.0
+# A job running longer than this is assumed to have lost its worker and is picked up again
+LEASE = 300.0
+# An attempt taking longer than this is given up on and retried, well within the lease
+DEADLINE = float(os.getenv("PUBLISH_DEADLINE_SECONDS", "120"))
+
+logger = logging.getLogger(__name__)
+
+_wakeup = asyncio.Event()
+
+
+async def enqueue(user_name: str, image: uploads.Upload) -> uuid.UUID:
+    """Queue a publish of the image, taking it from the user's rate limit unless it is already queued."""
+    # The same image sent again while it's still being published, e.g. by a double click, gets the same job
+    job_id = await pg.publish_jobs_find_pending(user_name, image.sha256)
+    if job_id is not None:
+        return job_id
+
+    job_id, arrival_time = await pg.publish_jobs_insert(
+        user_name,
+        image.sha256,
+        image.size,
+        image.iter_chunks(),
+        ratelimit.EMISSION_INTERVAL,
+        ratelimit.BURST_TOLERANCE,
+    )
+    ratelimit.remember(user_name, arrival_time)
+    if job_id is None:
+        raise ratelimit.refuse(arrival_time)
+
+    _wakeup.set()
+    return job_id
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a failed attempt is worth retrying."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return resilience.is_retryable_response(error.response)
+
+    # Past the deadline, most likely because GitHub was slow. An open circuit or the rate limit (both transport errors
+    # that `gh` doesn't retry by itself) are waited out between attempts
+    return isinstance(error, httpx.TransportError | psycopg.OperationalError | TimeoutError)
+
+
+async def _process_image(image: bytes) -> images.NormalizedImage:
+    with metrics.timer(metrics.publish_stages, "processing_image"):
+        artwork = await images.normalize(image)
+
+        if await pg.github_files_find_by_content(artwork.content_sha256) is not None:
+            raise HTTPException(status_code=409, detail="This artwork has already been published")
+        if await dedup.find_near_duplicate(artwork.phash) is not None:
+            raise HTTPException(status_code=409, detail="This artwork is too similar to one already published")
+
+        return artwork
+
+
+async def _find_fork(user_name: str, app_token: str) -> tuple[str, dict[str, Any]]:
+    """Get a token for the user's installation and the fork it is installed on."""
+    with metrics.timer(metrics.publish_stages, "checking_installation"):
+        installation_id = await installations.get_installation_id(user_name)
+        if installation_id is None:
+            raise HTTPException(status_code=404, detail="No GitHub App installation found")
+
+        app_installation_token = await gh.get_app_installation_token(installation_id, app_token)
+        installation_repositories = await gh.get_app_installation_repositories(app_installation_token)
+
+        total_repo_count = installation_repositories["total_count"]
+        if total_repo_count == 0:
+            raise HTTPException(status_code=409, detail="GitHub App not installed on any repository")
+        elif total_repo_count > 1:
+            raise HTTPException(status_code=409, detail="GitHub App must be installed on a single repository")
+
+        repository = installation_repositories["repositories"][0]
+        if not repository["fork"] or not await forks.is_fork(repository["full_name"]):
+            raise HTTPException(
+                status_code=409, detail="The installation repository must be a fork of the main repository"
+            )
+
+        return app_installation_token, repository
+
+
+async def _publish(job_id: uuid.UUID, user_name: str, image: bytes) -> None:
+    """Commit the image to the user's fork, open a pull request for it and mark the job succeeded."""
+    await pg.publish_jobs_set_stage(job_id, "processing_image")
+    # Duplicates are refused before any GitHub call, not even a token is minted for them
+    artwork = await _process_image(image)
+
+    # Finding the user's fork and getting the upstream token don't depend on each other. Only reads happen until both
+    # succeeded, so a missing fork still costs no branch, pull request or CI run.
+    await pg.publish_jobs_set_stage(job_id, "checking_installation")
+    app_token = await gh.get_app_token()
+    (app_installation_token, repository), root_app_installation_token = await utils.gather_or_cancel(
+        _find_fork(user_name, app_token),
+        gh.get_app_installation_token(env.GIT_UPSTREAM_APP_INSTALLATION_ID, app_token),
+    )
+
+    # A fresh name on every attempt, so a retry never collides with the branch or file of one that failed halfway
+    now = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    random_sequence = secrets.token_hex(8)
+    file_stem = f"{now}_{random_sequence}"
+    file_name = f"{file_stem}.{images.FORMAT}"
+
+    files = {file_name: artwork.image}
+    # The Contents API makes a commit per file, and the data workflow only accepts pull requests with a single one
+    mip_levels = list(artwork.levels) if gh.can_commit_multiple_files() else []
+    for size in mip_levels:
+        files[images.level_filename(file_name, size)] = artwork.levels[size]
+
+    await pg.publish_jobs_set_stage(job_id, "creating_pull_request")
+    with metrics.timer(metrics.publish_stages, "creating_pull_request"):
+        commit_hash = await gh.commit_and_create_pull_request(
+            root_app_installation_token=root_app_installation_token,
+            app_installation_token=app_installation_token,
+            fork_owner=user_name,
+            fork_name=repository["name"],
+            new_branch=file_stem,
+            files=files,
+            pr_title=f"Publish {file_name}",
+        )
+
+    await pg.publish_jobs_set_stage(job_id, "recording")
+    with metrics.timer(metrics.publish_stages, "recording"):
+        recorded = await pg.github_files_insert_row(
+            username=user_name,
+            filename=file_name,
+            commit_hash=commit_hash,
+            mip_levels=mip_levels,
+            content_sha256=artwork.content_sha256,
+            phash=artwork.phash,
+            publish_job_id=job_id,
+        )
+    if not recorded:
+        # Another job published the same image meanwhile, its pull request is the one that counts
+        raise HTTPException(status_code=409, detail="This artwork has already been published")
+    listing.invalidate()
+
+
+async def run(job_id: uuid.UUID, user_name: str, image: bytes, attempt: int) -> None:
+    start = time.perf_counter()
+    try:
+        async with asyncio.timeout(DEADLINE):
+            await _publish(job_id, user_name, image)
+    except HTTPException as e:
+        metrics.publish_jobs.observe(("refused",), time.perf_counter() - start)
+        await pg.publish_jobs_fail(job_id, e.detail, e.status_code)
+    except Exception as e:
+        if _is_transient(e) and attempt < MAX_ATTEMPTS:
+            metrics.publish_jobs.observe(("retrying",), time.perf_counter() - start)
+            await pg.publish_jobs_retry(job_id, RETRY_DELAY * 2 ** (attempt - 1), "Publishing failed, retrying")
+        else:
+            metrics.publish_jobs.observe(("failed",), time.perf_counter() - start)
+            await pg.publish_jobs_fail(job_id, "Failed to publish", 502)
+    else:
+        metrics.publish_jobs.observe(("succeeded",), time.perf_counter() - start)
+
+
+async def work_forever() -> None:
+    while True:
+        try:
+            job = await pg.publish_jobs_claim(LEASE, MAX_ATTEMPTS)
+            if job is not None:
+                await run(*job)
+                continue
+        except psycopg.Error:
+            # Claimed jobs we couldn't finish are picked up again once their lease runs out
+            pass
+        except Exception:
+            logger.exception("Running publish jobs failed")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_workers() -> list[asyncio.Task[None]]:
+    return [asyncio.create_task(work_forever()) for _ in range(WORKERS)]
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+from pydantic import BaseModel
+
+from . import images, pg
+
+# How long a worker trusts its cached listing before checking the table version again. Publishes through this worker
+# invalidate immediately, this only bounds how stale a listing can be when another worker published.
+REVALIDATE_AFTER = float(os.getenv("ARTWORKS_CACHE_REVALIDATE_SECONDS", "5"))
+
+
+class ArtworksResponse(BaseModel):
+    artworks: list[tuple[str, str]]
+    # Smaller copies of artworks that have them, by filename and then longest side, next to the artwork in the repo
+    manifest: dict[str, dict[int, str]] = {}
+    # Id of the last artwork in the listing, pass it as `after_id` to only fetch newer ones
+    cursor: int
+    has_more: bool
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    # The highest id in the listing. Like `after_id` cursors, this relies on ids becoming visible in increasing order,
+    # which `SERIAL` alone doesn't guarantee, `pg.github_files_insert_row` serializes inserts to make it hold
+    version: int
+    body: bytes
+
+    @property
+    def etag(self) -> str:
+        return f'"artworks-{self.version}"'
+
+
+_snapshot: Snapshot | None = None
+_checked_at = float("-inf")
+_lock = asyncio.Lock()
+
+
+def _get_fresh_snapshot() -> Snapshot | None:
+    if time.monotonic() - _checked_at < REVALIDATE_AFTER:
+        return _snapshot
+
+    return None
+
+
+async def get_snapshot() -> Snapshot:
+    """Get the serialized artworks listing, only touching Postgres when the cached one may be stale."""
+    global _snapshot, _checked_at
+
+    if (snapshot := _get_fresh_snapshot()) is not None:
+        return snapshot
+
+    # Single-flight, concurrent pollers wait for one revalidation instead of each querying the table
+    async with _lock:
+        if (snapshot := _get_fresh_snapshot()) is not None:
+            return snapshot
+
+        version = await pg.github_files_get_latest_id()
+        snapshot = _snapshot
+        if snapshot is None or snapshot.version != version:
+            rows = await pg.github_files_get_after(0)
+            response = to_response(rows, after_id=0, has_more=False)
+            # Version by the rows actually read, a row inserted after the probe is picked up by the next revalidation
+            snapshot = Snapshot(version=response.cursor, body=response.model_dump_json().encode())
+
+        _snapshot = snapshot
+        _checked_at = time.monotonic()
+        return snapshot
+
+
+def to_response(rows: list[pg.ArtworkRow], after_id: int, has_more: bool) -> ArtworksResponse:
+    return ArtworksResponse(
+        artworks=[(username, filename) for _, username, filename, _ in rows],
+        manifest={
+            filename: {size: images.level_filename(filename.rstrip(), size) for size in mip_levels}
+            for _, _, filename, mip_levels in rows
+            if mip_levels
+        },
+        cursor=rows[-1][0] if rows else after_id,
+        has_more=has_more,
+    )
+
+
+def invalidate() -> None:
+    """Force the next `get_snapshot` call to revalidate against the table."""
+    global _checked_at
+
+    _checked_at = float("-inf")
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check an `If-None-Match` header against a strong ETag, using weak comparison as RFC 9110 requires."""
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
@@ -0,0 +1,195 @@
+import functools
+import time
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable, Iterator, Mapping
+from contextlib import contextmanager
+from typing import Any, ParamSpec, TypeVar
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "hhh"
+# Upper bounds in seconds, from a cache hit to a slow GitHub call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """A Prometheus histogram, kept as plain per-bucket counts so observing stays a lookup and two additions.
+
+    Only to be used from the event loop, nothing is locked.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = f"{PREFIX}_{name}"
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Per set of label values, the count of each bucket (not cumulative), then of +Inf, then the sum
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def observe(self, labels: tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = [*map(repr, self.buckets), "+Inf"]
+        for labels, series in self._series.items():
+            label_text = ",".join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels, strict=True)
+            )
+            cumulative = 0
+            for bound, count in zip(bounds, series, strict=False):
+                cumulative += count
+                yield f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative:.0f}'
+            yield f"{self.name}_sum{{{label_text}}} {series[-1]!r}"
+            yield f"{self.name}_count{{{label_text}}} {cumulative:.0f}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+requests = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response started, by route template",
+    ("method", "route", "status"),
+)
+upstream_calls = Histogram(
+    "upstream_call_duration_seconds",
+    "Calls to GitHub and Supabase Auth, by function of `server.gh` and `server.sb`",
+    ("upstream", "call", "outcome"),
+)
+db_queries = Histogram(
+    "db_query_duration_seconds",
+    "Queries, by function of `server.pg`, including the wait for a pooled connection",
+    ("query", "outcome"),
+)
+publish_stages = Histogram(
+    "publish_stage_duration_seconds",
+    "Stages of publish jobs, as reported to editors",
+    ("stage", "outcome"),
+)
+publish_jobs = Histogram(
+    "publish_job_duration_seconds",
+    "Attempts at publish jobs, from being claimed to their outcome",
+    ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+HISTOGRAMS = (requests, upstream_calls, db_queries, publish_stages, publish_jobs)
+
+
+def timed(histogram: Histogram, *labels: str) -> Callable[[Callable[P, Awaitable[T]]], Callable[P, Awaitable[T]]]:
+    """Observe how long each call of the decorated coroutine function takes.
+
+    The function name and whether it raised follow `labels`.
+    """
+
+    def decorator(function: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+        ok_labels = (*labels, function.__name__, "ok")
+        error_labels = (*labels, function.__name__, "error")
+
+        @functools.wraps(function)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            start = time.perf_counter()
+            try:
+                result = await function(*args, **kwargs)
+            except BaseException:
+                histogram.observe(error_labels, time.perf_counter() - start)
+                raise
+
+            histogram.observe(ok_labels, time.perf_counter() - start)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def timer(histogram: Histogram, *labels: str) -> Iterator[None]:
+    """Observe how long the block takes, with whether it raised following `labels`."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        histogram.observe((*labels, "error"), time.perf_counter() - start)
+        raise
+
+    histogram.observe((*labels, "ok"), time.perf_counter() - start)
+
+
+class RequestMetricsMiddleware:
+    """Observe the time each HTTP request takes until its response starts.
+
+    Streamed responses only count until their headers, their bodies can go on for as long as the client listens.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        started = False
+
+        def observe(status: int) -> None:
+            # Set by the router once a route matched, unmatched paths are lumped together to bound the label values
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            requests.observe((scope["method"], route_path, str(status)), time.perf_counter() - start)
+
+        async def send_observed(message: Message) -> None:
+            nonlocal started
+
+            if message["type"] == "http.response.start":
+                started = True
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_observed)
+        except BaseException:
+            if not started:
+                observe(500)
+            raise
+
+
+def _render_gauges(name: str, value: Any) -> Iterator[str]:
+    if isinstance(value, Mapping):
+        for key, nested in value.items():
+            yield from _render_gauges(f"{name}_{key}", nested)
+    elif isinstance(value, int | float):
+        # Some are counters, like cache hits, but all of them come from the same stats /health shows
+        yield f"# TYPE {name} untyped"
+        yield f"{name} {value!r}"
+
+
+def render(stats: Mapping[str, Any]) -> str:
+    """Render all histograms, and `stats` as one untyped metric per number, in the Prometheus text format."""
+    lines: list[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(_render_gauges(PREFIX, stats))
+    lines.append("")
+    return "\n".join(lines)
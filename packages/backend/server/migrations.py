@@ -0,0 +1,174 @@
+from . import pg
+
+# Arbitrary key so concurrently starting workers don't race each other through the migrations
+MIGRATIONS_LOCK_KEY = 0x4848_4801
+
+# Append-only, each entry runs exactly once per database, in order of version
+MIGRATIONS: list[tuple[int, str]] = [
+    (
+        1,
+        """
+        CREATE TABLE IF NOT EXISTS github_files (
+            id SERIAL PRIMARY KEY,
+            github_username VARCHAR(39) NOT NULL,
+            filename CHAR(42) NOT NULL,
+            commit_hash CHAR(40) NOT NULL
+        );
+        """,
+    ),
+    (
+        2,
+        """
+        CREATE INDEX IF NOT EXISTS github_files_filename_commit_hash_idx
+        ON github_files (filename, commit_hash);
+        """,
+    ),
+    (
+        3,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS github_files_filename_commit_hash_key
+        ON github_files (filename, commit_hash);
+
+        DROP INDEX IF EXISTS github_files_filename_commit_hash_idx;
+        """,
+    ),
+    (
+        4,
+        """
+        CREATE OR REPLACE FUNCTION github_files_notify_insert() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'github_files_inserted',
+                json_build_object(
+                    'id', NEW.id,
+                    'github_username', NEW.github_username,
+                    'filename', NEW.filename
+                )::text
+            );
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS github_files_notify_insert ON github_files;
+        CREATE TRIGGER github_files_notify_insert
+        AFTER INSERT ON github_files
+        FOR EACH ROW EXECUTE FUNCTION github_files_notify_insert();
+        """,
+    ),
+    (
+        5,
+        """
+        CREATE TABLE IF NOT EXISTS github_installations (
+            account_login VARCHAR(39) PRIMARY KEY,
+            installation_id BIGINT NOT NULL,
+            synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ),
+    (
+        6,
+        """
+        CREATE TABLE IF NOT EXISTS publish_jobs (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            github_username VARCHAR(39) NOT NULL,
+            image BYTEA,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued',
+            stage VARCHAR(32),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            error_status_code INTEGER,
+            filename VARCHAR(42),
+            commit_hash CHAR(40),
+            run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+            locked_until TIMESTAMPTZ,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE INDEX IF NOT EXISTS publish_jobs_pending_idx
+        ON publish_jobs (run_after)
+        WHERE status IN ('queued', 'running');
+        """,
+    ),
+    (
+        7,
+        """
+        ALTER TABLE publish_jobs ADD COLUMN IF NOT EXISTS image_sha256 CHAR(64);
+        """,
+    ),
+    (
+        8,
+        """
+        ALTER TABLE github_files ADD COLUMN IF NOT EXISTS mip_levels SMALLINT[] NOT NULL DEFAULT '{}';
+        """,
+    ),
+    (
+        9,
+        """
+        ALTER TABLE github_files ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);
+        ALTER TABLE github_files ADD COLUMN IF NOT EXISTS phash BIGINT;
+
+        CREATE INDEX IF NOT EXISTS github_files_content_sha256_idx
+        ON github_files (content_sha256);
+        """,
+    ),
+    (
+        10,
+        """
+        CREATE TABLE IF NOT EXISTS publish_rate_limits (
+            github_username VARCHAR(39) PRIMARY KEY,
+            arrival_time TIMESTAMPTZ NOT NULL
+        );
+        """,
+    ),
+    (
+        11,
+        """
+        CREATE OR REPLACE FUNCTION github_files_notify_insert() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'github_files_inserted',
+                json_build_object(
+                    'id', NEW.id,
+                    'github_username', NEW.github_username,
+                    'filename', NEW.filename,
+                    'mip_levels', NEW.mip_levels
+                )::text
+            );
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+    ),
+]
+
+
+async def run() -> list[int]:
+    """Apply all pending migrations and return the versions that were applied."""
+    applied: list[int] = []
+
+    async with pg.connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """
+            )
+
+            cur = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            row = await cur.fetchone()
+            current_version = row[0] if row is not None else 0
+
+            for version, sql in MIGRATIONS:
+                if version <= current_version:
+                    continue
+
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+                applied.append(version)
+
+    return applied
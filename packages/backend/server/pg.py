@@ -1,84 +1,706 @@
+import asyncio
 import os
+import struct
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 import psycopg
+from psycopg.abc import Buffer
+from psycopg.conninfo import make_conninfo
+from psycopg.copy import AsyncLibpqWriter
 from psycopg.rows import tuple_row
+from psycopg_pool import AsyncConnectionPool
 
+from . import metrics
 
-async def get_connection() -> psycopg.AsyncConnection:
-    return await psycopg.AsyncConnection.connect(
+# Arbitrary key serializing inserts into `github_files`, so ids become visible in the order they were assigned (see
+# `github_files_insert_row`). Next to `migrations.MIGRATIONS_LOCK_KEY`
+GITHUB_FILES_INSERT_LOCK_KEY = 0x4848_4802
+
+_pool: AsyncConnectionPool | None = None
+
+
+def get_conninfo() -> str:
+    return make_conninfo(
         dbname=os.getenv("POSTGRES_DB"),
         user=os.getenv("POSTGRES_USER", "postgres"),
         password=os.getenv("POSTGRES_PASSWORD"),
         host=os.getenv("POSTGRES_HOST", "localhost"),
         port=os.getenv("POSTGRES_PORT", "5432"),
-        row_factory=tuple_row,
     )
 
 
-async def github_files_create_table() -> None:
-    async with await get_connection() as conn:
+async def get_connection() -> psycopg.AsyncConnection:
+    """Open a new, unpooled connection. Prefer `connection()` in request handlers."""
+    return await psycopg.AsyncConnection.connect(get_conninfo(), row_factory=tuple_row)
+
+
+async def open_pool() -> None:
+    """Open the application-wide connection pool, sized by `POSTGRES_POOL_*` environment variables."""
+    global _pool
+
+    if _pool is not None:
+        return
+
+    pool = AsyncConnectionPool(
+        get_conninfo(),
+        min_size=int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1")),
+        max_size=int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10")),
+        timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", "10")),
+        max_idle=float(os.getenv("POSTGRES_POOL_MAX_IDLE", "300")),
+        kwargs={"row_factory": tuple_row},
+        # Ping connections as they are handed out so a restarted database doesn't surface as request errors
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+        name="backend",
+    )
+    await pool.open(wait=True)
+    _pool = pool
+
+
+async def close_pool() -> None:
+    global _pool
+
+    if _pool is None:
+        return
+
+    pool, _pool = _pool, None
+    await pool.close()
+
+
+def get_pool_stats() -> dict[str, int]:
+    """Get the current connection pool counters, see `psycopg_pool` docs for their meaning."""
+    if _pool is None:
+        return {}
+
+    return _pool.get_stats()
+
+
+@asynccontextmanager
+async def connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """Borrow a connection from the pool, or open a one-off connection if the pool isn't running."""
+    if _pool is None:
+        async with await get_connection() as conn:
+            yield conn
+    else:
+        async with _pool.connection() as conn:
+            yield conn
+
+
+def _to_bigint(value: int) -> int:
+    """Reinterpret an unsigned 64-bit integer as the signed one Postgres can store."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _from_bigint(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+
+@metrics.timed(metrics.db_queries)
+async def github_files_insert_row(
+    username: str,
+    filename: str,
+    commit_hash: str,
+    mip_levels: list[int] | None = None,
+    content_sha256: str | None = None,
+    phash: int | None = None,
+    publish_job_id: uuid.UUID | None = None,
+) -> bool:
+    """Record a published artwork, and with `publish_job_id` mark the job that published it succeeded.
+
+    Both happen in one transaction, so a job can't be left to be retried, and publish the artwork again, after its
+    row was recorded. Returns `False`, recording nothing, if an artwork with the same `content_sha256` already was.
+    """
+    async with connection() as conn:
         async with conn.cursor() as cur:
+            # `SERIAL` ids are handed out before commit, so concurrent inserts could commit out of id order. The feed,
+            # the listing snapshot version and `after_id` cursors all treat the highest visible id as a high-water
+            # mark, which only holds if no lower id can show up after it. Held until the commit below
+            await cur.execute("SELECT pg_advisory_xact_lock(%s)", (GITHUB_FILES_INSERT_LOCK_KEY,))
+            if content_sha256 is not None:
+                # Checked before publishing too, but jobs for the same image on different workers can both pass that
+                await cur.execute(
+                    """
+                    SELECT EXISTS (
+                        SELECT
+                            1
+                        FROM
+                            github_files
+                        WHERE
+                            content_sha256=%s
+                    )
+                    """,
+                    (content_sha256,),
+                )
+                row = await cur.fetchone()
+                if row is not None and row[0]:
+                    await conn.rollback()
+                    return False
+
             await cur.execute(
                 """
-                CREATE TABLE IF NOT EXISTS github_files (
-                    id SERIAL PRIMARY KEY,
-                    github_username VARCHAR(39) NOT NULL,
-                    filename CHAR(42) NOT NULL,
-                    commit_hash CHAR(40) NOT NULL
-                );
-                """
+                INSERT INTO github_files (github_username, filename, commit_hash, mip_levels, content_sha256, phash)
+                VALUES (%s, %s, %s, %s, %s, %s);
+                """,
+                (
+                    username,
+                    filename,
+                    commit_hash,
+                    mip_levels or [],
+                    content_sha256,
+                    _to_bigint(phash) if phash is not None else None,
+                ),
             )
+            if publish_job_id is not None:
+                await cur.execute(
+                    """
+                    UPDATE publish_jobs
+                    SET
+                        status = 'succeeded',
+                        stage = NULL,
+                        image = NULL,
+                        filename = %s,
+                        commit_hash = %s,
+                        locked_until = NULL,
+                        updated_at = now()
+                    WHERE id = %s;
+                    """,
+                    (filename, commit_hash, publish_job_id),
+                )
             await conn.commit()
 
+    return True
 
-async def github_files_insert_row(username: str, filename: str, commit_hash: str) -> None:
-    await github_files_create_table()
 
-    async with await get_connection() as conn:
+@metrics.timed(metrics.db_queries)
+async def github_files_check_exists(filename: str, commit_hash: str) -> bool:
+    async with connection() as conn:
         async with conn.cursor() as cur:
+            # Answered from the (filename, commit_hash) unique index alone
             await cur.execute(
                 """
-                INSERT INTO github_files (github_username, filename, commit_hash)
-                VALUES (%s, %s, %s);
+                SELECT EXISTS (
+                    SELECT
+                        1
+                    FROM
+                        github_files
+                    WHERE
+                        filename=%s
+                        AND commit_hash=%s
+                )
                 """,
-                (username, filename, commit_hash),
+                (filename, commit_hash),
             )
-            await conn.commit()
 
+            row = await cur.fetchone()
+            return row is not None and row[0]
 
-async def github_files_check_exists(filename: str, commit_hash: str) -> bool:
-    async with await get_connection() as conn:
+
+@metrics.timed(metrics.db_queries)
+async def github_files_check_exist_many(pairs: list[tuple[str, str]]) -> list[bool]:
+    """Check many (filename, commit hash) pairs at once, returning whether each exists in the order given."""
+    if not pairs:
+        return []
+
+    filenames = [filename for filename, _ in pairs]
+    commit_hashes = [commit_hash for _, commit_hash in pairs]
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            # A single round trip, each pair still answered from the (filename, commit_hash) unique index. `bpchar`
+            # like the columns, so the index applies and trailing spaces are ignored as for the single lookup.
+            await cur.execute(
+                """
+                SELECT
+                    EXISTS (
+                        SELECT
+                            1
+                        FROM
+                            github_files
+                        WHERE
+                            filename=pairs.filename
+                            AND commit_hash=pairs.commit_hash
+                    )
+                FROM
+                    unnest(%s::bpchar[], %s::bpchar[]) WITH ORDINALITY AS pairs(filename, commit_hash, position)
+                ORDER BY
+                    pairs.position
+                """,
+                (filenames, commit_hashes),
+            )
+
+            return [exists for (exists,) in await cur.fetchall()]
+
+
+# id, GitHub username, filename and the mip levels published next to the file
+ArtworkRow = tuple[int, str, str, list[int]]
+
+
+@metrics.timed(metrics.db_queries)
+async def github_files_get_after(after_id: int, limit: int | None = None) -> list[ArtworkRow]:
+    """Get up to `limit` rows with an id greater than `after_id`, oldest first. No limit when `None`."""
+    async with connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(
                 """
                 SELECT
-                    *
+                    id,
+                    github_username,
+                    filename,
+                    mip_levels
                 FROM
                     github_files
                 WHERE
-                    filename=%s
-                    AND commit_hash=%s
+                    id > %s
+                ORDER BY
+                    id ASC
+                LIMIT
+                    %s
                 """,
-                (filename, commit_hash),
+                (after_id, limit),
             )
-
             rows = await cur.fetchall()
-            return len(rows) == 1
+            return rows
 
 
-async def github_files_get_all() -> list[tuple[str, str]]:
-    async with await get_connection() as conn:
+@metrics.timed(metrics.db_queries)
+async def github_files_find_by_content(content_sha256: str) -> str | None:
+    """Get the filename of an artwork with exactly these pixels, if one was published."""
+    async with connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(
                 """
                 SELECT
-                    github_username,
                     filename
                 FROM
                     github_files
+                WHERE
+                    content_sha256=%s
+                LIMIT
+                    1
+                """,
+                (content_sha256,),
+            )
+            row = await cur.fetchone()
+            return row[0] if row is not None else None
+
+
+@metrics.timed(metrics.db_queries)
+async def github_files_get_phashes_after(after_id: int, limit: int) -> list[tuple[int, int | None]]:
+    """Get the ids and perceptual hashes of up to `limit` rows with an id greater than `after_id`, oldest first.
+
+    Rows without a hash are included with a hash of `None`, so callers can advance past them.
+    """
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT
+                    id,
+                    phash
+                FROM
+                    github_files
+                WHERE
+                    id > %s
                 ORDER BY
                     id ASC
-                """
+                LIMIT
+                    %s
+                """,
+                (after_id, limit),
             )
             rows = await cur.fetchall()
-            return rows
+            return [(row_id, _from_bigint(phash) if phash is not None else None) for row_id, phash in rows]
+
+
+@metrics.timed(metrics.db_queries)
+async def github_files_get_latest_id() -> int:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT
+                    COALESCE(MAX(id), 0)
+                FROM
+                    github_files
+                """
+            )
+            row = await cur.fetchone()
+            return row[0] if row is not None else 0
+
+
+@metrics.timed(metrics.db_queries)
+async def github_installations_get(account_login: str) -> int | None:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT
+                    installation_id
+                FROM
+                    github_installations
+                WHERE
+                    account_login=%s
+                """,
+                (account_login,),
+            )
+            row = await cur.fetchone()
+            return row[0] if row is not None else None
+
+
+@metrics.timed(metrics.db_queries)
+async def github_installations_upsert(account_login: str, installation_id: int) -> None:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO github_installations (account_login, installation_id)
+                VALUES (%s, %s)
+                ON CONFLICT (account_login) DO UPDATE
+                SET installation_id = EXCLUDED.installation_id, synced_at = now();
+                """,
+                (account_login, installation_id),
+            )
+            await conn.commit()
+
+
+@metrics.timed(metrics.db_queries)
+async def github_installations_delete(installation_id: int) -> None:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                DELETE FROM github_installations
+                WHERE installation_id=%s;
+                """,
+                (installation_id,),
+            )
+            await conn.commit()
+
+
+@metrics.timed(metrics.db_queries)
+async def github_installations_replace_all(installations: list[tuple[str, int]]) -> None:
+    """Make `github_installations` hold exactly the given (account login, installation id) pairs."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                """
+                INSERT INTO github_installations (account_login, installation_id)
+                VALUES (%s, %s)
+                ON CONFLICT (account_login) DO UPDATE
+                SET installation_id = EXCLUDED.installation_id, synced_at = now();
+                """,
+                installations,
+            )
+            # now() is fixed for the whole transaction, so this removes exactly the rows not in `installations`
+            await cur.execute(
+                """
+                DELETE FROM github_installations
+                WHERE synced_at < now();
+                """
+            )
+            await conn.commit()
+
+
+class FlushingCopyWriter(AsyncLibpqWriter):
+    """Send COPY data to Postgres as it is written.
+
+    On Linux libpq otherwise keeps growing its output buffer while Postgres reads slower than we write, until it holds
+    most of a large upload.
+    """
+
+    async def write(self, data: Buffer) -> None:
+        await super().write(data)
+
+        loop = asyncio.get_running_loop()
+        while self._pgconn.flush() == 1:
+            writable = loop.create_future()
+            loop.add_writer(self._pgconn.socket, lambda: writable.done() or writable.set_result(None))
+            try:
+                await writable
+            finally:
+                loop.remove_writer(self._pgconn.socket)
+
+
+def _copy_binary_field(value: bytes) -> bytes:
+    return struct.pack("!i", len(value)) + value
+
+
+async def _publish_rate_limits_take(
+    cur: psycopg.AsyncCursor, username: str, emission_interval: float, burst_tolerance: float
+) -> tuple[bool, float]:
+    """Atomically push back the user's theoretical arrival time if it allows another publish.
+
+    Returns whether it did, and the user's arrival time afterwards as a Unix timestamp. The row stays locked until the
+    transaction ends, so the publish is only spent if the transaction commits.
+    """
+    await cur.execute(
+        """
+        WITH taken AS (
+            INSERT INTO publish_rate_limits AS limits (github_username, arrival_time)
+            VALUES (%s, now() + make_interval(secs => %s))
+            ON CONFLICT (github_username) DO UPDATE
+            SET arrival_time = GREATEST(limits.arrival_time, now()) + make_interval(secs => %s)
+            WHERE limits.arrival_time - now() <= make_interval(secs => %s)
+            RETURNING arrival_time
+        )
+        SELECT
+            true,
+            EXTRACT(EPOCH FROM arrival_time)
+        FROM
+            taken
+        UNION ALL
+        SELECT
+            false,
+            EXTRACT(EPOCH FROM arrival_time)
+        FROM
+            publish_rate_limits
+        WHERE
+            github_username=%s
+            AND NOT EXISTS (SELECT 1 FROM taken)
+        """,
+        (username, emission_interval, emission_interval, burst_tolerance, username),
+    )
+    row = await cur.fetchone()
+    if row is None:
+        # Refused by a row inserted concurrently, which the statement's snapshot doesn't include yet
+        await cur.execute(
+            """
+            SELECT
+                false,
+                EXTRACT(EPOCH FROM arrival_time)
+            FROM
+                publish_rate_limits
+            WHERE
+                github_username=%s
+            """,
+            (username,),
+        )
+        row = await cur.fetchone()
+
+    if row is None:
+        raise RuntimeError(f"No rate limit row for {username}")
+
+    return row[0], float(row[1])
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_insert(
+    username: str,
+    image_sha256: str,
+    image_size: int,
+    image_chunks: AsyncIterator[bytes],
+    emission_interval: float,
+    burst_tolerance: float,
+) -> tuple[uuid.UUID | None, float]:
+    """Insert a job if the user's rate limit allows it, streaming its image instead of passing it as one big parameter.
+
+    The publish is taken from the rate limit in the same transaction, so it is only spent on a job that was queued.
+    Returns the job's id, `None` if the user is over the limit, and the user's arrival time afterwards.
+    """
+    job_id = uuid.uuid4()
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            allowed, arrival_time = await _publish_rate_limits_take(cur, username, emission_interval, burst_tolerance)
+            if not allowed:
+                await conn.rollback()
+                return None, arrival_time
+
+            async with cur.copy(
+                "COPY publish_jobs (id, github_username, image_sha256, image) FROM STDIN (FORMAT BINARY)",
+                writer=FlushingCopyWriter(cur),
+            ) as copy:
+                # Binary format header and row, the image goes last so its length can precede its chunks
+                await copy.write(
+                    b"PGCOPY\n\xff\r\n\0"
+                    + struct.pack("!iih", 0, 0, 4)
+                    + _copy_binary_field(job_id.bytes)
+                    + _copy_binary_field(username.encode())
+                    + _copy_binary_field(image_sha256.encode())
+                    + struct.pack("!i", image_size)
+                )
+                async for chunk in image_chunks:
+                    await copy.write(chunk)
+                await copy.write(struct.pack("!h", -1))
+            await conn.commit()
+
+    return job_id, arrival_time
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_find_pending(username: str, image_sha256: str) -> uuid.UUID | None:
+    """Find a job of the user for the same image that hasn't finished yet."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT
+                    id
+                FROM
+                    publish_jobs
+                WHERE
+                    github_username=%s
+                    AND image_sha256=%s
+                    AND status IN ('queued', 'running')
+                LIMIT 1
+                """,
+                (username, image_sha256),
+            )
+            row = await cur.fetchone()
+            return row[0] if row is not None else None
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_claim(lease_seconds: float, max_attempts: int) -> tuple[uuid.UUID, str, bytes, int] | None:
+    """Lock the oldest runnable job for `lease_seconds` and return its id, username, image and attempt number.
+
+    Running jobs whose lease ran out, because their worker died, are runnable again, unless that was their last
+    attempt. Those are failed instead, so a job that keeps killing or hanging its worker doesn't run forever.
+    """
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE publish_jobs
+                SET
+                    status = 'failed',
+                    image = NULL,
+                    error = 'Failed to publish',
+                    error_status_code = 502,
+                    locked_until = NULL,
+                    updated_at = now()
+                WHERE
+                    status = 'running'
+                    AND locked_until < now()
+                    AND attempts >= %s;
+                """,
+                (max_attempts,),
+            )
+            await cur.execute(
+                """
+                UPDATE publish_jobs
+                SET
+                    status = 'running',
+                    attempts = attempts + 1,
+                    locked_until = now() + make_interval(secs => %s),
+                    updated_at = now()
+                WHERE id = (
+                    SELECT
+                        id
+                    FROM
+                        publish_jobs
+                    WHERE
+                        run_after <= now()
+                        AND (status = 'queued' OR (status = 'running' AND locked_until < now()))
+                        AND attempts < %s
+                    ORDER BY
+                        run_after ASC
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, github_username, image, attempts;
+                """,
+                (lease_seconds, max_attempts),
+            )
+            row = await cur.fetchone()
+            await conn.commit()
+            return row
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_set_stage(job_id: uuid.UUID, stage: str) -> None:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE publish_jobs
+                SET stage = %s, updated_at = now()
+                WHERE id = %s;
+                """,
+                (stage, job_id),
+            )
+            await conn.commit()
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_retry(job_id: uuid.UUID, delay_seconds: float, error: str) -> None:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE publish_jobs
+                SET
+                    status = 'queued',
+                    error = %s,
+                    run_after = now() + make_interval(secs => %s),
+                    locked_until = NULL,
+                    updated_at = now()
+                WHERE id = %s;
+                """,
+                (error, delay_seconds, job_id),
+            )
+            await conn.commit()
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_fail(job_id: uuid.UUID, error: str, error_status_code: int) -> None:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE publish_jobs
+                SET
+                    status = 'failed',
+                    image = NULL,
+                    error = %s,
+                    error_status_code = %s,
+                    locked_until = NULL,
+                    updated_at = now()
+                WHERE id = %s;
+                """,
+                (error, error_status_code, job_id),
+            )
+            await conn.commit()
+
+
+@metrics.timed(metrics.db_queries)
+async def publish_jobs_get(
+    job_id: uuid.UUID,
+) -> tuple[str, str | None, int, str | None, int | None, str | None] | None:
+    """Get a job's status, stage, attempts, error, error status code and filename."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT
+                    status,
+                    stage,
+                    attempts,
+                    error,
+                    error_status_code,
+                    filename
+                FROM
+                    publish_jobs
+                WHERE
+                    id=%s
+                """,
+                (job_id,),
+            )
+            return await cur.fetchone()
+
+
+@metrics.timed(metrics.db_queries)
+async def sessions_notify_logout(username: str, logged_out_at: float) -> None:
+    """Tell every worker that the user logged out, see `sessions.listen`."""
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT pg_notify(
+                    'sessions_logged_out',
+                    json_build_object('user_name', %s::text, 'at', %s::float8)::text
+                )
+                """,
+                (username, logged_out_at),
+            )
+            await conn.commit()
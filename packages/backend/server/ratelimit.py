@@ -0,0 +1,56 @@
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+# Publishes allowed per user in a burst, refilled evenly over the window, the editor tells users about this limit
+PUBLISH_LIMIT = int(os.getenv("PUBLISH_RATE_LIMIT", "5"))
+PUBLISH_WINDOW = float(os.getenv("PUBLISH_RATE_WINDOW_SECONDS", "3600"))
+
+# Time the bucket takes to refill by one publish
+EMISSION_INTERVAL = PUBLISH_WINDOW / PUBLISH_LIMIT
+# How far ahead of now a user's theoretical arrival time may be for another publish to go through
+BURST_TOLERANCE = EMISSION_INTERVAL * (PUBLISH_LIMIT - 1)
+
+# Latest theoretical arrival time seen for each user, as a Unix timestamp. Other workers only ever move it later, so
+# a user over the limit here is over it everywhere and can be refused without asking Postgres.
+_arrival_times: dict[str, float] = {}
+
+
+def get_stats() -> dict[str, int]:
+    return {"users": len(_arrival_times)}
+
+
+def _evict_expired(now: float) -> None:
+    # Past arrival times mean a full bucket, which is what an unknown user has too
+    for user_name in [user_name for user_name, arrival_time in _arrival_times.items() if arrival_time <= now]:
+        del _arrival_times[user_name]
+
+
+def refuse(arrival_time: float) -> HTTPException:
+    """The 429 for a user whose theoretical arrival time is `arrival_time`."""
+    return HTTPException(
+        status_code=429,
+        detail="Too many publishes, try again later",
+        headers={"Retry-After": str(math.ceil(arrival_time - BURST_TOLERANCE - time.time()))},
+    )
+
+
+def check_publish(user_name: str) -> None:
+    """Raise a 429 if the user is known to be over the limit, without taking a publish.
+
+    A generic cell rate algorithm: each user has a theoretical arrival time, pushed back by `EMISSION_INTERVAL` with
+    every publish, and a publish is allowed while that is at most `BURST_TOLERANCE` ahead of now. The publish itself
+    is taken along with queueing the job, see `pg.publish_jobs_insert`, which reports the new time to `remember`.
+    """
+    arrival_time = _arrival_times.get(user_name)
+    if arrival_time is not None and arrival_time - time.time() > BURST_TOLERANCE:
+        raise refuse(arrival_time)
+
+
+def remember(user_name: str, arrival_time: float) -> None:
+    """Keep the user's arrival time as Postgres reported it, after a publish was taken or refused."""
+    if len(_arrival_times) > 10_000:
+        _evict_expired(time.time())
+    _arrival_times[user_name] = arrival_time
@@ -0,0 +1,282 @@
+import asyncio
+import functools
+import os
+import random
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import ParamSpec, TypeVar
+
+import httpx
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# Attempts at an idempotent GitHub call, with a random wait of up to `RETRY_BASE_DELAY * 2 ** n` seconds after the nth
+MAX_ATTEMPTS = int(os.getenv("GITHUB_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# Consecutive failures after which GitHub is assumed to be down, and how long to fail fast before trying again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("GITHUB_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("GITHUB_CIRCUIT_RESET_SECONDS", "30"))
+# With this few requests left before the rate limit resets, the rest are spread evenly over the time until it does
+RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", "100"))
+# Requests that would have to wait longer than this for the rate limit fail instead
+MAX_THROTTLE = float(os.getenv("GITHUB_MAX_THROTTLE_SECONDS", "30"))
+# GitHub asks to wait at least this long after a secondary rate limit without a `Retry-After`
+SECONDARY_RATE_LIMIT_WAIT = 60.0
+MAX_TRACKED_CREDENTIALS = 1000
+
+_retries = 0
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending a request while GitHub is assumed to be down."""
+
+
+class ThrottledError(httpx.TransportError):
+    """Raised instead of sending a request that would have to wait too long for the rate limit."""
+
+
+def get_retry_stats() -> dict[str, int]:
+    return {"retried": _retries}
+
+
+def is_retryable_response(response: httpx.Response) -> bool:
+    """Whether a failed response might succeed when sent again later."""
+    if response.status_code >= 500 or response.status_code == 429:
+        return True
+
+    # Primary rate limits run out at 0 remaining, secondary ones come with a `Retry-After`
+    return response.status_code == 403 and (
+        response.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in response.headers
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    # Waiting a moment won't close the circuit or lift the rate limit, retrying later is up to the caller
+    if isinstance(error, CircuitOpenError | ThrottledError):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return is_retryable_response(error.response)
+
+    return isinstance(error, httpx.TransportError)
+
+
+def retry(function: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+    """Call the decorated coroutine function again after transient errors, only for calls that are safe to repeat.
+
+    Waits are jittered exponential backoff, "full jitter", so callers failing together don't retry together.
+    """
+
+    @functools.wraps(function)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        global _retries
+
+        for attempt in range(1, MAX_ATTEMPTS):
+            try:
+                return await function(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+
+            _retries += 1
+            await asyncio.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))))
+
+        return await function(*args, **kwargs)
+
+    return wrapper
+
+
+class CircuitBreaker:
+    """Fail fast after too many consecutive failures, then let a single request through now and then to probe."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    def get_stats(self) -> dict[str, int]:
+        return {"open": int(self._opened_at is not None), "failures": self.failures, "opened": self.opened}
+
+    def before_request(self) -> None:
+        if self._opened_at is None:
+            return
+
+        if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+            raise CircuitOpenError("GitHub is failing, not sending requests for now")
+        self._probing = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or (self._opened_at is None and self.failures >= self.failure_threshold):
+            if not self._probing:
+                self.opened += 1
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+    def abandon(self) -> None:
+        """Note that a request ended without an outcome, e.g. cancelled, so another one may probe."""
+        self._probing = False
+
+
+@dataclass
+class _RateLimit:
+    # The least GitHub reported as left in the current window, which doesn't count requests it hadn't received yet
+    remaining: int | None = None
+    reset_at: float = 0.0
+    blocked_until: float = 0.0
+    # When the next request may go out while the last `RATE_LIMIT_RESERVE` ones are spread out
+    next_at: float = 0.0
+    in_flight: int = 0
+
+
+class RateLimits:
+    """Keep GitHub's rate limit for each set of credentials, from the headers of its responses.
+
+    Requests still in flight are counted against what's left, so concurrent requests don't all see the same number.
+    """
+
+    def __init__(self, reserve: int, max_wait: float) -> None:
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.throttled = 0
+        self._limits: dict[str, _RateLimit] = {}
+
+    def get_stats(self) -> dict[str, int]:
+        return {"credentials": len(self._limits), "throttled": self.throttled}
+
+    def _get_wait(self, limit: _RateLimit, now: float) -> float:
+        if limit.blocked_until > now:
+            return limit.blocked_until - now
+        if limit.remaining is None or limit.reset_at <= now:
+            return 0.0
+
+        available = limit.remaining - limit.in_flight
+        if available <= 0:
+            return limit.reset_at - now
+        if available <= self.reserve:
+            return max(limit.next_at - now, 0.0)
+        return 0.0
+
+    async def acquire(self, credentials: str) -> None:
+        """Wait until a request with the credentials can be sent without running into the rate limit.
+
+        Every `acquire` has to be followed by a `release` once the request is done.
+        """
+        limit = self._limits.get(credentials)
+        if limit is None:
+            if len(self._limits) >= MAX_TRACKED_CREDENTIALS:
+                self._evict(time.time())
+            limit = self._limits[credentials] = _RateLimit()
+
+        while (wait := self._get_wait(limit, time.time())) > 0:
+            if wait > self.max_wait:
+                raise ThrottledError(f"GitHub rate limit reached, {wait:.0f} s until it resets")
+            self.throttled += 1
+            await asyncio.sleep(wait)
+
+        now = time.time()
+        if limit.remaining is not None and limit.reset_at > now:
+            available = limit.remaining - limit.in_flight
+            if available <= self.reserve:
+                limit.next_at = now + (limit.reset_at - now) / max(available, 1)
+        limit.in_flight += 1
+
+    def release(self, credentials: str, response: httpx.Response | None) -> None:
+        """Note that a request is done, with the response if there is one."""
+        limit = self._limits.get(credentials)
+        if limit is None:
+            return
+
+        limit.in_flight -= 1
+        if response is not None:
+            self._update(limit, response)
+
+        # Nothing known about these credentials, e.g. only responses without rate limit headers
+        if limit.in_flight == 0 and limit.remaining is None and limit.blocked_until == 0.0:
+            del self._limits[credentials]
+
+    def _update(self, limit: _RateLimit, response: httpx.Response) -> None:
+        headers = response.headers
+        remaining, reset = headers.get("X-RateLimit-Remaining"), headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            # Responses from an earlier window that arrive late say nothing about the current one
+            if limit.remaining is None or float(reset) > limit.reset_at:
+                limit.remaining = int(remaining)
+                limit.reset_at = float(reset)
+            elif float(reset) == limit.reset_at:
+                limit.remaining = min(limit.remaining, int(remaining))
+
+        if response.status_code in (403, 429) and is_retryable_response(response):
+            if (retry_after := headers.get("Retry-After")) is not None:
+                limit.blocked_until = time.time() + float(retry_after)
+            elif remaining == "0" and reset is not None:
+                limit.blocked_until = float(reset)
+            else:
+                limit.blocked_until = time.time() + SECONDARY_RATE_LIMIT_WAIT
+
+    def _evict(self, now: float) -> None:
+        # Credentials whose limits have reset are as good as unknown ones
+        for credentials in [
+            credentials
+            for credentials, limit in self._limits.items()
+            if limit.in_flight == 0 and limit.reset_at <= now and limit.blocked_until <= now
+        ]:
+            del self._limits[credentials]
+
+        # Otherwise the oldest go, tokens are replaced every hour at most
+        while len(self._limits) >= MAX_TRACKED_CREDENTIALS:
+            del self._limits[next(iter(self._limits))]
+
+
+class GuardedTransport(httpx.AsyncBaseTransport):
+    """Send requests through `transport`, unless the circuit is open, and no faster than the rate limits allow."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        circuit_breaker: CircuitBreaker,
+        rate_limits: RateLimits,
+    ) -> None:
+        self.transport = transport
+        self.circuit_breaker = circuit_breaker
+        self.rate_limits = rate_limits
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        credentials = request.headers.get("Authorization", "")
+        self.circuit_breaker.before_request()
+        try:
+            await self.rate_limits.acquire(credentials)
+        except BaseException:
+            self.circuit_breaker.abandon()
+            raise
+
+        response = None
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            self.circuit_breaker.abandon()
+            raise
+        finally:
+            self.rate_limits.release(credentials, response)
+
+        if response.status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
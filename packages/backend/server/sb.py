@@ -1,15 +1,111 @@
+import time
+from dataclasses import dataclass
+
+import httpx
+import jwt
 from fastapi import HTTPException, Request, Response
+from gotrue import AsyncMemoryStorage
 from gotrue.constants import STORAGE_KEY
 from gotrue.errors import AuthSessionMissingError
 from gotrue.types import UserIdentity
-from supabase import AsyncClient, AsyncClientOptions, create_async_client
+from supabase import ASupabaseAuthClient, __version__
 
-from . import env
+from . import env, metrics
 
 ACCESS_TOKEN_COOKIE_KEY = "sb_access_token"  # noqa: S105
 REFRESH_TOKEN_COOKIE_KEY = "sb_refresh_token"  # noqa: S105
 CODE_VERIFIER_COOKIE_KEY = "sb_code_verifier"
 
+# Access tokens expiring sooner than this aren't trusted locally, so GoTrue gets to refresh them
+ACCESS_TOKEN_REFRESH_MARGIN = 60
+MAX_VERIFIED_TOKENS = 10_000
+# Logouts older than this are forgotten, access tokens issued before them have expired by then
+LOGOUT_MEMORY = 2 * 60 * 60
+
+
+@dataclass(frozen=True)
+class VerifiedToken:
+    user_name: str
+    issued_at: float
+    expires_at: float
+
+
+# Access tokens that were verified locally
+_verified_tokens: dict[str, VerifiedToken] = {}
+# When users last logged out, which revokes all their sessions in GoTrue but not the access tokens already handed out
+_logged_out_at: dict[str, float] = {}
+
+
+def get_verified_token_stats() -> dict[str, int]:
+    return {"size": len(_verified_tokens), "logged_out_users": len(_logged_out_at)}
+
+
+def record_logout(user_name: str, logged_out_at: float) -> None:
+    """Stop trusting the user's access tokens issued before `logged_out_at` locally."""
+    now = time.time()
+    for logged_out_user, at in list(_logged_out_at.items()):
+        if now - at > LOGOUT_MEMORY:
+            del _logged_out_at[logged_out_user]
+
+    _logged_out_at[user_name] = max(logged_out_at, _logged_out_at.get(user_name, 0.0))
+
+
+def _decode_access_token(access_token: str, verify_exp: bool = True) -> VerifiedToken | None:
+    try:
+        claims = jwt.decode(
+            access_token,
+            env.JWT_SECRET,
+            algorithms=["HS256"],
+            audience="authenticated",
+            options={"require": ["exp", "sub"], "verify_exp": verify_exp},
+        )
+    except jwt.InvalidTokenError:
+        return None
+
+    app_metadata = claims.get("app_metadata") or {}
+    user_name = (claims.get("user_metadata") or {}).get("user_name")
+    if "github" not in app_metadata.get("providers", []) or not isinstance(user_name, str):
+        return None
+
+    return VerifiedToken(user_name=user_name, issued_at=float(claims.get("iat", 0)), expires_at=float(claims["exp"]))
+
+
+def verify_access_token(access_token: str) -> VerifiedToken | None:
+    """Get the GitHub username from an access token signed with the project's JWT secret, without asking GoTrue.
+
+    `None` if the token is invalid, not from a GitHub login, about to expire or issued before the user logged out. The
+    username comes from the user metadata, which users can change themselves, so this is only good enough for showing
+    who is logged in.
+    """
+    now = time.time()
+    verified = _verified_tokens.get(access_token)
+    if verified is None:
+        verified = _decode_access_token(access_token)
+        if verified is None:
+            return None
+
+        if len(_verified_tokens) >= MAX_VERIFIED_TOKENS:
+            for token in [token for token, cached in _verified_tokens.items() if cached.expires_at <= now]:
+                del _verified_tokens[token]
+        if len(_verified_tokens) < MAX_VERIFIED_TOKENS:
+            _verified_tokens[access_token] = verified
+
+    if verified.expires_at - now < ACCESS_TOKEN_REFRESH_MARGIN:
+        return None
+    if verified.issued_at <= _logged_out_at.get(verified.user_name, float("-inf")):
+        return None
+
+    return verified
+
+
+def get_access_token_user_name(access_token: str) -> str | None:
+    """Get the GitHub username from an access token signed with the project's JWT secret, even an expired one.
+
+    Good enough for saying whose sessions a logout revoked, see `verify_access_token` for trusting a token.
+    """
+    verified = _decode_access_token(access_token, verify_exp=False)
+    return verified.user_name if verified is not None else None
+
 
 def set_response_token_cookies_(response: Response, access_token: str, refresh_token: str) -> None:
     response.set_cookie(
@@ -28,27 +124,62 @@ def set_response_token_cookies_(response: Response, access_token: str, refresh_t
     )
 
 
-async def create_internal_client() -> AsyncClient:
-    """Create a Supabase client."""
-    return await create_async_client(
-        supabase_url=env.SUPABASE_INTERNAL_URL,
-        supabase_key=env.SUPABASE_KEY,
-        options=AsyncClientOptions(flow_type="pkce"),
-    )
+# One per Supabase URL, shared by the auth clients of all requests
+_http_clients: dict[str, httpx.AsyncClient] = {}
 
 
-async def create_public_client() -> AsyncClient:
-    """Create a Supabase client."""
-    return await create_async_client(
-        supabase_url=env.SUPABASE_PUBLIC_URL,
-        supabase_key=env.SUPABASE_KEY,
-        options=AsyncClientOptions(flow_type="pkce"),
+def get_http_client(supabase_url: str) -> httpx.AsyncClient:
+    """Get the client for a Supabase URL, so requests reuse kept-alive connections to GoTrue."""
+    if (client := _http_clients.get(supabase_url)) is None:
+        # As GoTrue would create it for itself
+        client = _http_clients[supabase_url] = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=120),
+        )
+
+    return client
+
+
+async def close_http_clients() -> None:
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _create_auth_client(supabase_url: str) -> ASupabaseAuthClient:
+    # The backend only ever uses Supabase Auth. A full client would also set up PostgREST, Storage and Realtime
+    # clients, and its own HTTP transport, for every request.
+    return ASupabaseAuthClient(
+        url=f"{supabase_url}/auth/v1",
+        headers={
+            "X-Client-Info": f"supabase-py/{__version__}",
+            "apiKey": env.SUPABASE_KEY,
+            "Authorization": f"Bearer {env.SUPABASE_KEY}",
+        },
+        # The session lives as long as the request, which makes a timer to refresh it leak the client until it fires
+        auto_refresh_token=False,
+        # Each request gets its own session and PKCE code verifier, only the transport is shared
+        storage=AsyncMemoryStorage(),
+        http_client=get_http_client(supabase_url),
+        flow_type="pkce",
     )
 
 
-async def get_code_verifier_from_client(client: AsyncClient) -> str:
+def create_internal_client() -> ASupabaseAuthClient:
+    """Create a Supabase Auth client for a single request, talking to Supabase over the internal network."""
+    return _create_auth_client(env.SUPABASE_INTERNAL_URL)
+
+
+def create_public_client() -> ASupabaseAuthClient:
+    """Create a Supabase Auth client for a single request, for URLs that are handed to the browser."""
+    return _create_auth_client(env.SUPABASE_PUBLIC_URL)
+
+
+async def get_code_verifier_from_client(client: ASupabaseAuthClient) -> str:
     """Get the code verifier from the client."""
-    storage = client.auth._storage  # noqa: SLF001
+    storage = client._storage  # noqa: SLF001
     code_verifier = await storage.get_item(f"{STORAGE_KEY}-code-verifier")
 
     if code_verifier is None:
@@ -57,22 +188,24 @@ async def get_code_verifier_from_client(client: AsyncClient) -> str:
     return code_verifier
 
 
-async def get_session(request: Request) -> AsyncClient:
-    """Get a Supabase client session."""
+@metrics.timed(metrics.upstream_calls, "supabase")
+async def get_session(request: Request) -> ASupabaseAuthClient:
+    """Get a Supabase Auth client with the request's session."""
     access_token = request.cookies.get(ACCESS_TOKEN_COOKIE_KEY)
     refresh_token = request.cookies.get(REFRESH_TOKEN_COOKIE_KEY)
 
     if access_token is None or refresh_token is None:
         raise HTTPException(status_code=401, detail="No session tokens found")
 
-    client = await create_internal_client()
-    await client.auth.set_session(access_token=access_token, refresh_token=refresh_token)
+    client = create_internal_client()
+    await client.set_session(access_token=access_token, refresh_token=refresh_token)
 
     return client
 
 
-async def get_github_identity(client: AsyncClient) -> UserIdentity:
-    user_identities = await client.auth.get_user_identities()
+@metrics.timed(metrics.upstream_calls, "supabase")
+async def get_github_identity(client: ASupabaseAuthClient) -> UserIdentity:
+    user_identities = await client.get_user_identities()
     if isinstance(user_identities, AuthSessionMissingError):
         raise HTTPException(status_code=401, detail="User not authenticated")
 
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+
+import psycopg
+from fastapi import HTTPException, Request
+from gotrue.errors import AuthError
+from psycopg import sql
+
+from . import feed, pg, sb
+
+# Notified with the username and time of every logout, see `pg.sessions_notify_logout`
+CHANNEL = "sessions_logged_out"
+RECONNECT_DELAY = 5.0
+# Logins can't be pushed to streams that don't know whose they'll be, these end this often for the browser to come back
+# with its new cookies, as often as the editor used to poll `/status`
+ANONYMOUS_STREAM_SECONDS = float(os.getenv("ANONYMOUS_SESSION_STREAM_SECONDS", "5"))
+
+
+@dataclass(frozen=True)
+class SessionState:
+    user_name: str | None
+    expires_at: float | None = None
+    # Set when GoTrue refreshed the session, the response has to pass the new tokens on as cookies
+    access_token: str | None = None
+    refresh_token: str | None = None
+
+    def encode_event(self) -> bytes:
+        data = json.dumps({"username": self.user_name, "logged_in": self.user_name is not None})
+        return f"event: session\ndata: {data}\n\n".encode()
+
+
+logger = logging.getLogger(__name__)
+
+# Woken when their user logs out, or with no user when the worker shuts down
+_subscribers: dict[str, set[asyncio.Event]] = {}
+_closing = False
+
+
+def get_stats() -> dict[str, int]:
+    return {"users": len(_subscribers), "streams": sum(len(events) for events in _subscribers.values())}
+
+
+async def resolve(request: Request) -> SessionState:
+    """Find out who is logged in from the request's cookies, only asking GoTrue when the access token can't be trusted.
+
+    Refreshes the session through GoTrue when its access token is about to expire.
+    """
+    access_token = request.cookies.get(sb.ACCESS_TOKEN_COOKIE_KEY)
+    if access_token is not None and (verified := sb.verify_access_token(access_token)) is not None:
+        return SessionState(user_name=verified.user_name, expires_at=verified.expires_at)
+
+    try:
+        client = await sb.get_session(request)
+        client_session = await client.get_session()
+        if client_session is None:
+            raise HTTPException(status_code=401, detail="User not authenticated")
+
+        gh_identity = await sb.get_github_identity(client)
+    except AuthError:
+        # E.g. a refresh token revoked by logging out elsewhere
+        return SessionState(user_name=None)
+    except HTTPException as e:
+        if e.status_code != 401:
+            raise
+
+        return SessionState(user_name=None)
+
+    return SessionState(
+        user_name=gh_identity.identity_data["user_name"],
+        expires_at=client_session.expires_at,
+        access_token=client_session.access_token,
+        refresh_token=client_session.refresh_token,
+    )
+
+
+def _wake(user_name: str) -> None:
+    for event in _subscribers.get(user_name, ()):
+        event.set()
+
+
+def close() -> None:
+    """End every open stream, e.g. so they don't hold up a graceful shutdown."""
+    global _closing
+
+    _closing = True
+    for user_name in list(_subscribers):
+        _wake(user_name)
+
+
+async def listen() -> None:
+    """Relay logouts through any worker to this worker's token checks and streams until cancelled."""
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(pg.get_conninfo(), autocommit=True)
+            async with conn:
+                await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(CHANNEL)))
+
+                async for notify in conn.notifies():
+                    logout = json.loads(notify.payload)
+                    sb.record_logout(logout["user_name"], logout["at"])
+                    _wake(logout["user_name"])
+        except psycopg.OperationalError:
+            await asyncio.sleep(RECONNECT_DELAY)
+        except Exception:
+            logger.exception("Relaying logouts failed, reconnecting")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+def _get_stream_end(state: SessionState) -> float | None:
+    if state.user_name is None:
+        return time.time() + ANONYMOUS_STREAM_SECONDS
+    if state.expires_at is not None:
+        return state.expires_at - sb.ACCESS_TOKEN_REFRESH_MARGIN
+    return None
+
+
+async def stream(state: SessionState) -> AsyncIterator[bytes]:
+    """Stream the login state as server-sent events, only sending anything when it changes.
+
+    The stream ends when the access token is due for a refresh, the browser's reconnect then refreshes it. Streams of
+    logged out users end every `ANONYMOUS_STREAM_SECONDS`, so a login in another tab shows up on reconnecting.
+    """
+    event = asyncio.Event()
+    if state.user_name is not None:
+        _subscribers.setdefault(state.user_name, set()).add(event)
+
+    try:
+        yield b"retry: 1000\n\n"
+        yield state.encode_event()
+
+        end_at = _get_stream_end(state)
+        while not _closing:
+            timeout = feed.HEARTBEAT_INTERVAL
+            if end_at is not None:
+                timeout = min(timeout, end_at - time.time())
+                if timeout <= 0:
+                    return
+
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+
+            if not _closing:
+                yield SessionState(user_name=None).encode_event()
+            return
+    finally:
+        if state.user_name is not None:
+            events = _subscribers.get(state.user_name, set())
+            events.discard(event)
+            if not events:
+                _subscribers.pop(state.user_name, None)
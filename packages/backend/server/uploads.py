@@ -0,0 +1,127 @@
+import hashlib
+import os
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import IO
+
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(os.getenv("PUBLISH_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Room for the boundaries, part headers and small form fields around the uploaded file
+MULTIPART_OVERHEAD = 16 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class Upload:
+    """A file uploaded to a temporary file, which is deleted when the `receive_file` block ends."""
+
+    file: IO[bytes]
+    size: int
+    sha256: str
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        self.file.seek(0)
+        while chunk := self.file.read(CHUNK_SIZE):
+            yield chunk
+
+
+class _FileFieldWriter:
+    """Parse a multipart body fed to it chunk by chunk, writing the contents of one field to `file`."""
+
+    def __init__(self, boundary: bytes, field_name: str, file: IO[bytes], max_bytes: int) -> None:
+        self.field_name = field_name.encode()
+        self.file = file
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.found = False
+
+        self._header_field = b""
+        self._header_value = b""
+        self._in_field = False
+        self._parser = MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_part_data": self._on_part_data,
+            },
+        )
+
+    def write(self, chunk: bytes) -> None:
+        self._parser.write(chunk)
+
+    def _on_part_begin(self) -> None:
+        self._in_field = False
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            _, options = parse_options_header(self._header_value)
+            # Only the first part with the name counts
+            self._in_field = options.get(b"name") == self.field_name and not self.found
+            self.found = self.found or self._in_field
+
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._in_field:
+            return
+
+        self.size += end - start
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload larger than {self.max_bytes} bytes")
+
+        chunk = data[start:end]
+        self.sha256.update(chunk)
+        self.file.write(chunk)
+
+
+@asynccontextmanager
+async def receive_file(request: Request, field_name: str, max_bytes: int = MAX_UPLOAD_BYTES) -> AsyncIterator[Upload]:
+    """Stream the file in a `multipart/form-data` field to a temporary file, hashing it on the way.
+
+    Only one chunk of the body is held in memory at a time, and the upload is rejected as soon as it goes over
+    `max_bytes`, instead of after it was read in full.
+    """
+    content_type, options = parse_options_header(request.headers.get("Content-Type"))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data upload")
+
+    max_body_bytes = max_bytes + MULTIPART_OVERHEAD
+    content_length = request.headers.get("Content-Length", "")
+    if content_length.isdigit() and int(content_length) > max_body_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload larger than {max_bytes} bytes")
+
+    with tempfile.TemporaryFile() as file:
+        writer = _FileFieldWriter(boundary, field_name, file, max_bytes)
+        received = 0
+        async for chunk in request.stream():
+            # Chunked requests have no Content-Length to check up front
+            received += len(chunk)
+            if received > max_body_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload larger than {max_bytes} bytes")
+
+            try:
+                writer.write(chunk)
+            except MultipartParseError as e:
+                raise HTTPException(status_code=400, detail="Malformed multipart upload") from e
+
+        if not writer.found:
+            raise HTTPException(status_code=422, detail=f"No {field_name} uploaded")
+
+        yield Upload(file=file, size=writer.size, sha256=writer.sha256.hexdigest())
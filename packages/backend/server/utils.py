@@ -1,4 +1,7 @@
+import asyncio
 import os
+from collections.abc import Coroutine
+from typing import Any
 
 
 def assure_get_env(var: str) -> str:
@@ -8,3 +11,15 @@ def assure_get_env(var: str) -> str:
         msg = f"Environment variable '{var}' is not set."
         raise OSError(msg)
     return value
+
+
+async def gather_or_cancel(*coroutines: Coroutine[Any, Any, Any]) -> list[Any]:
+    """Run the coroutines concurrently, cancelling the others as soon as one fails and raising its error as is."""
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(coroutine) for coroutine in coroutines]
+    except BaseExceptionGroup as group:
+        # The first error to happen, any others are from tasks failing at the same time
+        raise group.exceptions[0] from None
+
+    return [task.result() for task in tasks]
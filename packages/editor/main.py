@@ -5,9 +5,13 @@ import random
 
 from nicegui import app, ui
 from nicegui.client import Client
-from nicegui.events import UploadEventArguments, ValueChangeEventArguments
+from nicegui.events import GenericEventArguments, UploadEventArguments, ValueChangeEventArguments
 
 SPIN_COUNT = 10
+# Seconds between checks on a queued publish
+PUBLISH_POLL_INTERVAL = 2.0
+# Seconds after which a publish is given up on, about as long as the backend takes through all of its retries
+PUBLISH_POLL_TIMEOUT = 15 * 60.0
 
 HEX = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "A", "B", "C", "D", "E", "F"]
 
@@ -271,7 +275,7 @@ async def index(client: Client) -> None:  # noqa: C901, PLR0915 All of the below
         """Fetch the API and publish the canvas."""
         ui.notify("Publishing...")
         try:
-            response_ok = await ui.run_javascript(
+            result = await ui.run_javascript(
                 """
                 const format = "image/webp";
                 const quality = 0.7;  // 70%
@@ -280,7 +284,7 @@ async def index(client: Client) -> None:  # noqa: C901, PLR0915 All of the below
                 const blob = await new Promise((r) => canvas.toBlob(r, format, quality));
 
                 if (blob === null) {
-                    return false;
+                    return null;
                 }
 
                 // Use FormData so FastAPI can read it as UploadFile
@@ -295,15 +299,66 @@ async def index(client: Client) -> None:  # noqa: C901, PLR0915 All of the below
                     },
                 ).catch((e) => console.error(e));
 
-                return response.ok;
+                if (response?.status === 429) {
+                    return { retry_after: Number(response.headers.get("Retry-After")) };
+                }
+
+                // Refused before queueing a job, e.g. without the GitHub App installed
+                if (response?.status === 404) {
+                    return { error: (await response.json())["detail"] };
+                }
+
+                if (!response?.ok) {
+                    return null;
+                }
+
+                return { job_id: (await response.json())["job_id"] };
                 """,
-                timeout=300,
+                timeout=60,
             )
 
-            if not response_ok:
+            if result is None:
                 ui.notify("Failed to publish!", type="negative")
                 return
 
+            if "retry_after" in result:
+                minutes = max(1, round(result["retry_after"] / 60))
+                ui.notify(f"You can only upload 5 images an hour, try again in {minutes} min", type="warning")
+                return
+
+            if "error" in result:
+                ui.notify(f"Failed to publish: {result['error']}", type="negative")
+                return
+
+            job_id = result["job_id"]
+
+            # The backend publishes in the background, wait for it to finish
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + PUBLISH_POLL_TIMEOUT
+            while loop.time() < deadline:
+                await asyncio.sleep(PUBLISH_POLL_INTERVAL)
+                job = await ui.run_javascript(
+                    f"""
+                    response = await fetch(
+                        "/api/publish/{job_id}",
+                        {{ method: "GET" }},
+                    ).catch((e) => console.error(e));
+
+                    return response?.ok ? await response.json() : null;
+                    """,
+                    timeout=30,
+                )
+
+                if job is not None and job["status"] in ("succeeded", "failed"):
+                    break
+            else:
+                ui.notify("Publishing took too long, it may still show up in the gallery later", type="negative")
+                return
+
+            if job["status"] == "failed":
+                ui.notify(f"Failed to publish: {job['error']}", type="negative")
+                return
+
             ui.notify("Artwork published successfully!", type="positive")
 
         except Exception as e:  # noqa: BLE001
@@ -376,41 +431,35 @@ async def index(client: Client) -> None:  # noqa: C901, PLR0915 All of the below
         except Exception as e:
             ui.notify(f"An error occurred: {e}", type="negative")
 
-    async def check_login_status() -> None:
-        try:
-            response = await ui.run_javascript(
-                """
-                response = await fetch(
-                    "/api/status",
-                    { method: "GET" },
-                ).catch((e) => console.error(e));
-
-                response_json = response.json();
-
-                sessionStorage.setItem("cj12-hhh-logged-in", response_json['logged_in']);
-
-                return response_json;
-                """,
-                timeout=60,
-            )
-
-            if response["logged_in"]:
-                username.set_text(response["username"])
-                register_button.move(hidden_buttons)
-                login_button.move(hidden_buttons)
+    def show_login_status(event: GenericEventArguments) -> None:
+        if event.args["logged_in"]:
+            username.set_text(event.args["username"])
+            register_button.move(hidden_buttons)
+            login_button.move(hidden_buttons)
 
-                publish_button.move(shown_buttons)
-                logout_button.move(shown_buttons)
-            else:
-                username.set_text("")
-                register_button.move(shown_buttons)
-                login_button.move(shown_buttons)
+            publish_button.move(shown_buttons)
+            logout_button.move(shown_buttons)
+        else:
+            username.set_text("")
+            register_button.move(shown_buttons)
+            login_button.move(shown_buttons)
 
-                publish_button.move(hidden_buttons)
-                logout_button.move(hidden_buttons)
+            publish_button.move(hidden_buttons)
+            logout_button.move(hidden_buttons)
 
-        except Exception as e:
-            ui.notify(f"An error occurred: {e}", type="negative")
+    def subscribe_to_login_status() -> None:
+        # The backend sends the login state once and then only when it changes, e.g. on logging out in another tab.
+        # The browser reconnects on its own, which also refreshes the session when the access token is about to expire.
+        ui.run_javascript("""
+            if (!window.hhhSessionSource) {
+                window.hhhSessionSource = new EventSource("/api/session/stream");
+                window.hhhSessionSource.addEventListener("session", (event) => {
+                    const session = JSON.parse(event.data);
+                    sessionStorage.setItem("cj12-hhh-logged-in", session.logged_in);
+                    emitEvent("session_changed", session);
+                });
+            }
+        """)
 
     ui.add_head_html("""
         <link rel="stylesheet" href="https://pyscript.net/releases/2024.1.1/core.css">
@@ -615,8 +664,8 @@ async def index(client: Client) -> None:  # noqa: C901, PLR0915 All of the below
         publish_button.move(shown_buttons)
         logout_button.move(shown_buttons)
 
-    ui.on("content_loaded", check_login_status)
-    ui.timer(5.0, check_login_status)
+    ui.on("session_changed", show_login_status)
+    ui.on("content_loaded", subscribe_to_login_status)
 
 
 if __name__ in {"__main__", "__mp_main__"}:
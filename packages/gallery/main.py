@@ -64,7 +64,12 @@ ROOMS: list[THREE.Group] = []  # a list of all rooms in the scene
 PAINTINGS: list[THREE.Object3D] = []  # a list of all the paintings in the scene
 LOADED_ROOMS: list[THREE.Group] = []  # a list of all the rooms that are currently loaded
 IMAGES_LIST: list[str] = []  # a list of the names of the paintings that have to be loaded in order
+ARTWORKS_CURSOR: int = 0  # id of the last artwork received from the backend, only newer ones are requested
 LOADED_SLOTS: list[int] = []  # a list of all slots that have been loaded
+MANIFESTS: dict[str, dict[int, str]] = {}  # the smaller copies of each painting, by the length of their longest side
+SLOT_PLANES: dict[int, THREE.Mesh] = {}  # the plane showing each loaded slot
+LOADED_LEVELS: dict[int, float] = {}  # the longest side of the texture loaded (or loading) in each slot, inf if full
+UPGRADE_INTERVAL = 0.5  # seconds between checks for paintings that came close enough to need a sharper texture
 
 # Related to Moving
 RUN_STATE: bool = False  # to toggle running
@@ -143,6 +148,23 @@ def get_painting_info(p: THREE.Mesh) -> tuple[V3, V3, V2]:
     return (position, normal, size_wh)
 
 
+def pick_level(slot: int, position: V3) -> tuple[float, str]:
+    """Pick the smallest copy of a painting that is still sharp at its current distance, and its longest side."""
+    image_loc = IMAGES_LIST[slot]
+    levels = MANIFESTS.get(image_loc, {})
+
+    distance = max(CAMERA.position.distanceTo(THREE.Vector3.new(*position)), 0.01)
+    # On-screen height of a unit at that distance, in device pixels, times the longest side of the plane
+    view_height = 2 * distance * Math.tan(CAMERA.fov * Math.PI / 360)
+    needed = 1.414 / view_height * window.innerHeight * window.devicePixelRatio
+
+    for size in sorted(levels):
+        if size >= needed:
+            return size, levels[size]
+
+    return float("inf"), image_loc
+
+
 def get_player_chunk(room_apothem: float) -> tuple[int, int]:
     x_coord = round((CAMERA.position.x) / (room_apothem * 2))
     z_coord = round((CAMERA.position.z) / (room_apothem * 2))
@@ -392,12 +414,15 @@ def load_image(slot: int):
             f"WARNING: slot to be accessed '{slot}' is greater than the maximum available "
             f"one '{len(PAINTINGS) - 1}'. The image will not be loaded."
         )
+        return
 
     if slot >= len(IMAGES_LIST):
         # this slot does not have a corresponding painting yet
         return
 
-    image_loc = IMAGES_LIST[slot]
+    (x, y, z), (nx, ny, nz), (w, h) = get_painting_info(PAINTINGS[slot])
+    level, image_loc = pick_level(slot, (x, y, z))
+    LOADED_LEVELS[slot] = level
     textureLoader = THREE.TextureLoader.new()
 
     def inner_loader(loaded_obj):
@@ -414,7 +439,6 @@ def load_image(slot: int):
         plane.scale.x = 1.414
 
         # Snap the plane to its slot
-        (x, y, z), (nx, ny, nz), (w, h) = get_painting_info(PAINTINGS[slot])
         plane.position.set(x, y, z)
 
         q = THREE.Quaternion.new()
@@ -425,6 +449,7 @@ def load_image(slot: int):
         plane.name = f"picture_{PAINTINGS[slot].parent.parent.name[5:]}_{slot:03d}"
         PICTURES.add(plane)
         LOADED_SLOTS.append(slot)
+        SLOT_PLANES[slot] = plane
 
     try:
         textureLoader.load(
@@ -437,15 +462,63 @@ def load_image(slot: int):
         console.error(e)
 
 
+def upgrade_textures() -> None:
+    """Swap in sharper copies for visible paintings the player walked up to, loaded ones are never downgraded."""
+    for slot, plane in SLOT_PLANES.items():
+        if not plane.visible:
+            continue
+
+        p = plane.position
+        level, image_loc = pick_level(slot, (p.x, p.y, p.z))
+        if level <= LOADED_LEVELS[slot]:
+            continue
+
+        LOADED_LEVELS[slot] = level
+
+        def inner_loader(loaded_obj, plane=plane):
+            old_texture = plane.material.map
+            plane.material.map = loaded_obj
+            plane.material.needsUpdate = True
+            old_texture.dispose()
+
+        THREE.TextureLoader.new().load(
+            REPO_URL + image_loc,
+            create_proxy(inner_loader),
+            None,
+            create_proxy(lambda _: None),
+        )
+
+
+def add_manifest(data: dict) -> None:
+    # JSON object keys are always strings
+    for img, levels in data.get("manifest", {}).items():
+        MANIFESTS[img] = {int(size): level_loc for size, level_loc in levels.items()}
+
+
 async def load_images_from_listing() -> int:
+    global ARTWORKS_CURSOR
+
+    n_existing_images = len(IMAGES_LIST)
+
     if USE_LOCALHOST:
         r = await pyfetch("./assets/test-image-listing.json")
-    else:
-        r = await pyfetch("https://localhost/api/artworks")
-    data = await r.text()
-    n_existing_images = len(IMAGES_LIST)
-    for username, img in json.loads(data)["artworks"][n_existing_images:]:
-        IMAGES_LIST.append(img)
+        data = await r.text()
+        for username, img in json.loads(data)["artworks"][n_existing_images:]:
+            IMAGES_LIST.append(img)
+
+        return len(IMAGES_LIST) - n_existing_images
+
+    # Only the artworks published since the last fetch are sent, page through them until caught up
+    has_more = True
+    while has_more:
+        r = await pyfetch(f"https://localhost/api/artworks?after_id={ARTWORKS_CURSOR}&limit=500")
+        data = json.loads(await r.text())
+        for username, img in data["artworks"]:
+            IMAGES_LIST.append(img)
+        add_manifest(data)
+
+        ARTWORKS_CURSOR = data["cursor"]
+        has_more = data["has_more"]
 
     n_added_images = len(IMAGES_LIST) - n_existing_images
 
@@ -658,24 +731,39 @@ async def load_gallery() -> None:
     await clone_rooms(layout_points, layout, apothem)
 
 
-async def image_query_loop():
+async def show_new_images(n_added_images: int) -> None:
     apothem = get_room_apothem()
-    while True:
-        await asyncio.sleep(15)
+    chunk_x, chunk_z = get_player_chunk(apothem)
+    print(f"New images to be added: {n_added_images}")
+    await updated_loaded_rooms(
+        SCENE.getObjectByName(f"room_{chunk_x}_{chunk_z}"),
+        force_reload=True,
+        r=3,  # A slightly bigger radius, just in case
+    )
+
+
+def on_artworks_event(event) -> None:
+    global ARTWORKS_CURSOR
+
+    data = json.loads(event.data)
+    for username, img in data["artworks"]:
+        IMAGES_LIST.append(img)
+    add_manifest(data)
+    ARTWORKS_CURSOR = data["cursor"]
+
+    if data["artworks"]:
+        asyncio.ensure_future(show_new_images(len(data["artworks"])))
 
-        # Might error out because of downtime, no big deal
-        try:
-            n_added_images = await load_images_from_listing()
-            if n_added_images:
-                chunk_x, chunk_z = get_player_chunk(apothem)
-                print(f"New images to be added: {n_added_images}")
-                await updated_loaded_rooms(
-                    SCENE.getObjectByName(f"room_{chunk_x}_{chunk_z}"),
-                    force_reload=True,
-                    r=3,  # A slightly bigger radius, just in case
-                )
-        except Exception:
-            ...
+
+def subscribe_to_new_images() -> None:
+    if USE_LOCALHOST:
+        # The test listing is static, there is nothing to subscribe to
+        return
+
+    # The backend pushes new artworks as they are published, the browser reconnects on its own after downtime and
+    # resumes from the last event it received
+    source = window.EventSource.new(f"https://localhost/api/artworks/stream?after_id={ARTWORKS_CURSOR}")
+    source.addEventListener("artworks", create_proxy(on_artworks_event))
 
 
 def tp_to_slot(slot: int) -> None:
@@ -722,14 +810,21 @@ async def main():
 
     asyncio.ensure_future(updated_loaded_rooms(SCENE.getObjectByName("room_0_0")))
 
-    asyncio.ensure_future(image_query_loop())
+    subscribe_to_new_images()
 
     # TP camera
     url_process()
 
     clock = THREE.Clock.new()
+    since_upgrade = 0.0
     while True:
         delta = clock.getDelta()
+
+        since_upgrade += delta
+        if since_upgrade >= UPGRADE_INTERVAL:
+            since_upgrade = 0.0
+            upgrade_textures()
+
         velocity = move_character(delta)
         if velocity == THREE.Vector3.new(0, 0, 0):
             continue